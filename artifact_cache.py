@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+# Bump whenever prepare_data changes what it writes, so old entries stop matching
+PIPELINE_VERSION = 1
+
+DEFAULT_BUDGET_MB = 2048
+ENTRY_FILE = "entry.json"
+
+
+def cache_key(params):
+    """Stable hash of everything that determines the prepared artifacts."""
+    payload = dict(params, pipeline_version=PIPELINE_VERSION)
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _entry_size(entry_dir):
+    return sum(f.stat().st_size for f in entry_dir.iterdir() if f.is_file())
+
+
+def lookup(cache_dir, key):
+    """Return the entry directory for `key`, marking it as just used, or None."""
+    entry_dir = Path(cache_dir) / key
+    entry_file = entry_dir / ENTRY_FILE
+    if not entry_file.exists():
+        return None
+    # The entry file's mtime doubles as the LRU timestamp
+    try:
+        os.utime(entry_file)
+    except OSError:
+        return None
+    return entry_dir
+
+
+def restore(entry_dir, targets):
+    """Copy cached files back out. `targets` maps cached file name -> destination path."""
+    for name, target in targets.items():
+        shutil.copyfile(Path(entry_dir) / name, target)
+
+
+def store(cache_dir, key, files, params=None, budget_mb=DEFAULT_BUDGET_MB):
+    """Add an entry from `files` (cached file name -> source path), then evict down to the budget.
+
+    The entry is assembled in a scratch directory and renamed into place, so
+    a concurrent lookup sees either the complete entry or none at all.
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    entry_dir = cache_dir / key
+    if (entry_dir / ENTRY_FILE).exists():
+        return entry_dir
+
+    tmp_dir = cache_dir / f".{key}.{uuid.uuid4().hex}.tmp"
+    tmp_dir.mkdir()
+    try:
+        for name, source in files.items():
+            shutil.copyfile(source, tmp_dir / name)
+        with open(tmp_dir / ENTRY_FILE, 'w', encoding='utf-8') as f:
+            json.dump({"key": key, "params": params or {}, "created": time.time()}, f,
+                      indent=2, ensure_ascii=False)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Another job stored the same key first; keep theirs
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    evict(cache_dir, budget_mb)
+    return entry_dir
+
+
+def evict(cache_dir, budget_mb=DEFAULT_BUDGET_MB):
+    """Remove least-recently-used entries until the cache fits in `budget_mb`."""
+    cache_dir = Path(cache_dir)
+    entries = []
+    for entry_dir in cache_dir.iterdir():
+        entry_file = entry_dir / ENTRY_FILE
+        if entry_dir.name.startswith(".") or not entry_file.exists():
+            continue
+        try:
+            entries.append((entry_file.stat().st_mtime, _entry_size(entry_dir), entry_dir))
+        except OSError:
+            continue
+
+    budget = budget_mb * 1024 * 1024
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry_dir in sorted(entries, key=lambda e: e[0]):
+        if total <= budget:
+            break
+        print(f"Evicting cached artifacts {entry_dir.name[:12]} ({size / 1024 / 1024:.1f} MB)")
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total -= size
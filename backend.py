@@ -1,5 +1,7 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
+import atexit
+import functools
 import json
 import subprocess
 import os
@@ -7,6 +9,19 @@ from pathlib import Path
 import threading
 import time
 import sys
+import hashlib
+import shutil
+
+import batch
+import history_store
+import image_variants
+import prepare_data
+import preview
+import progress
+import render_profiles
+from jobs import JobManager
+from prepare_worker import PreparePool
+from render_protocol import RenderServerProcess
 
 app = Flask(__name__)
 CORS(app)
@@ -18,14 +33,77 @@ PYTHON_EXE = ".\\venv\\Scripts\\python.exe"
 if not os.path.exists(PYTHON_EXE):
     PYTHON_EXE = sys.executable
 BLENDER_EXE = r"C:\Program Files\Blender Foundation\Blender 5.0\blender.exe"
+# Every job prepares and renders in its own jobs/<id>/ directory
+JOBS_DIR = Path("jobs")
+RENDER_CACHE_DIR = OUTPUT_DIR / "cache"
+# Least-recently-used cached renders are evicted beyond this size
+RENDER_CACHE_MB = int(os.environ.get("ANYMAPS_RENDER_CACHE_MB", 2048))
 
-# Global state for job tracking
-current_job = {
-    "status": "idle",  # idle, preparing, rendering, complete, error
-    "message": "",
-    "current_file": None
+# Render settings and the defaults render_map.py falls back to
+RENDER_DEFAULTS = {
+    "z_scale": 3.5,
+    "sun_angle": 25,
+    "render_profile": "standard",
+    "render_device": "auto",
+    "mesh_mode": "displace",
+    # None: the profile decides
+    "render_samples": None,
+    "render_resolution": None,
+    "render_threads": None,
+    "show_text": True,
+    "colors": {},
 }
 
+# Concurrency limits for the two pipeline stages
+PREPARE_WORKERS = int(os.environ.get("ANYMAPS_PREPARE_WORKERS", 2))
+RENDER_WORKERS = int(os.environ.get("ANYMAPS_RENDER_WORKERS", 1))
+
+# "pool" runs preparation in warm worker processes, "subprocess" starts prepare_data.py per job
+PREPARE_MODE = os.environ.get("ANYMAPS_PREPARE_MODE", "pool")
+
+# "server" keeps a Blender process per render worker running render_server.py,
+# "subprocess" starts Blender per job, "fake" serves the same protocol without Blender
+RENDER_MODE = os.environ.get("ANYMAPS_RENDER_MODE", "server")
+
+# Browsers may reuse an image this long before revalidating it with its ETag
+IMAGE_MAX_AGE = 60
+
+# Comment line sent on idle event streams so proxies keep the connection open
+SSE_KEEPALIVE_SECONDS = 15
+
+def write_json(path, payload):
+    # Written aside and renamed so concurrent requests never leave a torn file
+    tmp_path = Path(f"{path}.{os.getpid()}.{time.time_ns()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def hash_json(payload):
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+def render_params(config):
+    return {key: config.get(key, default) for key, default in RENDER_DEFAULTS.items()}
+
+def request_key(config):
+    """Identifies identical generate requests so they can share one job."""
+    return hash_json({
+        "location_name": config.get("location_name"),
+        "location_type": config.get("location_type", "country"),
+        "parent_country": config.get("parent_country"),
+        "prepare": prepare_data.prepare_options(config),
+        "render": render_params(config),
+    })
+
+def render_key(metadata, config):
+    """Hash of everything the final image depends on: prepared data plus render settings."""
+    # The metadata names the mesh file but not the settings it was built with
+    return hash_json({
+        "metadata": metadata,
+        "prepare": prepare_data.prepare_options(config),
+        "render": render_params(config),
+    })
+
 @app.route('/api/config', methods=['GET', 'POST'])
 def handle_config():
     if request.method == 'GET':
@@ -45,32 +123,99 @@ def handle_config():
     
     elif request.method == 'POST':
         data = request.json
-        with open(CONFIG_PATH, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
+        write_json(CONFIG_PATH, data)
         return jsonify({"success": True})
 
-@app.route('/api/generate', methods=['POST'])
-def generate_map():
-    global current_job
-    
-    if current_job["status"] in ["preparing", "rendering"]:
-        return jsonify({"error": "Job already running"}), 400
+def submit_job(data):
+    # Only remembers the last form for /api/config, jobs read their own copy
+    write_json(CONFIG_PATH, data)
+    job, created = job_manager.submit(data, request_key=request_key(data))
+    if created:
+        print(f"[{job.id}] Queued {data.get('location_name')}")
+    return job, created
+
+@app.route('/api/jobs', methods=['GET', 'POST'])
+def handle_jobs():
+    if request.method == 'GET':
+        return jsonify([job.to_dict() for job in job_manager.list()])
     
-    data = request.json
+    job, created = submit_job(request.json)
+    # An identical job already in flight is shared rather than run twice
+    return jsonify({"job_id": job.id, "attached": not created, "job": job.to_dict()}), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/preview', methods=['GET'])
+def get_job_preview(job_id):
+    job = job_manager.get(job_id)
+    if job is None or not job.preview:
+        return jsonify({"error": "Preview not available"}), 404
+    # Removed with the job directory once the final render is published
+    path = job_dir(job) / job.preview
+    if not path.exists():
+        return jsonify({"error": "Preview not available"}), 404
+    return send_file(path, mimetype='image/png', max_age=0)
+
+def sse_event(seq, payload):
+    return f"id: {seq}\nevent: job\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-Sent Events: one `job` event per state change or progress line, until the job ends."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
     
-    # Save config
-    with open(CONFIG_PATH, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
+    last_id = request.headers.get("Last-Event-ID", "")
+    resume_from = int(last_id) if last_id.isdigit() else None
     
-    # Start generation in background
-    thread = threading.Thread(target=run_generation)
-    thread.start()
+    def stream():
+        after = resume_from
+        if after is None:
+            # New subscriber: start from the current state rather than replaying history
+            snapshot = job.snapshot()
+            after = snapshot["seq"]
+            yield sse_event(after, dict(snapshot, event="snapshot"))
+        
+        while job.active or job.seq > after:
+            events = job.wait_events(after, SSE_KEEPALIVE_SECONDS)
+            if not events:
+                yield ": keepalive\n\n"
+                continue
+            for seq, event in events:
+                yield sse_event(seq, event)
+                after = seq
     
-    return jsonify({"success": True, "message": "Generation started"})
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(stream()), mimetype="text/event-stream", headers=headers)
 
-def run_process_with_logging(command, stage_name):
-    global current_job
-    current_job["status"] = stage_name
+@app.route('/api/generate', methods=['POST'])
+def generate_map():
+    job, created = submit_job(request.json)
+    message = "Generation started" if created else "Attached to running job"
+    return jsonify({"success": True, "message": message, "job_id": job.id})
+
+def handle_output_line(job, stage_name, line, echo=True):
+    line = line.strip()
+    if not line:
+        return
+    event = progress.parse(line)
+    if event is not None:
+        job.record_progress(event)
+        if line.startswith("{"):
+            # Structured event, nothing to show as a message
+            return
+    job.update(message=line)
+    if echo:
+        print(f"[{job.id} {stage_name}] {line}")
+
+def run_process_with_logging(job, command, stage_name):
+    job.update(stage_name)
     
     try:
         process = subprocess.Popen(
@@ -84,101 +229,379 @@ def run_process_with_logging(command, stage_name):
         
         # Read stdout line by line
         for line in process.stdout:
-            line = line.strip()
-            if line:
-                current_job["message"] = line
-                print(f"[{stage_name}] {line}")
+            handle_output_line(job, stage_name, line)
         
         # Determine success
         stdout, stderr = process.communicate()
         if process.returncode != 0:
-            current_job["status"] = "error"
             # Prefer stderr if available, otherwise use last message
             error_msg = stderr.strip() if stderr else "Unknown error"
-            current_job["message"] = f"{stage_name} failed: {error_msg}"
-            print(f"[{stage_name} ERROR] {stderr}")
+            job.update("error", f"{stage_name} failed: {error_msg}")
+            print(f"[{job.id} {stage_name} ERROR] {stderr}")
             return False
             
         return True
         
     except Exception as e:
-        current_job["status"] = "error"
-        current_job["message"] = f"Error in {stage_name}: {str(e)}"
-        print(f"[{stage_name} EXCEPTION] {e}")
+        job.update("error", f"Error in {stage_name}: {str(e)}")
+        print(f"[{job.id} {stage_name} EXCEPTION] {e}")
         return False
 
-def run_generation():
-    global current_job
+prepare_pool = None
+prepare_pool_lock = threading.Lock()
+
+def get_prepare_pool():
+    # Created on first use: spawned workers re-import this module and must not start pools of their own
+    global prepare_pool
+    with prepare_pool_lock:
+        if prepare_pool is None:
+            prepare_pool = PreparePool(PREPARE_WORKERS)
+        return prepare_pool
+
+history = None
+history_lock = threading.Lock()
+
+def get_history_store():
+    # Opened and reconciled with output/ on first use (at startup when run as a server)
+    global history
+    with history_lock:
+        if history is None:
+            history = history_store.HistoryStore(OUTPUT_DIR / history_store.DB_NAME)
+            added, updated, removed = history.reconcile(OUTPUT_DIR)
+            print(f"History: {added} renders added, {updated} updated, {removed} removed")
+        return history
+
+render_servers = []
+idle_render_servers = []
+render_servers_lock = threading.Lock()
+
+def render_server_command():
+    if RENDER_MODE == "fake":
+        return [PYTHON_EXE, "render_server.py", "--fake"]
+    return [BLENDER_EXE, "--background", "--python", "render_server.py"]
+
+def render_on_server(job, workdir):
+    # At most RENDER_WORKERS renders run at once, so at most that many servers get started
+    with render_servers_lock:
+        if idle_render_servers:
+            server = idle_render_servers.pop()
+        else:
+            server = RenderServerProcess(render_server_command())
+            render_servers.append(server)
     
     try:
-        # Step 1: Prepare Data
-        current_job["message"] = "Starting data preparation..."
+        result = server.render(workdir, job_id=job.id,
+                               on_line=lambda line: handle_output_line(job, "rendering", line),
+                               timeout=render_profiles.resolve(job.config)["timeout"])
+    except Exception as e:
+        job.update("error", f"rendering failed: {e}")
+        print(f"[{job.id} rendering ERROR] {e}")
+        return False
+    finally:
+        with render_servers_lock:
+            idle_render_servers.append(server)
+    
+    if not result.get("ok"):
+        job.update("error", f"rendering failed: {result.get('error')}")
+        return False
+    return True
+
+@atexit.register
+def stop_render_servers():
+    for server in render_servers:
+        server.close()
+
+def job_dir(job):
+    return (JOBS_DIR / job.id).resolve()
+
+def prepare_job(job, location=None, mosaic_path=None):
+    workdir = job_dir(job)
+    workdir.mkdir(parents=True, exist_ok=True)
+    write_json(workdir / "config.json", job.config)
+    
+    # Step 1: Prepare Data
+    # Batch locations come with their geometry and group mosaic, which only the pool can hand over
+    if PREPARE_MODE == "pool" or mosaic_path is not None:
+        try:
+            success = get_prepare_pool().run(job.config, workdir, lambda line: handle_output_line(job, "preparing", line),
+                                             location=location, mosaic_path=mosaic_path)
+        except Exception as e:
+            job.update("error", f"preparing failed: {e}")
+            print(f"[{job.id} preparing ERROR] {e}")
+            return False
+    else:
         success = run_process_with_logging(
-            [PYTHON_EXE, "-u", "prepare_data.py"], 
+            job,
+            [PYTHON_EXE, "-u", "prepare_data.py", "--job-dir", str(workdir)], 
             "preparing"
         )
+    
+    if success:
+        publish_preview(job, workdir)
+    return success
+
+def publish_preview(job, workdir):
+    # Something to look at while the render waits; a failure here never fails the job
+    try:
+        z_scale = job.config.get("z_scale", RENDER_DEFAULTS["z_scale"])
+        preview_path = preview.make_preview(workdir, z_scale=z_scale)
+    except Exception as e:
+        print(f"[{job.id} preview ERROR] {e}")
+        return
+    job.update(preview=preview_path.name)
+
+def evict_render_cache(budget_mb=RENDER_CACHE_MB):
+    """Remove least-recently-used cached renders until the cache fits in `budget_mb`."""
+    entries = []
+    for path in RENDER_CACHE_DIR.glob("*.png"):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        # A hit touches the file, so its mtime is the last use
+        entries.append((stat.st_mtime, stat.st_size, path))
+    
+    budget = budget_mb * 1024 * 1024
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries, key=lambda e: e[0]):
+        if total <= budget:
+            break
+        print(f"Evicting cached render {path.stem[:12]} ({size / 1024 / 1024:.1f} MB)")
+        path.unlink(missing_ok=True)
+        total -= size
+
+def render_job(job):
+    started = time.time()
+    config = job.config
+    workdir = job_dir(job)
+    with open(workdir / "metadata.json", 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+    
+    location_name = config.get("location_name", "")
+    key = render_key(metadata, config)
+    # Named after the key too, so jobs for one location with different settings keep their own files
+    render_name = f"{location_name}_{key[:8]}{history_store.RENDER_SUFFIX}"
+    output_file = OUTPUT_DIR / render_name
+    cached_file = RENDER_CACHE_DIR / f"{key}.png"
+    OUTPUT_DIR.mkdir(exist_ok=True)
+    
+    tmp_file = output_file.with_name(f"{render_name}.{job.id}.tmp")
+    try:
+        shutil.copyfile(cached_file, tmp_file)
+        os.utime(cached_file)
+        os.replace(tmp_file, output_file)
+        cache_hit = True
+    except FileNotFoundError:
+        # Never rendered, or evicted meanwhile
+        tmp_file.unlink(missing_ok=True)
+        cache_hit = False
+    if cache_hit:
+        # Identical render already exists, skip Blender entirely
+        print(f"[{job.id} rendering] Render cache hit: {cached_file.name}")
+    else:
+        # Step 2: Render (render_map.py writes into the job directory)
+        if RENDER_MODE == "subprocess":
+            success = run_process_with_logging(
+                job,
+                [BLENDER_EXE, "--background", "--python", "render_map.py", "--", "--job-dir", str(workdir)], 
+                "rendering"
+            )
+        else:
+            success = render_on_server(job, workdir)
         
         if not success:
-            return
-        
-        # Step 2: Render
-        current_job["message"] = "Starting Blender render..."
-        success = run_process_with_logging(
-            [BLENDER_EXE, "--background", "--python", "render_map.py"], 
-            "rendering"
-        )
-        
-        if not success:
-            return
+            return False
         
-        # Check result
-        with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-            config = json.load(f)
+        job_render = workdir / f"{location_name}_render.png"
+        if not job_render.exists():
+            job.update("error", f"Render file not found at {job_render}")
+            return False
         
-        location_name = config.get("location_name", "")
-        # The render script outputs to OUTPUT_DIR
-        output_file = OUTPUT_DIR / f"{location_name}_render.png"
+        RENDER_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_file = cached_file.with_suffix(f".{job.id}.tmp")
+        shutil.copyfile(job_render, tmp_file)
+        os.replace(tmp_file, cached_file)
+        evict_render_cache()
         
-        if output_file.exists():
-            current_job["status"] = "complete"
-            current_job["message"] = "Map generated successfully!"
-            current_job["current_file"] = f"{location_name}_render.png"
-        else:
-            current_job["status"] = "error"
-            current_job["message"] = f"Render file not found at {output_file}"
-            
+        # Publish into the shared output folder the history reads from
+        os.replace(job_render, output_file)
+        job_scene = workdir / f"{location_name}_scene.blend"
+        if job_scene.exists():
+            os.replace(job_scene, OUTPUT_DIR / f"{location_name}_{key[:8]}_scene.blend")
+    
+    # Thumbnails for the history; a failure here never fails the job, /api/image retries
+    try:
+        image_variants.generate_all(output_file)
+    except Exception as e:
+        print(f"[{job.id} variants ERROR] {e}")
+    try:
+        get_history_store().record(output_file, config, render_params(config),
+                             prepare_seconds=job.timings.get("preparing"),
+                             render_seconds=time.time() - started,
+                             cached=cache_hit, job_id=job.id)
+    except Exception as e:
+        print(f"[{job.id} history ERROR] {e}")
+    
+    # The job directory only held intermediates; failed jobs keep theirs for inspection
+    shutil.rmtree(workdir, ignore_errors=True)
+    job.update("complete", "Map generated successfully!", render_name)
+    return True
+
+job_manager = JobManager(prepare_job, render_job, PREPARE_WORKERS, RENDER_WORKERS)
+
+batches = {}
+batches_lock = threading.Lock()
+
+def run_batch_jobs(batch_id, jobs, base_config):
+    """Fetch a batch's tiles and build its mosaics in a prepare worker, then queue each location.
+    
+    Runs in a prepare slot, and every location then takes its own, so a batch
+    stays within ANYMAPS_PREPARE_WORKERS like single jobs do.
+    """
+    batch_dir = (JOBS_DIR / f"batch-{batch_id}").resolve()
+    for job in jobs:
+        job.start_stage("preparing", "Fetching tiles with the rest of the batch...")
+    
+    def on_line(line):
+        for job in jobs:
+            handle_output_line(job, "preparing", line, echo=False)
+        if not line.startswith("{"):
+            print(f"[batch {batch_id}] {line}")
+    
+    try:
+        tasks, errors = get_prepare_pool().call(
+            batch.plan_batch, ([job.config for job in jobs], base_config, str(batch_dir)), on_line
+        )
     except Exception as e:
-        current_job["status"] = "error"
-        current_job["message"] = f"CRITICAL ERROR: {str(e)}"
+        for job in jobs:
+            job.update("error", f"CRITICAL ERROR in batch: {e}")
+        print(f"[batch {batch_id} EXCEPTION] {e}")
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        return
+    
+    for index, error in errors.items():
+        jobs[index].update("error", f"preparing failed: {error}")
+    if not tasks:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        return
+    
+    # The group mosaics are needed until the last location is prepared
+    remaining = [len(tasks)]
+    remaining_lock = threading.Lock()
+    
+    def prepare_location(job, location, mosaic_path):
+        try:
+            return prepare_job(job, location, mosaic_path)
+        finally:
+            with remaining_lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                shutil.rmtree(batch_dir, ignore_errors=True)
+    
+    for index, (location, mosaic_path) in tasks.items():
+        jobs[index].update(message="Tiles ready, waiting for a free worker...")
+        job_manager.queue_prepare(jobs[index], functools.partial(prepare_location, location=location,
+                                                                 mosaic_path=mosaic_path))
+
+@app.route('/api/batch', methods=['POST'])
+def submit_batch():
+    """Generate many maps at once: {"locations": [...] or "regions_of": "France", ...shared settings}."""
+    data = dict(request.json or {})
+    locations = data.pop("locations", None)
+    regions_of = data.pop("regions_of", None)
+    if regions_of:
+        locations = batch.regions_of(regions_of)
+    if not isinstance(locations, list) or not locations:
+        return jsonify({"error": "Give a non-empty 'locations' list or 'regions_of'"}), 400
+    
+    configs = batch.location_configs(locations, data)
+    jobs = [job_manager.add(config, request_key=request_key(config)) for config in configs]
+    batch_id = jobs[0].id
+    with batches_lock:
+        batches[batch_id] = {"id": batch_id, "created": time.time(), "job_ids": [job.id for job in jobs]}
+    
+    job_manager.run_in_prepare_slot(run_batch_jobs, batch_id, jobs, data)
+    print(f"[batch {batch_id}] Queued {len(jobs)} locations")
+    return jsonify({"batch_id": batch_id, "job_ids": [job.id for job in jobs]}), 202
+
+@app.route('/api/batch/<batch_id>', methods=['GET'])
+def get_batch(batch_id):
+    with batches_lock:
+        info = batches.get(batch_id)
+    if info is None:
+        return jsonify({"error": "Batch not found"}), 404
+    jobs = [job_manager.get(job_id) for job_id in info["job_ids"]]
+    jobs = [job.to_dict() for job in jobs if job is not None]
+    counts = {}
+    for job in jobs:
+        counts[job["status"]] = counts.get(job["status"], 0) + 1
+    return jsonify(dict(info, counts=counts, jobs=jobs))
+
 @app.route('/api/status', methods=['GET'])
 def get_status():
-    return jsonify(current_job)
+    # Single-job view kept for older clients: the most recently submitted job
+    job = job_manager.latest()
+    if job is None:
+        return jsonify({"status": "idle", "message": "", "current_file": None})
+    return jsonify(job.to_dict())
 
 @app.route('/api/history', methods=['GET'])
 def get_history():
-    if not OUTPUT_DIR.exists():
-        return jsonify([])
-    
-    files = []
-    for file in OUTPUT_DIR.glob("*_render.png"):
-        stat = file.stat()
-        files.append({
-            "filename": file.name,
-            "name": file.stem.replace("_render", ""),
-            "size": stat.st_size,
-            "modified": stat.st_mtime
-        })
-    
-    # Sort by modified time, newest first
-    files.sort(key=lambda x: x["modified"], reverse=True)
-    return jsonify(files)
+    """Renders newest first: ?limit=, ?cursor= (the previous page's next_cursor), ?location= (name contains)."""
+    store = get_history_store()
+    # The index's version changes with every render, so a matching ETag skips the query entirely
+    etag = hash_json({"version": store.version(), "query": sorted(request.args.items())})
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        try:
+            items, next_cursor, total = store.page(
+                request.args.get("limit", history_store.DEFAULT_PAGE_SIZE, type=int),
+                request.args.get("cursor"),
+                request.args.get("location", "").strip(),
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        response = jsonify({"items": items, "next_cursor": next_cursor, "total": total})
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
 
 @app.route('/api/image/<filename>', methods=['GET'])
 def get_image(filename):
+    """A render, or with ?size=thumb|preview a downscaled copy (&format=webp|jpeg, else by Accept)."""
     file_path = OUTPUT_DIR / filename
-    if file_path.exists() and file_path.suffix == '.png':
-        return send_file(file_path, mimetype='image/png')
-    return jsonify({"error": "File not found"}), 404
+    if not file_path.exists() or file_path.suffix != '.png':
+        return jsonify({"error": "File not found"}), 404
+    
+    size = request.args.get("size", "full")
+    image_format = request.args.get("format")
+    if size == "full":
+        path, mimetype = file_path, 'image/png'
+    elif size in image_variants.SIZES:
+        if image_format is None:
+            # Literal match: image/* and */* do not mean the browser decodes WebP
+            image_format = "webp" if "image/webp" in request.headers.get("Accept", "") else "jpeg"
+        if image_format not in image_variants.FORMATS:
+            return jsonify({"error": f"Unknown format '{image_format}'"}), 400
+        path = image_variants.ensure_variant(file_path, size, image_format)
+        mimetype = image_variants.mimetype(image_format)
+    else:
+        return jsonify({"error": f"Unknown size '{size}'"}), 400
+    
+    # ETag and Last-Modified from the file; a matching If-None-Match/If-Modified-Since gets a 304
+    response = send_file(path.resolve(), mimetype=mimetype, conditional=True, etag=True, max_age=IMAGE_MAX_AGE)
+    # Re-rendering a location replaces its image under the same name
+    response.cache_control.must_revalidate = True
+    if size != "full" and "format" not in request.args:
+        response.vary.add("Accept")
+    return response
 
 if __name__ == '__main__':
+    # The reloader runs this file twice; only the serving process starts the workers
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        get_history_store()
+        if PREPARE_MODE == "pool":
+            get_prepare_pool().warm()
     app.run(debug=True, port=5000)
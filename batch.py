@@ -0,0 +1,244 @@
+"""Prepare many locations in one run, sharing catalog lookups, tiles and mosaics.
+
+    python batch.py locations.json [--out-dir batches/mine] [--workers 4]
+    python batch.py --regions-of France [--out-dir batches/france]
+
+locations.json is a list of location names, or of objects with
+location_name / location_type / parent_country and any other per-location
+config keys; everything else comes from config.json. --regions-of takes
+every admin-1 region of a country from the catalog.
+
+The catalog is loaded once and every geometry looked up up front.
+Locations whose SRTM tiles overlap are grouped, each group's tiles are
+fetched once into one virtual mosaic, and every location is clipped from
+its group's mosaic (the streaming pipeline) in a pool of worker processes.
+Each location gets its own job directory, <out-dir>/<nnn>_<name>/, with its
+config.json, the prepared files and the run's log in prepare.log, ready
+for `render_map.py -- --job-dir`.
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import location_catalog
+import prepare_data
+import prepare_worker
+import vrt_mosaic
+
+DEFAULT_OUT_DIR = Path("batches")
+
+
+def location_configs(entries, base_config):
+    """One full config per entry: the base config plus the entry's own keys."""
+    configs = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"location_name": entry}
+        config = dict(base_config)
+        config.update({"location_type": "country", "parent_country": None})
+        config.update(entry)
+        # Every location is clipped from its group's mosaic
+        config["pipeline_mode"] = "streaming"
+        configs.append(config)
+    return configs
+
+
+def regions_of(country):
+    prepare_data.setup_directories()
+    catalog_dir = prepare_data.get_catalog(prepare_data.REGIONS_SHP_URL, "ne_10m_admin_1_states_provinces")
+    return [{"location_name": name, "location_type": "region", "parent_country": country}
+            for name in location_catalog.names(catalog_dir, "name", country)]
+
+
+def group_by_tiles(tile_sets):
+    """Indices of the tile sets, grouped so that sets sharing any tile end up together."""
+    parent = list(range(len(tile_sets)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    owner = {}
+    for i, tiles in enumerate(tile_sets):
+        for tile in tiles:
+            if tile in owner:
+                parent[find(i)] = find(owner[tile])
+            else:
+                owner[tile] = i
+
+    groups = {}
+    for i in range(len(tile_sets)):
+        groups.setdefault(find(i), []).append(i)
+    return list(groups.values())
+
+
+def job_dir_name(index, config):
+    slug = re.sub(r"[^\w-]+", "_", config["location_name"]).strip("_")
+    return f"{index:03d}_{slug}"
+
+
+def _prepare(config, job_dir, location, mosaic_path):
+    """Worker: prepare one location from the shared mosaic, output to prepare.log."""
+    started = time.perf_counter()
+    error = None
+    with open(Path(job_dir) / "prepare.log", 'w', encoding='utf-8') as log, contextlib.redirect_stdout(log):
+        try:
+            prepare_data.run(config, job_dir, location=location, mosaic_path=mosaic_path)
+        except Exception as e:
+            traceback.print_exc(file=sys.stdout)
+            error = str(e)
+    return {"ok": error is None, "error": error, "seconds": time.perf_counter() - started}
+
+
+def group_resolution(group, configs, locations, tile_paths, base_config):
+    """Finest pixel size any location of the group reads at, or None for the tiles' own."""
+    resolutions = []
+    for i in group:
+        # Per-location keys (target_max_dim, resolution_aware...) can differ
+        prepare_data.configure(configs[i])
+        resolutions.append(prepare_data.plan_target_resolution(locations[i][0], tile_paths))
+    prepare_data.configure(base_config)
+    if None in resolutions:
+        return None
+    return min(resolutions)
+
+
+def plan_batch(configs, base_config, out_dir):
+    """Look every geometry up, fetch each tile group's tiles and build its mosaic in `out_dir`.
+
+    Returns ({index: (location, mosaic path)}, {index: error}). This sets
+    prepare_data's module settings, so the backend calls it in a prepare
+    worker rather than in its own process.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    errors = {}
+
+    # Geometry: the catalog is loaded (and kept) by the first lookup
+    prepare_data.configure(base_config)
+    prepare_data.setup_directories()
+    locations = {}
+    for i, config in enumerate(configs):
+        try:
+            locations[i] = prepare_data.get_geometry(
+                config["location_name"], config["location_type"], config["parent_country"]
+            )
+        except Exception as e:
+            errors[i] = str(e)
+
+    tile_sets = {i: prepare_data.get_cgiar_tiles(*geometry.bounds) for i, (geometry, _) in locations.items()}
+    indices = list(tile_sets)
+    groups = [[indices[k] for k in group] for group in group_by_tiles([tile_sets[i] for i in indices])]
+    print(f"{len(locations)} locations in {len(groups)} tile groups")
+
+    # One mosaic per group, over the union of its tiles, at the finest resolution any location needs
+    tasks = {}
+    for number, group in enumerate(groups):
+        tiles = sorted({tile for i in group for tile in tile_sets[i]})
+        try:
+            tile_paths = prepare_data.fetch_tiles(tiles)
+            if not tile_paths:
+                raise Exception("No DEM tiles available for merging.")
+            resolution = group_resolution(group, configs, locations, tile_paths, base_config)
+            mosaic_path = vrt_mosaic.build_vrt(tile_paths, out_dir / f"group{number:03d}_mosaic.vrt",
+                                               resolution=resolution)
+        except Exception as e:
+            for i in group:
+                errors[i] = f"Tiles: {e}"
+            continue
+        print(f"Group {number}: {len(group)} locations over {len(tile_paths)} tiles")
+        for i in group:
+            tasks[i] = (locations[i], str(mosaic_path))
+    return tasks, errors
+
+
+def run_batch(entries, base_config, out_dir, workers=None, on_result=None):
+    """Prepare every location in `entries`; returns one result dict per entry, in order.
+
+    The mosaics and one numbered job directory per location go to `out_dir`.
+    `on_result(result)` is called as each location finishes, from this thread.
+    """
+    out_dir = Path(out_dir)
+    configs = location_configs(entries, base_config)
+    job_dirs = [out_dir / job_dir_name(i, c) for i, c in enumerate(configs)]
+    results = [{"index": i, "location_name": c["location_name"], "job_dir": str(job_dirs[i]),
+                "ok": False, "error": None} for i, c in enumerate(configs)]
+
+    def finish(i, **fields):
+        results[i].update(fields)
+        if on_result:
+            on_result(results[i])
+
+    tasks, errors = plan_batch(configs, base_config, out_dir)
+    for i, error in errors.items():
+        finish(i, error=error)
+
+    context = multiprocessing.get_context("spawn")
+    workers = workers or max(1, min(len(tasks), os.cpu_count() or 1))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=prepare_worker.enter_gdal_env) as pool:
+        futures = {}
+        for i, (location, mosaic_path) in tasks.items():
+            job_dir = job_dirs[i]
+            job_dir.mkdir(parents=True, exist_ok=True)
+            with open(job_dir / "config.json", 'w', encoding='utf-8') as f:
+                json.dump(configs[i], f, indent=4, ensure_ascii=False)
+            futures[pool.submit(_prepare, configs[i], str(job_dir), location, mosaic_path)] = i
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                # The worker itself died
+                result = {"ok": False, "error": str(e)}
+            finish(futures[future], **result)
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Prepare many locations, sharing tiles and mosaics.")
+    parser.add_argument("locations", nargs="?", help="JSON file with the list of locations")
+    parser.add_argument("--regions-of", metavar="COUNTRY", help="Every admin-1 region of this country")
+    parser.add_argument("--config", default=str(prepare_data.CONFIG_PATH), help="Settings shared by every location")
+    parser.add_argument("--out-dir", default=None, help="Where the job directories go (default: batches/<time>)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per core)")
+    args = parser.parse_args(argv)
+    if not args.locations and not args.regions_of:
+        parser.error("give a locations file or --regions-of")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    base_config = prepare_data.load_config(args.config) if Path(args.config).exists() else {}
+    if args.regions_of:
+        entries = regions_of(args.regions_of)
+    else:
+        with open(args.locations, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+    out_dir = Path(args.out_dir) if args.out_dir else DEFAULT_OUT_DIR / time.strftime("%Y%m%d-%H%M%S")
+
+    started = time.perf_counter()
+
+    def report(result):
+        state = f"done in {result['seconds']:.1f}s" if result["ok"] else f"FAILED: {result['error']}"
+        print(f"{result['location_name']}: {state}")
+
+    results = run_batch(entries, base_config, out_dir, args.workers, on_result=report)
+    failed = [r for r in results if not r["ok"]]
+    print(f"Prepared {len(results) - len(failed)}/{len(results)} locations into {out_dir} "
+          f"in {time.perf_counter() - started:.1f}s")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
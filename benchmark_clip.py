@@ -0,0 +1,66 @@
+"""Compare the two clip_dem engines on the same mosaic.
+
+    python benchmark_clip.py data/dem/Russia_mosaic.vrt Russia [country|region] [parent_country]
+
+Each engine runs in its own interpreter so one run's allocations cannot
+hide the other's peak. Peak memory is what tracemalloc sees, which covers
+the NumPy arrays the clip allocates (the part that scales with the raster).
+"""
+import json
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+MODES = ["mask", "windowed"]
+
+
+def run_mode(mode, dem_path, location_name, location_type, parent_country):
+    import prepare_data
+
+    geometry, _ = prepare_data.get_geometry(location_name, location_type, parent_country)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        prepare_data.configure({"clip_mode": mode}, job_dir=tmp)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        prepare_data.clip_dem(dem_path, geometry, location_name)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    print(json.dumps({"mode": mode, "seconds": elapsed, "peak_mb": peak / 1024 / 1024}))
+
+
+def main():
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+
+    if sys.argv[1] == "--mode":
+        run_mode(sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5],
+                 sys.argv[6] if len(sys.argv) > 6 else None)
+        return
+
+    dem_path = sys.argv[1]
+    location_name = sys.argv[2]
+    location_type = sys.argv[3] if len(sys.argv) > 3 else "country"
+    parent_country = sys.argv[4] if len(sys.argv) > 4 else None
+
+    results = []
+    for mode in MODES:
+        command = [sys.executable, __file__, "--mode", mode, dem_path, location_name, location_type]
+        if parent_country:
+            command.append(parent_country)
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'engine':<10} {'time (s)':>10} {'peak (MB)':>10}")
+    for result in results:
+        print(f"{result['mode']:<10} {result['seconds']:>10.2f} {result['peak_mb']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
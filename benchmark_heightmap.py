@@ -0,0 +1,103 @@
+"""Compare heightmap formats for Blender: texture load time and, optionally, render time.
+
+    blender --background --python benchmark_heightmap.py -- --job-dir jobs/mine [--runs 5] [--render]
+
+Takes a job prepared with the default 16-bit PNG heightmap, writes half and
+full float EXR copies of it, and loads each format `runs` times. With
+--render every format is also rendered once with the job's render profile,
+each from its own copy of the job directory.
+"""
+import argparse
+import json
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import bpy
+import numpy as np
+
+SCRIPT_DIR = Path(__file__).parent.absolute()
+# Blender does not put the script's folder on sys.path
+if str(SCRIPT_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPT_DIR))
+
+import exr_stream
+import render_map
+
+
+def read_heightmap(path):
+    """Heightmap as a (height, width) float32 array, top row first."""
+    img = bpy.data.images.load(str(path))
+    img.colorspace_settings.name = 'Non-Color'
+    width, height = img.size
+    pixels = np.empty(width * height * 4, dtype=np.float32)
+    img.pixels.foreach_get(pixels)
+    bpy.data.images.remove(img)
+    # Blender stores rows bottom to top
+    return pixels.reshape(height, width, 4)[::-1, :, 0]
+
+
+def load_seconds(path):
+    started = time.perf_counter()
+    img = render_map.load_image(path)
+    seconds = time.perf_counter() - started
+    bpy.data.images.remove(img)
+    return seconds
+
+
+def render_seconds(job_dir, heightmap_path, scratch):
+    """Render a copy of the job that points at `heightmap_path`."""
+    copy_dir = Path(scratch) / heightmap_path.name.replace(".", "_")
+    shutil.copytree(job_dir, copy_dir, ignore=shutil.ignore_patterns("*_heightmap.*", "*_render.png", "*.blend"))
+    shutil.copyfile(heightmap_path, copy_dir / heightmap_path.name)
+    with open(copy_dir / "metadata.json", 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+    metadata["heightmap"] = heightmap_path.name
+    with open(copy_dir / "metadata.json", 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, indent=2, ensure_ascii=False)
+
+    started = time.perf_counter()
+    render_map.render_job(copy_dir)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time PNG and EXR heightmaps in Blender.")
+    parser.add_argument("--job-dir", required=True, help="Job prepared with a PNG heightmap")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--render", action="store_true", help="Also time a full render per format")
+    args = parser.parse_args(render_map.script_args())
+
+    job_dir = Path(args.job_dir)
+    with open(job_dir / "metadata.json", 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+    png_path = job_dir / metadata.get('heightmap', f"{metadata['country_name']}_heightmap.png")
+    if png_path.suffix != ".png":
+        sys.exit(f"{png_path.name} is not a PNG; prepare the job with heightmap_format \"png\"")
+
+    with tempfile.TemporaryDirectory() as scratch:
+        data = read_heightmap(png_path)
+        paths = {"png": png_path}
+        for heightmap_format, pixel_type in exr_stream.PIXEL_TYPES.items():
+            paths[heightmap_format] = Path(scratch) / f"{metadata['country_name']}_{heightmap_format}.exr"
+            exr_stream.write_exr(paths[heightmap_format], data, pixel_type)
+        del data
+
+        results = {}
+        for heightmap_format, path in paths.items():
+            loads = [load_seconds(path) for _ in range(args.runs)]
+            rendered = render_seconds(job_dir, path, scratch) if args.render else None
+            results[heightmap_format] = (path.stat().st_size, loads, rendered)
+
+    print(f"{'format':<7} {'MB':>7} {'load mean (s)':>14} {'load min (s)':>13} {'render (s)':>11}")
+    for heightmap_format, (size, loads, rendered) in results.items():
+        render_text = f"{rendered:>11.1f}" if rendered is not None else f"{'-':>11}"
+        print(f"{heightmap_format:<7} {size / 1024 / 1024:>7.1f} {statistics.mean(loads):>14.3f} "
+              f"{min(loads):>13.3f} {render_text}")
+
+
+if __name__ == "__main__":
+    main()
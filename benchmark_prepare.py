@@ -0,0 +1,85 @@
+"""Compare cold (new interpreter per job) and warm (worker pool) data preparation.
+
+    python benchmark_prepare.py "South Korea" [country|region] [parent_country] [runs]
+
+Uses config.json for every other setting. One untimed run first makes sure
+the tiles and catalogs are on disk, so both sides do the same work and the
+difference is the start-up cost: interpreter, imports and catalog loading.
+"""
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from prepare_worker import PreparePool
+
+
+def job_config(location_name, location_type, parent_country):
+    with open("config.json", 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    config.update({"location_name": location_name,
+                   "location_type": location_type,
+                   "parent_country": parent_country})
+    # Time a real preparation on both sides, not a copy out of the artifact cache
+    config["artifact_cache"] = False
+    return config
+
+
+def write_job(root, index, config):
+    job_dir = Path(root) / f"job{index}"
+    job_dir.mkdir()
+    with open(job_dir / "config.json", 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False)
+    return job_dir
+
+
+def run_cold(job_dir):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "prepare_data.py", "--job-dir", str(job_dir)],
+                   check=True, capture_output=True)
+    return time.perf_counter() - start
+
+
+def run_warm(pool, job_dir, config):
+    start = time.perf_counter()
+    pool.run(config, job_dir, lambda line: None)
+    return time.perf_counter() - start
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    location_name = sys.argv[1]
+    location_type = sys.argv[2] if len(sys.argv) > 2 else "country"
+    parent_country = sys.argv[3] if len(sys.argv) > 3 and sys.argv[3] else None
+    runs = int(sys.argv[4]) if len(sys.argv) > 4 else 5
+    config = job_config(location_name, location_type, parent_country)
+
+    with tempfile.TemporaryDirectory() as root:
+        run_cold(write_job(root, "prime", config))
+
+        cold = [run_cold(write_job(root, f"cold{i}", config)) for i in range(runs)]
+
+        pool = PreparePool(1)
+        try:
+            start = time.perf_counter()
+            pool.warm()
+            warm_up = time.perf_counter() - start
+            warm = [run_warm(pool, write_job(root, f"warm{i}", config), config) for i in range(runs)]
+        finally:
+            pool.shutdown()
+
+    print(f"{'mode':<6} {'runs':>5} {'mean (s)':>10} {'min (s)':>10}")
+    for mode, times in (("cold", cold), ("warm", warm)):
+        print(f"{mode:<6} {len(times):>5} {statistics.mean(times):>10.2f} {min(times):>10.2f}")
+    print(f"One-off worker start-up: {warm_up:.2f}s, saved per job: "
+          f"{statistics.mean(cold) - statistics.mean(warm):.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.enums import Resampling
+from rasterio.features import geometry_mask
+from rasterio.windows import Window
+
+import exr_stream
+from png_stream import PngStreamWriter
+
+DEFAULT_MEMORY_MB = 512
+# Same cut-off write_blender_outputs uses to tell elevations from nodata
+VALID_THRESHOLD = -10000
+# Bytes held per output pixel while a strip is in flight: the source values,
+# the float32 work array, the boolean mask and the uint16/uint8 outputs
+BYTES_PER_PIXEL = 16
+# Strips in flight at most (two per worker). The strip height is sized for this
+# many rather than for the core count, so it, and where decimated reads are split,
+# is the same on every machine and the artifact cache key stays portable
+MAX_STRIPS_IN_FLIGHT = 16
+
+
+class StripReader:
+    """Read horizontal strips of a raster window at the export resolution.
+
+    Rasterio datasets must not be shared between threads, so every worker
+    thread lazily opens its own handle. When `geometry` is given, each strip
+    is masked against it on the output grid (used when reading straight from
+    an unclipped mosaic).
+    """
+
+    def __init__(self, dem_path, window, out_shape, geometry=None):
+        self.dem_path = dem_path
+        self.window = window
+        self.out_shape = out_shape
+        self.geometry = geometry
+        self._local = threading.local()
+        self._handles = []
+        self._lock = threading.Lock()
+
+        with rasterio.open(dem_path) as src:
+            self.crs = src.crs
+            self.nodata = src.nodata if src.nodata is not None else 0
+            out_h, out_w = out_shape
+            self.transform = src.window_transform(window) * Affine.scale(
+                window.width / out_w, window.height / out_h
+            )
+
+    def _dataset(self):
+        src = getattr(self._local, "src", None)
+        if src is None:
+            src = rasterio.open(self.dem_path)
+            self._local.src = src
+            with self._lock:
+                self._handles.append(src)
+        return src
+
+    def read(self, row_start, row_stop):
+        out_h, out_w = self.out_shape
+        rows = row_stop - row_start
+        src = self._dataset()
+
+        if (out_h, out_w) == (self.window.height, self.window.width):
+            data = src.read(1, window=Window(self.window.col_off, self.window.row_off + row_start,
+                                             self.window.width, rows))
+        else:
+            # Fractional source window covering exactly these output rows
+            scale_y = self.window.height / out_h
+            src_window = Window(self.window.col_off, self.window.row_off + row_start * scale_y,
+                                self.window.width, rows * scale_y)
+            data = src.read(1, window=src_window, out_shape=(rows, out_w), resampling=Resampling.bilinear)
+
+        if self.geometry is not None:
+            strip_transform = self.transform * Affine.translation(0, row_start)
+            outside = geometry_mask([self.geometry], out_shape=(rows, out_w), transform=strip_transform)
+            data[outside] = self.nodata
+        return data
+
+    def close(self):
+        with self._lock:
+            for src in self._handles:
+                src.close()
+            self._handles = []
+
+
+def _bounded_map(pool, fn, items, limit):
+    """Like pool.map, in order, but with at most `limit` results in flight."""
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(fn, item))
+        if len(pending) >= limit:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def strip_rows_for_budget(width, memory_mb, in_flight):
+    return max(1, (memory_mb * 1024 * 1024) // (BYTES_PER_PIXEL * width * in_flight))
+
+
+def heightmap_writer(path, width, height, heightmap_format="png"):
+    """Streaming writer for the heightmap: 16-bit PNG ("png") or float OpenEXR ("exr", "exr16")."""
+    if heightmap_format == "png":
+        return PngStreamWriter(path, width, height, 16)
+    return exr_stream.ExrStreamWriter(path, width, height, exr_stream.PIXEL_TYPES[heightmap_format])
+
+
+def export_blocks(reader, heightmap_path, mask_path, memory_mb=DEFAULT_MEMORY_MB, workers=None,
+                  on_strip=None, heightmap_format="png"):
+    """Write the heightmap (16-bit PNG or 0-1 float EXR) and 8-bit mask strip by strip.
+
+    Pass one reads every strip for the elevation range. Pass two re-reads the
+    strips, normalizes them in float32 on a thread pool and streams them, in
+    order, into the PNG writers. At most two strips per worker exist at any
+    time, sized so MAX_STRIPS_IN_FLIGHT of them fit in `memory_mb`.
+    Returns (min_elev, max_elev).
+    """
+    out_h, out_w = reader.out_shape
+    workers = min(workers or os.cpu_count() or 1, MAX_STRIPS_IN_FLIGHT // 2)
+    in_flight = workers * 2
+    strip_rows = min(out_h, strip_rows_for_budget(out_w, memory_mb, MAX_STRIPS_IN_FLIGHT))
+    strips = [(start, min(start + strip_rows, out_h)) for start in range(0, out_h, strip_rows)]
+    print(f"Exporting {out_w}x{out_h} in {len(strips)} strips of {strip_rows} rows "
+          f"({workers} threads, {memory_mb} MB budget)...")
+
+    def strip_stats(strip):
+        data = reader.read(*strip)
+        valid = data > VALID_THRESHOLD
+        if not valid.any():
+            return None
+        values = data[valid]
+        return values.min(), values.max()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Pass 1: statistics
+        min_elev, max_elev = None, None
+        for result in _bounded_map(pool, strip_stats, strips, in_flight):
+            if result is None:
+                continue
+            lo, hi = result
+            min_elev = lo if min_elev is None else min(min_elev, lo)
+            max_elev = hi if max_elev is None else max(max_elev, hi)
+        if min_elev is None:
+            min_elev, max_elev = 0, 1
+
+        range_val = max_elev - min_elev
+        if range_val == 0: range_val = 1
+        # PNG stores 0-65535, EXR stores 0-1
+        top = 65535 if heightmap_format == "png" else 1
+        scale = np.float32(top / range_val)
+        offset = np.float32(min_elev)
+
+        # Pass 2: normalize in float32, in place
+        def normalize(strip):
+            data = reader.read(*strip)
+            valid = data > VALID_THRESHOLD
+            work = data.astype(np.float32)
+            del data
+            work[~valid] = offset
+            work -= offset
+            work *= scale
+            np.nan_to_num(work, copy=False, nan=0)
+            # float32 rounding can land a hair above the top value
+            np.clip(work, 0, top, out=work)
+            mask_arr = valid.view(np.uint8) * np.uint8(255)
+            return strip, work.astype(np.uint16) if heightmap_format == "png" else work, mask_arr
+
+        # Pass 3: stream into the writers
+        with heightmap_writer(heightmap_path, out_w, out_h, heightmap_format) as heightmap, \
+                PngStreamWriter(mask_path, out_w, out_h, 8) as mask:
+            for strip, normalized, mask_arr in _bounded_map(pool, normalize, strips, in_flight):
+                heightmap.write_rows(normalized)
+                mask.write_rows(mask_arr)
+                if on_strip:
+                    on_strip(strip, len(strips))
+
+    reader.close()
+    return min_elev, max_elev
@@ -0,0 +1,117 @@
+import math
+
+import numpy as np
+import rasterio
+import shapely
+from affine import Affine
+from rasterio.enums import Resampling
+from rasterio.features import geometry_mask, geometry_window
+from rasterio.windows import Window
+from rasterio.windows import bounds as window_bounds
+
+DEFAULT_BLOCK_SIZE = 1024
+# Simplify to this fraction of a pixel; below that the rasterized mask cannot change much
+SIMPLIFY_PIXELS = 0.5
+
+
+def simplify_for_resolution(geometry, res, pixels=SIMPLIFY_PIXELS):
+    """Drop vertices that are closer together than `pixels` output pixels."""
+    tolerance = min(abs(res[0]), abs(res[1])) * pixels
+    simplified = geometry.simplify(tolerance, preserve_topology=True)
+    return simplified if not simplified.is_empty else geometry
+
+
+def clip_windowed(dem_path, geometry, out_path, block_size=DEFAULT_BLOCK_SIZE, simplify=True,
+                  on_block=None):
+    """Block-wise equivalent of rasterio.mask.mask(src, [geometry], crop=True).
+
+    The cropped window is processed in `block_size` squares. Blocks that lie
+    wholly outside the polygon are written as nodata without being read, and
+    blocks wholly inside are copied without rasterizing anything; only the
+    blocks on the boundary get a per-block mask. Peak memory is a couple of
+    blocks no matter how large the clipped area is.
+    """
+    with rasterio.open(dem_path) as src:
+        # The crop window comes from the original geometry so the extent matches mask(crop=True)
+        window = geometry_window(src, [geometry])
+        window = Window(int(window.col_off), int(window.row_off), int(window.width), int(window.height))
+        transform = src.window_transform(window)
+
+        clip_geometry = simplify_for_resolution(geometry, src.res) if simplify else geometry
+        shapely.prepare(clip_geometry)
+
+        nodata = src.nodata if src.nodata is not None else 0
+        dtype = src.dtypes[0]
+
+        out_meta = src.meta.copy()
+        out_meta.update({"driver": "GTiff",
+                         "height": int(window.height),
+                         "width": int(window.width),
+                         "transform": transform,
+                         "nodata": nodata,
+                         "tiled": True,
+                         "blockxsize": 256,
+                         "blockysize": 256})
+
+        stats = {"inside": 0, "outside": 0, "boundary": 0}
+        total_blocks = math.ceil(window.height / block_size) * math.ceil(window.width / block_size)
+        with rasterio.open(out_path, "w", **out_meta) as dest:
+            for row_off in range(0, int(window.height), block_size):
+                for col_off in range(0, int(window.width), block_size):
+                    block = Window(col_off, row_off,
+                                   min(block_size, int(window.width) - col_off),
+                                   min(block_size, int(window.height) - row_off))
+                    block_shape = (int(block.height), int(block.width))
+                    block_transform = rasterio.windows.transform(block, transform)
+                    block_box = shapely.box(*window_bounds(block, transform))
+
+                    if not shapely.intersects(clip_geometry, block_box):
+                        data = np.full(block_shape, nodata, dtype=dtype)
+                        stats["outside"] += 1
+                    else:
+                        src_window = Window(window.col_off + col_off, window.row_off + row_off,
+                                            block.width, block.height)
+                        data = src.read(1, window=src_window)
+                        if shapely.contains(clip_geometry, block_box):
+                            stats["inside"] += 1
+                        else:
+                            # Rasterize only the part of the outline that crosses this block
+                            part = shapely.clip_by_rect(clip_geometry, *block_box.bounds)
+                            outside = geometry_mask([part], out_shape=block_shape, transform=block_transform) \
+                                if not part.is_empty else np.ones(block_shape, dtype=bool)
+                            data[outside] = nodata
+                            stats["boundary"] += 1
+
+                    dest.write(data, 1, window=block)
+                    if on_block:
+                        on_block(block, total_blocks)
+
+    print(f"Clip blocks: {stats['inside']} inside, {stats['outside']} outside, {stats['boundary']} on the boundary")
+    return out_path
+
+
+def read_clipped(dem_path, geometry, out_shape_fn, simplify=True):
+    """Read the geometry's window straight at output resolution and mask it.
+
+    `out_shape_fn(height, width)` maps the native crop size to the size to
+    read, so the decimation happens inside GDAL's read instead of on a full
+    resolution copy. Returns (data, crs, transform, nodata).
+    """
+    with rasterio.open(dem_path) as src:
+        window = geometry_window(src, [geometry])
+        window = Window(int(window.col_off), int(window.row_off), int(window.width), int(window.height))
+        out_h, out_w = out_shape_fn(int(window.height), int(window.width))
+
+        nodata = src.nodata if src.nodata is not None else 0
+        data = src.read(1, window=window, out_shape=(out_h, out_w),
+                        resampling=Resampling.bilinear)
+
+        # Transform of the decimated grid covering the same window
+        transform = src.window_transform(window) * Affine.scale(window.width / out_w, window.height / out_h)
+        res = (abs(transform.a), abs(transform.e))
+        crs = src.crs
+
+    clip_geometry = simplify_for_resolution(geometry, res) if simplify else geometry
+    outside = geometry_mask([clip_geometry], out_shape=(out_h, out_w), transform=transform)
+    data[outside] = nodata
+    return data, crs, transform, nodata
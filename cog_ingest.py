@@ -0,0 +1,153 @@
+"""Convert cached SRTM tiles into tiled, compressed GeoTIFFs with overviews.
+
+    python cog_ingest.py [cache_dir] [--config config.json]
+
+Migrates an existing tile cache in place: every plain srtm_*.tif and every
+srtm_*.zip kept by the "zip" storage mode is rewritten as a Cloud-Optimized
+GeoTIFF. Tiles that are already converted are skipped. Each tile is
+converted under its tile_cache lock and its manifest entry updated right
+away, so jobs running meanwhile never see a half-migrated tile. Without a
+cache_dir, the cache of config.json (`tile_cache_dir`) is migrated.
+"""
+import argparse
+import os
+import sys
+import zipfile
+from pathlib import Path
+
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.shutil import copy as raster_copy
+
+BLOCK_SIZE = 512
+OVERVIEW_LEVELS = [2, 4, 8, 16, 32]
+COG_OPTIONS = {
+    "COMPRESS": "DEFLATE",
+    "PREDICTOR": "2",
+    "BLOCKSIZE": str(BLOCK_SIZE),
+    "OVERVIEW_RESAMPLING": "AVERAGE",
+    "NUM_THREADS": "ALL_CPUS",
+}
+
+
+def is_cog(path):
+    """True if the tile is internally tiled and carries an overview pyramid."""
+    try:
+        with rasterio.open(path) as src:
+            block_h, block_w = src.block_shapes[0]
+            return bool(src.overviews(1)) and block_w < src.width
+    except Exception:
+        return False
+
+
+def _has_cog_driver():
+    with rasterio.Env() as env:
+        return "COG" in env.drivers()
+
+
+def convert_to_cog(src_path, dst_path):
+    """Rewrite `src_path` (any GDAL path, /vsizip/ included) as a COG at `dst_path`.
+
+    Written next to the destination and renamed into place, so `dst_path` may
+    be the source file itself and readers never see a half-converted tile.
+    """
+    dst_path = Path(dst_path)
+    tmp_path = dst_path.with_name(f"{dst_path.stem}.{os.getpid()}.cog.tmp")
+
+    if _has_cog_driver():
+        raster_copy(str(src_path), str(tmp_path), driver="COG", **COG_OPTIONS)
+    else:
+        # GDAL < 3.1: tiled GeoTIFF with internal overviews, same read behaviour
+        with rasterio.open(src_path) as src:
+            profile = src.profile.copy()
+            profile.update({"driver": "GTiff",
+                            "tiled": True,
+                            "blockxsize": BLOCK_SIZE,
+                            "blockysize": BLOCK_SIZE,
+                            "compress": "deflate",
+                            "predictor": 2})
+            with rasterio.open(tmp_path, "w", **profile) as dest:
+                dest.write(src.read())
+        with rasterio.open(tmp_path, "r+") as dest:
+            dest.build_overviews(OVERVIEW_LEVELS, Resampling.average)
+
+    os.replace(tmp_path, dst_path)
+    return dst_path
+
+
+def ingest_zip(local_zip, tif_name):
+    """Convert the tile inside a downloaded zip straight to a COG and drop the zip."""
+    local_tif = local_zip.with_name(tif_name)
+    convert_to_cog(f"/vsizip/{local_zip.as_posix()}/{tif_name}", local_tif)
+    local_zip.unlink()
+    return local_tif
+
+
+def migrate(cache_dir):
+    # tile_cache imports this module
+    import tile_cache
+
+    cache_dir = Path(cache_dir)
+    cache = tile_cache.TileCache(cache_dir)
+    converted = skipped = failed = 0
+
+    for local_tif in sorted(cache_dir.glob("srtm_*.tif")):
+        with tile_cache.tile_lock(cache_dir, local_tif.stem):
+            # Evicted, or converted by someone else, while waiting for the lock
+            if not local_tif.exists() or is_cog(local_tif):
+                skipped += 1
+                continue
+            print(f"Converting {local_tif.name}...")
+            try:
+                convert_to_cog(local_tif, local_tif)
+                converted += 1
+            except Exception as e:
+                print(f"Could not convert {local_tif.name}: {e}")
+                failed += 1
+            cache.rescan([local_tif.name])
+
+    for local_zip in sorted(cache_dir.glob("srtm_*.zip")):
+        tif_name = f"{local_zip.stem}.tif"
+        with tile_cache.tile_lock(cache_dir, local_zip.stem):
+            if not local_zip.exists() or (cache_dir / tif_name).exists():
+                continue
+            print(f"Converting {local_zip.name}...")
+            try:
+                if not zipfile.is_zipfile(local_zip):
+                    raise IOError("not a valid zip")
+                ingest_zip(local_zip, tif_name)
+                converted += 1
+            except Exception as e:
+                print(f"Could not convert {local_zip.name}: {e}")
+                failed += 1
+            cache.rescan([local_zip.name, tif_name])
+
+    print(f"Migration finished: {converted} converted, {skipped} already optimized, {failed} failed.")
+    return converted, skipped, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert cached SRTM tiles to Cloud-Optimized GeoTIFFs.")
+    parser.add_argument("cache_dir", nargs="?", help="Tile cache to migrate (default: the one config.json uses)")
+    parser.add_argument("--config", default="config.json", help="Cache settings (tile_cache_dir, ...)")
+    args = parser.parse_args()
+
+    if args.cache_dir:
+        cache_dir = Path(args.cache_dir)
+    else:
+        import prepare_data
+        config = prepare_data.load_config(args.config) if Path(args.config).exists() else {}
+        prepare_data.configure(config)
+        cache_dir = prepare_data.TILE_CACHE_DIR
+
+    if not cache_dir.exists():
+        print(f"Cache directory {cache_dir} does not exist.")
+        sys.exit(1)
+    migrate(cache_dir)
+    # Tiles that were already COGs but missing from the manifest
+    import tile_cache
+    tile_cache.TileCache(cache_dir).rescan()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import struct
+
+import numpy as np
+
+EXR_MAGIC = 20000630
+# Version 2, single-part scanline file, no flags
+EXR_VERSION = 2
+
+HALF = 1
+FLOAT = 2
+PIXEL_DTYPES = {HALF: np.dtype("<f2"), FLOAT: np.dtype("<f4")}
+CHANNEL = b"Y"
+# Heightmap formats prepare_data.py accepts, by OpenEXR pixel type. Full float
+# holds the 16-bit PNG's values exactly; half floats keep 11 bits near the top
+PIXEL_TYPES = {"exr": FLOAT, "exr16": HALF}
+
+
+def _attribute(name, kind, value):
+    return name.encode() + b"\0" + kind.encode() + b"\0" + struct.pack("<i", len(value)) + value
+
+
+def _header(width, height, pixel_type):
+    box = struct.pack("<iiii", 0, 0, width - 1, height - 1)
+    # One channel: name, pixel type, pLinear + 3 reserved bytes, x/y sampling
+    channels = CHANNEL + b"\0" + struct.pack("<iB3xii", pixel_type, 0, 1, 1) + b"\0"
+    return b"".join([
+        struct.pack("<ii", EXR_MAGIC, EXR_VERSION),
+        _attribute("channels", "chlist", channels),
+        _attribute("compression", "compression", b"\0"),
+        _attribute("dataWindow", "box2i", box),
+        _attribute("displayWindow", "box2i", box),
+        _attribute("lineOrder", "lineOrder", b"\0"),
+        _attribute("pixelAspectRatio", "float", struct.pack("<f", 1.0)),
+        _attribute("screenWindowCenter", "v2f", struct.pack("<ff", 0.0, 0.0)),
+        _attribute("screenWindowWidth", "float", struct.pack("<f", 1.0)),
+        b"\0",
+    ])
+
+
+class ExrStreamWriter:
+    """Write a single-channel ("Y"), uncompressed scanline OpenEXR row strip by row strip.
+
+    Uncompressed scanlines all have the same size, so the offset table is
+    known before the first row and the file is written front to back with
+    no seeking. Nothing has to be inflated on load, which makes it the
+    quickest format for Blender to read. Values are written as half
+    (16-bit) or full (32-bit) floats.
+    """
+
+    def __init__(self, path, width, height, pixel_type=FLOAT):
+        if pixel_type not in PIXEL_DTYPES:
+            raise ValueError("pixel_type must be HALF or FLOAT")
+        self.path = path
+        self.width = width
+        self.height = height
+        self.dtype = PIXEL_DTYPES[pixel_type]
+        self.rows_written = 0
+
+        header = _header(width, height, pixel_type)
+        line_size = 8 + width * self.dtype.itemsize
+        first = len(header) + 8 * height
+        offsets = np.arange(height, dtype="<u8") * line_size + first
+
+        self._file = open(path, 'wb')
+        self._file.write(header)
+        self._file.write(offsets.tobytes())
+
+    def write_rows(self, rows):
+        rows = np.asarray(rows)
+        if rows.ndim != 2 or rows.shape[1] != self.width:
+            raise ValueError(f"Expected rows of width {self.width}, got {rows.shape}")
+        if self.rows_written + rows.shape[0] > self.height:
+            raise ValueError("More rows than the declared image height")
+
+        # Each scanline: y, byte count, then the pixels
+        count = rows.shape[0]
+        prefix = np.empty((count, 2), dtype="<i4")
+        prefix[:, 0] = np.arange(self.rows_written, self.rows_written + count)
+        prefix[:, 1] = self.width * self.dtype.itemsize
+        pixels = rows.astype(self.dtype, copy=False)
+        lines = np.concatenate([prefix.view(np.uint8), pixels.view(np.uint8)], axis=1)
+        self._file.write(lines.tobytes())
+        self.rows_written += count
+
+    def close(self):
+        if self._file.closed:
+            return
+        try:
+            if self.rows_written != self.height:
+                raise ValueError(f"Wrote {self.rows_written} rows, expected {self.height}")
+        finally:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+
+def write_exr(path, data, pixel_type=FLOAT):
+    """Write a whole 2D array at once."""
+    height, width = data.shape
+    with ExrStreamWriter(path, width, height, pixel_type) as writer:
+        writer.write_rows(data)
+
+
+def read_exr(path):
+    """Memory-map a file written by ExrStreamWriter as a (height, width) array.
+
+    Only the layout this module writes is understood: one channel,
+    uncompressed scanlines, increasing Y.
+    """
+    with open(path, 'rb') as f:
+        magic, _ = struct.unpack("<ii", f.read(8))
+        if magic != EXR_MAGIC:
+            raise ValueError(f"{path} is not an OpenEXR file")
+        attributes = {}
+        while True:
+            name = _read_string(f)
+            if not name:
+                break
+            _read_string(f)
+            size, = struct.unpack("<i", f.read(4))
+            attributes[name] = f.read(size)
+        header_size = f.tell()
+
+    if attributes.get("compression") != b"\0":
+        raise ValueError(f"{path}: only uncompressed files can be read")
+    channels = attributes["channels"]
+    # name\0, 16 bytes of channel settings, then the list's closing \0
+    name_end = channels.index(b"\0")
+    if len(channels) != name_end + 18:
+        raise ValueError(f"{path}: expected a single channel")
+    pixel_type, = struct.unpack_from("<i", channels, name_end + 1)
+    xmin, ymin, xmax, ymax = struct.unpack("<iiii", attributes["dataWindow"])
+    width, height = xmax - xmin + 1, ymax - ymin + 1
+    dtype = PIXEL_DTYPES[pixel_type]
+
+    lines = np.memmap(path, dtype=np.uint8, mode='r', offset=header_size + 8 * height,
+                      shape=(height, 8 + width * dtype.itemsize))
+    return lines[:, 8:].view(dtype)
+
+
+def _read_string(f):
+    chars = bytearray()
+    while True:
+        char = f.read(1)
+        if char in (b"", b"\0"):
+            return chars.decode()
+        chars += char
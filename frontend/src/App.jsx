@@ -2,13 +2,20 @@ import { useState, useEffect } from 'react'
 import MapForm from './components/MapForm'
 import MapDisplay from './components/MapDisplay'
 import MapHistory from './components/MapHistory'
+import { isActive } from './jobStatus'
 import './App.css'
 
+const HISTORY_PAGE_SIZE = 24
+
 function App() {
   const [config, setConfig] = useState(null)
   const [status, setStatus] = useState({ status: 'idle', message: '', current_file: null })
-  const [history, setHistory] = useState([])
+  const [history, setHistory] = useState({ items: [], nextCursor: null, total: 0 })
+  const [historyFilter, setHistoryFilter] = useState('')
+  // Bumped when a render completes so the first page is fetched again
+  const [historyVersion, setHistoryVersion] = useState(0)
   const [selectedImage, setSelectedImage] = useState(null)
+  const [jobId, setJobId] = useState(null)
 
   // Load initial config
   useEffect(() => {
@@ -18,47 +25,87 @@ function App() {
       .catch(err => console.error('Failed to load config:', err))
   }, [])
 
-  // Poll status when generating
+  // Follow the job: updates are pushed over SSE, polling is only the fallback
   useEffect(() => {
-    if (status.status === 'preparing' || status.status === 'rendering') {
-      const interval = setInterval(() => {
-        fetch('/api/status')
+    if (!jobId) return
+
+    let source = null
+    let interval = null
+    let finished = false
+
+    const stop = () => {
+      finished = true
+      if (source) source.close()
+      if (interval) clearInterval(interval)
+    }
+
+    const handleUpdate = (data) => {
+      if (finished) return
+      setStatus(data)
+      if (!isActive(data.status)) {
+        stop()
+        if (data.status === 'complete') {
+          setHistoryVersion(v => v + 1)
+          setSelectedImage(data.current_file)
+        }
+      }
+    }
+
+    const startPolling = () => {
+      if (finished || interval) return
+      interval = setInterval(() => {
+        fetch(`/api/jobs/${jobId}`)
           .then(res => res.json())
-          .then(data => {
-            setStatus(data)
-            if (data.status === 'complete') {
-              loadHistory()
-              setSelectedImage(data.current_file)
-            }
-          })
+          .then(handleUpdate)
       }, 2000)
-      
-      return () => clearInterval(interval)
     }
-  }, [status.status])
 
-  // Load history
-  const loadHistory = () => {
-    fetch('/api/history')
+    if (window.EventSource) {
+      source = new EventSource(`/api/jobs/${jobId}/events`)
+      source.addEventListener('job', (e) => handleUpdate(JSON.parse(e.data)))
+      source.onerror = () => {
+        source.close()
+        startPolling()
+      }
+    } else {
+      startPolling()
+    }
+
+    return stop
+  }, [jobId])
+
+  // Load history: one page at a time, the next one after `cursor`
+  const loadHistory = (cursor = null) => {
+    const params = new URLSearchParams({ limit: HISTORY_PAGE_SIZE })
+    if (cursor) params.set('cursor', cursor)
+    if (historyFilter.trim()) params.set('location', historyFilter.trim())
+    fetch(`/api/history?${params}`)
       .then(res => res.json())
-      .then(data => setHistory(data))
+      .then(data => setHistory(prev => ({
+        items: cursor ? [...prev.items, ...data.items] : data.items,
+        nextCursor: data.next_cursor,
+        total: data.total,
+      })))
       .catch(err => console.error('Failed to load history:', err))
   }
 
   useEffect(() => {
-    loadHistory()
-  }, [])
+    // Wait for a pause in typing before filtering
+    const timeout = setTimeout(() => loadHistory(), historyFilter ? 250 : 0)
+    return () => clearTimeout(timeout)
+  }, [historyFilter, historyVersion])
 
   const handleGenerate = (formData) => {
-    fetch('/api/generate', {
+    fetch('/api/jobs', {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify(formData)
     })
       .then(res => res.json())
       .then(data => {
-        if (data.success) {
-          setStatus({ status: 'preparing', message: 'Starting...', current_file: null })
+        if (data.job_id) {
+          setJobId(data.job_id)
+          setStatus(data.job)
         }
       })
       .catch(err => console.error('Failed to start generation:', err))
@@ -89,7 +136,11 @@ function App() {
           />
           
           <MapHistory 
-            history={history}
+            history={history.items}
+            total={history.total}
+            filter={historyFilter}
+            onFilterChange={setHistoryFilter}
+            onLoadMore={history.nextCursor ? () => loadHistory(history.nextCursor) : null}
             onSelect={setSelectedImage}
             selectedImage={selectedImage}
           />
@@ -1,7 +1,18 @@
 import './MapDisplay.css'
+import { isActive } from '../jobStatus'
+
+// "export: 42% (about 12s left)" for the stage currently running
+const stageProgress = (status) => {
+  const entry = status.stages && status.stages[status.stage]
+  if (!entry) return null
+  let text = `${status.stage}: ${Math.round(entry.percent)}%`
+  if (entry.eta) text += ` (about ${Math.ceil(entry.eta)}s left)`
+  return text
+}
 
 function MapDisplay({ selectedImage, status }) {
-  const isGenerating = status.status === 'preparing' || status.status === 'rendering'
+  const isGenerating = isActive(status.status)
+  const progressText = stageProgress(status)
 
   return (
     <div className="map-display">
@@ -10,18 +21,29 @@ function MapDisplay({ selectedImage, status }) {
       <div className="display-container">
         {isGenerating ? (
           <div className="generating-state">
-            <div className="spinner"></div>
+            {status.preview ? (
+              <img
+                src={`/api/jobs/${status.id}/preview`}
+                alt="Quick preview"
+                className="preview-image"
+              />
+            ) : (
+              <div className="spinner"></div>
+            )}
             <p className="status-text">{status.message}</p>
+            {progressText && <p className="stage-progress">{progressText}</p>}
           </div>
         ) : selectedImage ? (
           <div className="image-container">
-            <img 
-              src={`/api/image/${selectedImage}`} 
-              alt="Generated map"
-              className="map-image"
-            />
+            <a href={`/api/image/${selectedImage}`} target="_blank" rel="noreferrer" title="Open full resolution">
+              <img 
+                src={`/api/image/${selectedImage}?size=preview`} 
+                alt="Generated map"
+                className="map-image"
+              />
+            </a>
             <div className="image-label">
-              {selectedImage.replace('_render.png', '')}
+              {selectedImage.replace(/(_[0-9a-f]{8})?_render\.png$/, '')}
             </div>
           </div>
         ) : (
@@ -1,5 +1,6 @@
 import { useState, useEffect } from 'react'
 import './MapForm.css'
+import { isActive } from '../jobStatus'
 
 function MapForm({ initialConfig, onGenerate, status }) {
   const [locationName, setLocationName] = useState('')
@@ -7,12 +8,14 @@ function MapForm({ initialConfig, onGenerate, status }) {
   const [parentCountry, setParentCountry] = useState('')
   const [lowColor, setLowColor] = useState('#F2FAFF')
   const [highColor, setHighColor] = useState('#051480')
+  const [renderProfile, setRenderProfile] = useState('standard')
 
   useEffect(() => {
     if (initialConfig) {
       setLocationName(initialConfig.location_name || '')
       setLocationType(initialConfig.location_type || 'country')
       setParentCountry(initialConfig.parent_country || '')
+      setRenderProfile(initialConfig.render_profile || 'standard')
       
       const colors = initialConfig.colors || {}
       if (colors.low_color) {
@@ -45,6 +48,7 @@ function MapForm({ initialConfig, onGenerate, status }) {
       location_name: locationName,
       location_type: locationType,
       parent_country: parentCountry || null,
+      render_profile: renderProfile,
       colors: {
         low_color: hexToRgba(lowColor),
         high_color: hexToRgba(highColor)
@@ -54,7 +58,7 @@ function MapForm({ initialConfig, onGenerate, status }) {
     onGenerate(formData)
   }
 
-  const isGenerating = status.status === 'preparing' || status.status === 'rendering'
+  const isGenerating = isActive(status.status)
 
   return (
     <div className="map-form">
@@ -165,6 +169,27 @@ function MapForm({ initialConfig, onGenerate, status }) {
           </div>
         </div>
 
+        <div className="form-section">
+          <h3>Render Quality</h3>
+          
+          <div className="form-group">
+            <div className="radio-group">
+              {[['draft', 'Draft'], ['standard', 'Standard'], ['print', 'Print']].map(([value, label]) => (
+                <label className="radio-label" key={value}>
+                  <input
+                    type="radio"
+                    value={value}
+                    checked={renderProfile === value}
+                    onChange={(e) => setRenderProfile(e.target.value)}
+                    disabled={isGenerating}
+                  />
+                  {label}
+                </label>
+              ))}
+            </div>
+          </div>
+        </div>
+
         <button 
           type="submit" 
           className="generate-btn"
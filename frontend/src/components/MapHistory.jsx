@@ -1,7 +1,7 @@
 import './MapHistory.css'
 
-function MapHistory({ history, onSelect, selectedImage }) {
-  if (history.length === 0) {
+function MapHistory({ history, total, filter, onFilterChange, onLoadMore, onSelect, selectedImage }) {
+  if (history.length === 0 && !filter) {
     return (
       <div className="map-history">
         <h2>History</h2>
@@ -14,7 +14,21 @@ function MapHistory({ history, onSelect, selectedImage }) {
 
   return (
     <div className="map-history">
-      <h2>History ({history.length})</h2>
+      <h2>History ({total})</h2>
+      
+      <input
+        type="search"
+        className="history-filter"
+        placeholder="Filter by location..."
+        value={filter}
+        onChange={(e) => onFilterChange(e.target.value)}
+      />
+      
+      {history.length === 0 && (
+        <div className="empty-history">
+          <p>No maps match "{filter}"</p>
+        </div>
+      )}
       
       <div className="history-grid">
         {history.map((item) => (
@@ -25,8 +39,9 @@ function MapHistory({ history, onSelect, selectedImage }) {
           >
             <div className="thumbnail">
               <img 
-                src={`/api/image/${item.filename}`} 
+                src={`/api/image/${item.filename}?size=thumb&v=${item.modified}`} 
                 alt={item.name}
+                loading="lazy"
               />
             </div>
             <div className="item-info">
@@ -40,6 +55,12 @@ function MapHistory({ history, onSelect, selectedImage }) {
           </div>
         ))}
       </div>
+      
+      {onLoadMore && (
+        <button className="load-more" onClick={onLoadMore}>
+          Load more ({total - history.length} left)
+        </button>
+      )}
     </div>
   )
 }
@@ -0,0 +1,4 @@
+// Job states in which the backend is still working on the map
+export const ACTIVE_STATUSES = ['queued', 'preparing', 'waiting', 'rendering']
+
+export const isActive = (status) => ACTIVE_STATUSES.includes(status)
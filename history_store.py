@@ -0,0 +1,202 @@
+"""Index of finished renders in SQLite, so the history is not a directory scan per request.
+
+    python history_store.py [output_dir]
+
+backend.py records each render as its job completes: location, render
+settings, timings and file size. At startup the index is reconciled
+with <output_dir>/*_render.png, which picks up renders made outside the
+web app (render_map.py on its own, older versions) and forgets deleted
+ones. Run as a script to reconcile and print what changed.
+
+Pages come newest first with an opaque cursor, so asking for the next
+page costs the same however deep it is. Every change bumps a version
+number that backend.py puts in the history's ETag.
+"""
+import base64
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+
+DB_NAME = "history.sqlite3"
+RENDER_SUFFIX = "_render.png"
+# backend.py names renders <location>_<first 8 hex digits of the render key>_render.png
+RENDER_NAME = re.compile(r"^(?P<name>.*?)(_[0-9a-f]{8})?" + re.escape(RENDER_SUFFIX) + "$")
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS renders (
+    filename TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    location_type TEXT,
+    parent_country TEXT,
+    params TEXT,
+    size INTEGER NOT NULL,
+    modified REAL NOT NULL,
+    prepare_seconds REAL,
+    render_seconds REAL,
+    cached INTEGER,
+    job_id TEXT
+);
+CREATE INDEX IF NOT EXISTS renders_newest ON renders (modified DESC, filename DESC);
+CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT OR IGNORE INTO state VALUES ('version', 0);
+"""
+
+COLUMNS = ("filename", "name", "location_type", "parent_country", "params", "size", "modified",
+           "prepare_seconds", "render_seconds", "cached", "job_id")
+
+
+def location_name(filename):
+    """The location a render file is named after."""
+    return RENDER_NAME.match(filename).group("name")
+
+
+def encode_cursor(modified, filename):
+    raw = json.dumps([modified, filename], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """(modified, filename) of the last entry of the previous page; ValueError if malformed."""
+    try:
+        modified, filename = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return float(modified), str(filename)
+    except Exception:
+        raise ValueError(f"Invalid cursor '{cursor}'")
+
+
+class HistoryStore:
+    """The renders table, shared by the request and render threads through one connection."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.lock, self.db:
+            # The script can read the index while the server writes to it
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def version(self):
+        with self.lock:
+            return self.db.execute("SELECT value FROM state WHERE key = 'version'").fetchone()[0]
+
+    def _bump(self):
+        # Caller holds self.lock inside a transaction
+        self.db.execute("UPDATE state SET value = value + 1 WHERE key = 'version'")
+
+    def record(self, render_path, config=None, params=None, prepare_seconds=None, render_seconds=None,
+               cached=False, job_id=None):
+        """Add or replace the entry of a render that has just been written."""
+        render_path = Path(render_path)
+        config = config or {}
+        stat = render_path.stat()
+        entry = {
+            "filename": render_path.name,
+            "name": config.get("location_name") or location_name(render_path.name),
+            "location_type": config.get("location_type"),
+            "parent_country": config.get("parent_country"),
+            "params": json.dumps(params, sort_keys=True, ensure_ascii=False) if params is not None else None,
+            "size": stat.st_size,
+            "modified": stat.st_mtime,
+            "prepare_seconds": prepare_seconds,
+            "render_seconds": render_seconds,
+            "cached": int(cached),
+            "job_id": job_id,
+        }
+        with self.lock, self.db:
+            self.db.execute(
+                f"INSERT OR REPLACE INTO renders ({', '.join(COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(COLUMNS))})",
+                [entry[column] for column in COLUMNS],
+            )
+            self._bump()
+
+    def reconcile(self, output_dir):
+        """Match the index to the renders on disk; returns (added, updated, removed) counts."""
+        on_disk = {}
+        with os.scandir(output_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(RENDER_SUFFIX) and entry.is_file():
+                    stat = entry.stat()
+                    on_disk[entry.name] = (stat.st_size, stat.st_mtime)
+
+        with self.lock, self.db:
+            indexed = {row["filename"]: (row["size"], row["modified"])
+                       for row in self.db.execute("SELECT filename, size, modified FROM renders")}
+            added = [(name, location_name(name), size, modified)
+                     for name, (size, modified) in on_disk.items() if name not in indexed]
+            # Replaced outside the web app: the file is right, the recorded settings may not be
+            updated = [(size, modified, name) for name, (size, modified) in on_disk.items()
+                       if name in indexed and indexed[name] != (size, modified)]
+            removed = [(name,) for name in indexed if name not in on_disk]
+
+            self.db.executemany("INSERT INTO renders (filename, name, size, modified) VALUES (?, ?, ?, ?)", added)
+            self.db.executemany("UPDATE renders SET size = ?, modified = ? WHERE filename = ?", updated)
+            self.db.executemany("DELETE FROM renders WHERE filename = ?", removed)
+            if added or updated or removed:
+                self._bump()
+        return len(added), len(updated), len(removed)
+
+    def page(self, limit=DEFAULT_PAGE_SIZE, cursor=None, location=None):
+        """Up to `limit` entries, newest first, after `cursor`, whose name contains `location`.
+
+        Returns (entries, next_cursor, total); next_cursor is None on the last page
+        and total counts every entry that matches `location`.
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        filters, args = [], []
+        if location:
+            filters.append("instr(lower(name), lower(?)) > 0")
+            args.append(location)
+        conditions, page_args = list(filters), list(args)
+        if cursor:
+            modified, filename = decode_cursor(cursor)
+            conditions.append("(modified < ? OR (modified = ? AND filename < ?))")
+            page_args += [modified, modified, filename]
+        filter_sql = f"WHERE {' AND '.join(filters)}" if filters else ""
+        page_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with self.lock:
+            total = self.db.execute(f"SELECT COUNT(*) FROM renders {filter_sql}", args).fetchone()[0]
+            rows = self.db.execute(
+                f"SELECT * FROM renders {page_sql} ORDER BY modified DESC, filename DESC LIMIT ?",
+                page_args + [limit + 1],
+            ).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]["modified"], rows[-1]["filename"])
+        return [self._entry(row) for row in rows], next_cursor, total
+
+    @staticmethod
+    def _entry(row):
+        entry = dict(row)
+        entry["params"] = json.loads(entry["params"]) if entry["params"] else None
+        entry["cached"] = bool(entry["cached"]) if entry["cached"] is not None else None
+        return entry
+
+
+def main():
+    output_dir = Path(sys.argv[1]) if len(sys.argv) > 1 else Path("output")
+    store = HistoryStore(output_dir / DB_NAME)
+    added, updated, removed = store.reconcile(output_dir)
+    _, _, total = store.page(limit=1)
+    print(f"{total} renders indexed ({added} added, {updated} updated, {removed} removed)")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
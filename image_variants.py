@@ -0,0 +1,99 @@
+"""Downscaled, web-friendly copies of finished renders for the frontend.
+
+    python image_variants.py [output_dir]
+
+A render is a 2400x3000 PNG (twice that with the print profile), far too
+heavy for the history grid. Each render gets a thumbnail and a preview,
+both as WebP and as JPEG for browsers without WebP, in
+<output_dir>/variants/<name>.<size>.<ext>. They are made when a render
+completes, or on first request for renders from before this module, and
+remade whenever the render is newer than its variants. Run as a script to
+make the missing ones for every render at once.
+"""
+import os
+import sys
+import threading
+from pathlib import Path
+
+from PIL import Image
+
+VARIANTS_DIR_NAME = "variants"
+# Longest side in pixels; "full" is the render itself
+SIZES = {"thumb": 320, "preview": 1200}
+# Format: (file extension, mimetype, encoder options)
+FORMATS = {
+    "webp": ("webp", "image/webp", {"quality": 80, "method": 4}),
+    "jpeg": ("jpg", "image/jpeg", {"quality": 85, "optimize": True, "progressive": True}),
+}
+
+# Renders being converted, so two requests for an old render decode it once
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def variant_path(render_path, size, image_format):
+    render_path = Path(render_path)
+    extension = FORMATS[image_format][0]
+    return render_path.parent / VARIANTS_DIR_NAME / f"{render_path.stem}.{size}.{extension}"
+
+
+def mimetype(image_format):
+    return FORMATS[image_format][1]
+
+
+def _is_fresh(path, render_path):
+    return path.exists() and path.stat().st_mtime >= render_path.stat().st_mtime
+
+
+def _lock_for(render_path):
+    with _locks_lock:
+        return _locks.setdefault(str(render_path), threading.Lock())
+
+
+def generate_all(render_path):
+    """Every size and format of one render, from a single decode of the PNG."""
+    render_path = Path(render_path)
+    variants_dir = render_path.parent / VARIANTS_DIR_NAME
+    variants_dir.mkdir(parents=True, exist_ok=True)
+
+    with Image.open(render_path) as image:
+        image.load()
+        # Largest first, so each size is reduced from the previous one rather than the full render
+        for size, max_dim in sorted(SIZES.items(), key=lambda item: -item[1]):
+            image = image.copy()
+            # reducing_gap: a cheap box reduction first, then Lanczos on the small image
+            image.thumbnail((max_dim, max_dim), Image.LANCZOS, reducing_gap=3.0)
+            for image_format, (_, _, options) in FORMATS.items():
+                path = variant_path(render_path, size, image_format)
+                encoded = image.convert("RGB") if image_format == "jpeg" else image
+                # Written aside and renamed, so a request never sees half a file
+                tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+                encoded.save(tmp_path, format=image_format.upper(), **options)
+                os.replace(tmp_path, path)
+
+
+def ensure_variant(render_path, size, image_format):
+    """Path of an up-to-date variant, making the render's variants first if needed."""
+    render_path = Path(render_path)
+    path = variant_path(render_path, size, image_format)
+    if _is_fresh(path, render_path):
+        return path
+    with _lock_for(render_path):
+        # Another request may have made them while this one waited
+        if not _is_fresh(path, render_path):
+            generate_all(render_path)
+    return path
+
+
+def main():
+    output_dir = Path(sys.argv[1]) if len(sys.argv) > 1 else Path("output")
+    for render_path in sorted(output_dir.glob("*_render.png")):
+        if all(_is_fresh(variant_path(render_path, size, image_format), render_path)
+               for size in SIZES for image_format in FORMATS):
+            continue
+        generate_all(render_path)
+        print(f"Variants for {render_path.name}")
+
+
+if __name__ == "__main__":
+    main()
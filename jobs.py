@@ -0,0 +1,223 @@
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Job lifecycle: queued -> preparing -> waiting (for a render slot) -> rendering -> complete | error
+ACTIVE_STATUSES = ("queued", "preparing", "waiting", "rendering")
+
+# Finished jobs kept around for /api/jobs/<id>
+MAX_FINISHED_JOBS = 200
+
+# Recent events kept per job so a reconnecting stream can catch up
+MAX_EVENTS = 500
+
+
+class Job:
+    def __init__(self, config, request_key=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.config = config
+        self.request_key = request_key
+        self.status = "queued"
+        self.message = "Waiting for a free worker..."
+        self.current_file = None
+        self.preview = None
+        self.created = time.time()
+        self.updated = self.created
+        self.timings = {}
+        self._stage_started = None
+        self.stage = None
+        self.stages = {}
+        self.seq = 0
+        self.events = deque(maxlen=MAX_EVENTS)
+        self._changed = threading.Condition()
+
+    @property
+    def active(self):
+        return self.status in ACTIVE_STATUSES
+
+    def update(self, status=None, message=None, current_file=None, preview=None):
+        with self._changed:
+            kind = "progress"
+            if status is not None and status != self.status:
+                self.status = status
+                kind = "status"
+            if message is not None:
+                self.message = message
+            if current_file is not None:
+                self.current_file = current_file
+            if preview is not None:
+                self.preview = preview
+            self.updated = time.time()
+            self._publish(kind)
+
+    def record_progress(self, event):
+        """Fold a progress event (see progress.py) into per-stage percent and ETA."""
+        name = event.get("stage")
+        if name is None:
+            return
+        kind = event.get("event")
+        with self._changed:
+            now = time.time()
+            entry = self.stages.get(name)
+            if kind == "stage_start" or entry is None:
+                entry = self.stages[name] = {"started": now, "percent": 0.0, "eta": None}
+                self.stage = name
+
+            if kind == "stage_end":
+                entry.update(seconds=now - entry["started"], percent=100.0, eta=0.0)
+                if "error" in event:
+                    entry["error"] = event["error"]
+            elif kind == "bytes":
+                entry["bytes"] = event.get("done", 0)
+            elif kind != "stage_start":
+                done, total = event.get("done", 0), event.get("total")
+                entry.update(unit=kind, done=done, total=total)
+                if total:
+                    entry["percent"] = min(100.0, 100.0 * done / total)
+                    # Linear extrapolation from the stage's rate so far
+                    elapsed = now - entry["started"]
+                    entry["eta"] = elapsed * (total - done) / done if done else None
+
+            self.updated = now
+            self._publish("progress")
+
+    def _publish(self, kind):
+        # Caller holds self._changed
+        self.seq += 1
+        self.events.append((self.seq, dict(self.to_dict(), event=kind)))
+        self._changed.notify_all()
+
+    def snapshot(self):
+        """Consistent copy of the current state, seq included."""
+        with self._changed:
+            return self.to_dict()
+
+    def wait_events(self, after, timeout=None):
+        """Events newer than sequence number `after`, waiting up to `timeout` for one."""
+        with self._changed:
+            if self.seq <= after:
+                self._changed.wait(timeout)
+            return [(seq, event) for seq, event in self.events if seq > after]
+
+    def start_stage(self, status, message):
+        self._stage_started = time.time()
+        self.update(status, message)
+
+    def end_stage(self, stage):
+        with self._changed:
+            if self._stage_started is not None:
+                self.timings[stage] = time.time() - self._stage_started
+                self._stage_started = None
+                self._publish("timing")
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "message": self.message,
+            "current_file": self.current_file,
+            "preview": self.preview,
+            "location_name": self.config.get("location_name"),
+            "created": self.created,
+            "updated": self.updated,
+            "timings": dict(self.timings),
+            "stage": self.stage,
+            "stages": {name: dict(entry) for name, entry in self.stages.items()},
+            "seq": self.seq,
+        }
+
+
+class JobManager:
+    """Runs jobs through a prepare pool and a render pool.
+
+    The two stages have their own concurrency limits, so job B can prepare
+    while job A renders. `prepare_fn(job)` and `render_fn(job)` do the actual
+    work and return True on success; they report progress through
+    job.update().
+    """
+
+    def __init__(self, prepare_fn, render_fn, prepare_workers=1, render_workers=1):
+        self.prepare_fn = prepare_fn
+        self.render_fn = render_fn
+        self.prepare_pool = ThreadPoolExecutor(max_workers=prepare_workers, thread_name_prefix="prepare")
+        self.render_pool = ThreadPoolExecutor(max_workers=render_workers, thread_name_prefix="render")
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, config, request_key=None):
+        """Queue a job. An active job with the same request key is returned instead."""
+        with self.lock:
+            if request_key is not None:
+                for job in self.jobs.values():
+                    if job.active and job.request_key == request_key:
+                        return job, False
+
+            job = Job(config, request_key)
+            self.jobs[job.id] = job
+            self._prune()
+
+        self.queue_prepare(job)
+        return job, True
+
+    def add(self, config, request_key=None):
+        """Register a job without queueing it (batch jobs); hand it on with queue_prepare()."""
+        with self.lock:
+            job = Job(config, request_key)
+            self.jobs[job.id] = job
+            self._prune()
+        return job
+
+    def queue_prepare(self, job, prepare_fn=None):
+        """Queue a job's preparation; `prepare_fn` replaces the manager's for this job only."""
+        self.prepare_pool.submit(self._run_prepare, job, prepare_fn or self.prepare_fn)
+
+    def run_in_prepare_slot(self, fn, *args):
+        """Run work shared by several jobs (a batch's tiles and mosaics) under the prepare limit."""
+        return self.prepare_pool.submit(fn, *args)
+
+    def queue_render(self, job):
+        job.update("waiting", "Waiting for a free render slot...")
+        self.render_pool.submit(self._run_render, job)
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return sorted(self.jobs.values(), key=lambda job: job.created, reverse=True)
+
+    def latest(self):
+        jobs = self.list()
+        return jobs[0] if jobs else None
+
+    def _prune(self):
+        finished = sorted((job for job in self.jobs.values() if not job.active), key=lambda job: job.updated)
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job.id]
+
+    def _fail(self, job, stage, error):
+        job.update("error", f"CRITICAL ERROR in {stage}: {error}")
+        print(f"[{job.id} {stage} EXCEPTION] {error}")
+
+    def _run_prepare(self, job, prepare_fn):
+        try:
+            job.start_stage("preparing", "Starting data preparation...")
+            ok = prepare_fn(job)
+            job.end_stage("preparing")
+        except Exception as e:
+            self._fail(job, "preparing", e)
+            return
+
+        if ok and job.active:
+            self.queue_render(job)
+
+    def _run_render(self, job):
+        try:
+            job.start_stage("rendering", "Starting Blender render...")
+            self.render_fn(job)
+            job.end_stage("rendering")
+        except Exception as e:
+            self._fail(job, "rendering", e)
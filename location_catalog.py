@@ -0,0 +1,263 @@
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import shapely
+
+# Bump when the on-disk layout changes so stale catalogs get rebuilt
+CATALOG_VERSION = 1
+
+# Every column a location can be looked up by (Natural Earth admin-0 and admin-1)
+NAME_COLUMNS = ["ADMIN", "NAME", "name", "woe_name", "gn_name"]
+# Kept as a plain column so region lookups can filter on their parent country
+PARENT_COLUMN = "admin"
+
+# Files next to the .shp that the catalog is also built from
+SIDECAR_SUFFIXES = [".dbf", ".shx", ".prj", ".cpg"]
+
+MANIFEST_FILE = "manifest.json"
+INDEX_FILE = "index.json"
+GEOMETRY_FILE = "geometries.wkb"
+GEOMETRY_OFFSETS_FILE = "geometry_offsets.npy"
+ATTRIBUTES_FILE = "attributes.jsonl"
+ATTRIBUTE_OFFSETS_FILE = "attribute_offsets.npy"
+
+# In-process cache of loaded indexes, keyed by catalog directory
+_loaded = {}
+
+
+def _source_signature(shp_path):
+    stat = Path(shp_path).stat()
+    # [mtime_ns, size] of each sidecar, None when it does not exist
+    sidecars = {}
+    for suffix in SIDECAR_SUFFIXES:
+        sidecar = Path(shp_path).with_suffix(suffix)
+        if sidecar.exists():
+            sidecar_stat = sidecar.stat()
+            sidecars[suffix] = [sidecar_stat.st_mtime_ns, sidecar_stat.st_size]
+        else:
+            sidecars[suffix] = None
+    return {
+        "version": CATALOG_VERSION,
+        "source": str(Path(shp_path).resolve()),
+        "source_mtime_ns": stat.st_mtime_ns,
+        "source_size": stat.st_size,
+        "sidecars": sidecars,
+    }
+
+
+def _read_manifest(catalog_dir):
+    manifest_path = catalog_dir / MANIFEST_FILE
+    if not manifest_path.exists():
+        return None
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_stale(shp_path, catalog_dir):
+    manifest = _read_manifest(Path(catalog_dir))
+    if manifest is None:
+        return True
+    signature = _source_signature(shp_path)
+    return any(manifest.get(key) != value for key, value in signature.items())
+
+
+def _write_atomic(path, write):
+    tmp_path = path.with_name(path.name + f".{os.getpid()}.tmp")
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _save_array(path, array):
+    with open(path, 'wb') as f:
+        np.save(f, array)
+
+
+def build_catalog(shp_path, catalog_dir):
+    """Convert a shapefile into the indexed catalog layout.
+
+    Geometries are stored as concatenated WKB with an offset table, attributes
+    as one JSON object per line with their own offsets, so a lookup only has
+    to decode the single feature it matched.
+    """
+    import geopandas as gpd
+
+    catalog_dir = Path(catalog_dir)
+    catalog_dir.mkdir(parents=True, exist_ok=True)
+    print(f"Building location catalog for {shp_path}...")
+
+    # Invalidate first so a crash mid-build never leaves a "valid" catalog
+    manifest_path = catalog_dir / MANIFEST_FILE
+    if manifest_path.exists():
+        manifest_path.unlink()
+
+    gdf = gpd.read_file(shp_path)
+
+    # Geometries
+    wkbs = shapely.to_wkb(gdf.geometry.values)
+    geometry_offsets = np.zeros(len(wkbs) + 1, dtype=np.int64)
+    geometry_offsets[1:] = np.cumsum([len(b) for b in wkbs])
+
+    def write_geometries(path):
+        with open(path, 'wb') as f:
+            for blob in wkbs:
+                f.write(blob)
+
+    # Attributes (pandas maps NaN to null and numpy scalars to plain JSON)
+    records = gdf.drop(columns=gdf.geometry.name).to_json(
+        orient="records", lines=True, force_ascii=False
+    )
+    lines = [line.encode('utf-8') + b"\n" for line in records.splitlines() if line]
+    attribute_offsets = np.zeros(len(lines) + 1, dtype=np.int64)
+    attribute_offsets[1:] = np.cumsum([len(line) for line in lines])
+
+    def write_attributes(path):
+        with open(path, 'wb') as f:
+            f.writelines(lines)
+
+    # Name -> row index for every name column present in this file
+    names = {}
+    for column in NAME_COLUMNS:
+        if column not in gdf.columns:
+            continue
+        column_index = {}
+        for row, value in enumerate(gdf[column].tolist()):
+            if isinstance(value, str) and value:
+                column_index.setdefault(value, []).append(row)
+        names[column] = column_index
+
+    index = {"names": names, "columns": {}}
+    if PARENT_COLUMN in gdf.columns:
+        index["columns"][PARENT_COLUMN] = [
+            value if isinstance(value, str) else None for value in gdf[PARENT_COLUMN].tolist()
+        ]
+
+    def write_index(path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False)
+
+    _write_atomic(catalog_dir / GEOMETRY_FILE, write_geometries)
+    _write_atomic(catalog_dir / GEOMETRY_OFFSETS_FILE, lambda p: _save_array(p, geometry_offsets))
+    _write_atomic(catalog_dir / ATTRIBUTES_FILE, write_attributes)
+    _write_atomic(catalog_dir / ATTRIBUTE_OFFSETS_FILE, lambda p: _save_array(p, attribute_offsets))
+    _write_atomic(catalog_dir / INDEX_FILE, write_index)
+
+    manifest = _source_signature(shp_path)
+    manifest["count"] = len(gdf)
+
+    def write_manifest(path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+
+    _write_atomic(manifest_path, write_manifest)
+    _loaded.pop(str(catalog_dir.resolve()), None)
+    print(f"Catalog built: {len(gdf)} features in {catalog_dir}")
+
+
+def ensure_catalog(shp_path, catalog_dir):
+    if is_stale(shp_path, catalog_dir):
+        build_catalog(shp_path, catalog_dir)
+    return Path(catalog_dir)
+
+
+def _load(catalog_dir):
+    catalog_dir = Path(catalog_dir)
+    key = str(catalog_dir.resolve())
+    manifest = _read_manifest(catalog_dir)
+    cached = _loaded.get(key)
+    if cached is not None and cached["manifest"] == manifest:
+        return cached
+
+    with open(catalog_dir / INDEX_FILE, 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    # Offset tables are a few KB, load them outright rather than memory-mapping
+    # (a live mmap would block the atomic replace of a rebuild on Windows)
+    loaded = {
+        "manifest": manifest,
+        "index": index,
+        "geometry_offsets": np.load(catalog_dir / GEOMETRY_OFFSETS_FILE),
+        "attribute_offsets": np.load(catalog_dir / ATTRIBUTE_OFFSETS_FILE),
+    }
+    _loaded[key] = loaded
+    return loaded
+
+
+def preload(catalog_dir):
+    """Keep the whole catalog in memory, for long-lived processes that look up many locations.
+
+    The blobs are dropped along with the rest of the cached entry when the
+    catalog is rebuilt.
+    """
+    catalog_dir = Path(catalog_dir)
+    loaded = _load(catalog_dir)
+    if "blobs" not in loaded:
+        loaded["blobs"] = {name: (catalog_dir / name).read_bytes() for name in (GEOMETRY_FILE, ATTRIBUTES_FILE)}
+    return loaded
+
+
+def _read_slice(catalog_dir, loaded, name, start, end):
+    blob = loaded.get("blobs", {}).get(name)
+    if blob is not None:
+        return blob[start:end]
+    with open(catalog_dir / name, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start)
+
+
+def read_feature(catalog_dir, row):
+    """Decode the geometry and attributes of a single catalog row."""
+    catalog_dir = Path(catalog_dir)
+    loaded = _load(catalog_dir)
+
+    g_offsets = loaded["geometry_offsets"]
+    geometry = shapely.from_wkb(
+        _read_slice(catalog_dir, loaded, GEOMETRY_FILE, int(g_offsets[row]), int(g_offsets[row + 1]))
+    )
+
+    a_offsets = loaded["attribute_offsets"]
+    attributes = json.loads(
+        _read_slice(catalog_dir, loaded, ATTRIBUTES_FILE, int(a_offsets[row]), int(a_offsets[row + 1])).decode('utf-8')
+    )
+    return geometry, attributes
+
+
+def find_rows(catalog_dir, location_name, columns, parent_country=None):
+    """Rows matching `location_name`, trying `columns` in order.
+
+    Mirrors the old pandas lookup: the first column with any match wins, and
+    the parent-country filter is applied to that column's matches only.
+    """
+    index = _load(catalog_dir)["index"]
+    rows = []
+    for column in columns:
+        rows = index["names"].get(column, {}).get(location_name, [])
+        if rows:
+            break
+
+    if rows and parent_country:
+        parents = index["columns"].get(PARENT_COLUMN)
+        if parents is not None:
+            rows = [row for row in rows if parents[row] == parent_country]
+    return rows
+
+
+def lookup(catalog_dir, location_name, columns, parent_country=None):
+    rows = find_rows(catalog_dir, location_name, columns, parent_country)
+    if not rows:
+        return None
+    return read_feature(catalog_dir, rows[0])
+
+
+def names(catalog_dir, column, parent_country=None):
+    """Every name in `column`, or only those of rows under `parent_country`."""
+    index = _load(catalog_dir)["index"]
+    parents = index["columns"].get(PARENT_COLUMN)
+    found = []
+    for name, rows in index["names"].get(column, {}).items():
+        if parent_country is None or (parents is not None and any(parents[row] == parent_country for row in rows)):
+            found.append(name)
+    return sorted(found)
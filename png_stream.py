@@ -0,0 +1,95 @@
+import struct
+import zlib
+
+import numpy as np
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+IDAT_CHUNK_SIZE = 1024 * 1024
+
+
+class PngStreamWriter:
+    """Write a grayscale PNG row strip by row strip.
+
+    PIL needs the whole image in memory before it can save it. This writer
+    only keeps the previous row (for the "Up" filter) and the deflate state,
+    so images of any height can be written with a fixed amount of memory.
+    Supports 8-bit (uint8) and 16-bit (uint16) grayscale.
+    """
+
+    def __init__(self, path, width, height, bit_depth, compress_level=6):
+        if bit_depth not in (8, 16):
+            raise ValueError("bit_depth must be 8 or 16")
+        self.path = path
+        self.width = width
+        self.height = height
+        self.bit_depth = bit_depth
+        self.dtype = np.dtype(">u2") if bit_depth == 16 else np.dtype("u1")
+        self.rows_written = 0
+        self._prev = np.zeros(width * self.dtype.itemsize, dtype=np.uint8)
+        self._compressor = zlib.compressobj(compress_level)
+        self._pending = []
+        self._pending_size = 0
+
+        self._file = open(path, 'wb')
+        self._file.write(PNG_SIGNATURE)
+        # Color type 0 = grayscale
+        self._write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, bit_depth, 0, 0, 0, 0))
+
+    def _write_chunk(self, kind, data):
+        self._file.write(struct.pack(">I", len(data)))
+        self._file.write(kind)
+        self._file.write(data)
+        self._file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind)) & 0xFFFFFFFF))
+
+    def _queue(self, data):
+        if not data:
+            return
+        self._pending.append(data)
+        self._pending_size += len(data)
+        if self._pending_size >= IDAT_CHUNK_SIZE:
+            self._flush_idat()
+
+    def _flush_idat(self):
+        if self._pending:
+            self._write_chunk(b"IDAT", b"".join(self._pending))
+            self._pending = []
+            self._pending_size = 0
+
+    def write_rows(self, rows):
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        if rows.ndim != 2 or rows.shape[1] != self.width:
+            raise ValueError(f"Expected rows of width {self.width}, got {rows.shape}")
+        if self.rows_written + rows.shape[0] > self.height:
+            raise ValueError("More rows than the declared image height")
+
+        raw = rows.view(np.uint8).reshape(rows.shape[0], -1)
+        # "Up" filter: each byte minus the byte above it, wrapping mod 256
+        filtered = np.empty((raw.shape[0], raw.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = 2
+        filtered[0, 1:] = raw[0] - self._prev
+        filtered[1:, 1:] = raw[1:] - raw[:-1]
+        self._prev = raw[-1].copy()
+
+        self._queue(self._compressor.compress(filtered.tobytes()))
+        self.rows_written += rows.shape[0]
+
+    def close(self):
+        if self._file.closed:
+            return
+        try:
+            if self.rows_written != self.height:
+                raise ValueError(f"Wrote {self.rows_written} rows, expected {self.height}")
+            self._queue(self._compressor.flush())
+            self._flush_idat()
+            self._write_chunk(b"IEND", b"")
+        finally:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
@@ -1,40 +1,152 @@
+import argparse
 import os
 import zipfile
 import requests
-import geopandas as gpd
 # import elevation 
 import rasterio
 from rasterio.mask import mask
 from rasterio.merge import merge
 from rasterio.enums import Resampling
-import shapely
+from rasterio.features import geometry_window
+from rasterio.windows import Window
 import numpy as np
 from pathlib import Path
-import shutil
 import math
 import json
 from PIL import Image
 
+import location_catalog
+import artifact_cache
+import block_export
+import clip_engine
+import exr_stream
+import progress
+import render_profiles
+import terrain_mesh
+import tile_cache
+import tile_downloader
+import vrt_mosaic
+
 # Config
 DATA_DIR = Path("data")
-EXISTING_CACHE_DIR = Path("../map_render/data/dem/srtm_cache_tif").resolve() 
+# SRTM tiles, shared by every job (see tile_cache.py); `tile_cache_dir` overrides it
+DEFAULT_TILE_CACHE_DIR = DATA_DIR / "srtm_cache"
+# Where tiles were kept before the cache was configurable, still used when it exists
+LEGACY_TILE_CACHE_DIR = Path("../map_render/data/dem/srtm_cache_tif")
 COUNTRIES_SHP_URL = "https://naciscdn.org/naturalearth/10m/cultural/ne_10m_admin_0_countries.zip"
 REGIONS_SHP_URL = "https://naciscdn.org/naturalearth/10m/cultural/ne_10m_admin_1_states_provinces.zip"
 
+MAX_DIM = 16384 # Limit texture size to 16k to prevent Memory Errors
+# Heightmap pixels per pixel of the render's longest side; displacement needs some oversampling
+HEIGHTMAP_HEADROOM = 1.5
+
 CONFIG_PATH = Path("config.json")
-with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-    config = json.load(f)
+ARTIFACT_DIR = DATA_DIR / "artifacts"
 
-LOCATION_NAME = config.get("location_name", "South Korea")
-LOCATION_TYPE = config.get("location_type", "country") # country or region
-PARENT_COUNTRY = config.get("parent_country", None) # Optional, mainly for regions
-COLORS = config.get("colors", {})
+def prepare_options(config):
+    """Every setting that changes the prepared pixels or files, with its default.
+
+    configure() takes these settings from here, and the artifact cache key
+    and backend.py's request key are both built from it, so neither can
+    miss a setting that changes the output.
+    """
+    # Output texture size (never above MAX_DIM).
+    # By default it follows the render profile: a 3000 px render needs no 16k texture.
+    if "target_max_dim" in config:
+        max_dim = min(MAX_DIM, config["target_max_dim"])
+    elif config.get("heightmap_size", "render") == "render":
+        render_dim = max(render_profiles.resolve(config)["resolution"])
+        headroom = config.get("heightmap_headroom", HEIGHTMAP_HEADROOM)
+        max_dim = min(MAX_DIM, math.ceil(render_dim * headroom))
+    else:
+        max_dim = MAX_DIM
+    mesh_mode = config.get("mesh_mode", "displace") # "displace" (Blender subdivides a plane) or "rtin" (prebuilt mesh)
+    rtin = mesh_mode == "rtin"
+    return {
+        "max_dim": max_dim,
+        "resolution_aware": config.get("resolution_aware", False), # Every stage reads at the output size
+        # Another mirror may serve different data
+        "srtm_base_url": config.get("srtm_base_url", tile_downloader.SRTM_BASE_URL),
+        # COG overviews change what decimated reads return
+        "tile_storage": config.get("tile_storage", "tif"), # "tif" (extract), "zip" (read in place) or "cog"
+        "mosaic_mode": config.get("mosaic_mode", "merge"), # "merge" (write _merged.tif) or "vrt"
+        "clip_mode": config.get("clip_mode", "mask"), # "mask" (whole window at once) or "windowed"
+        "clip_block_size": config.get("clip_block_size", clip_engine.DEFAULT_BLOCK_SIZE),
+        "pipeline_mode": config.get("pipeline_mode", "staged"), # "staged" (GeoTIFF per stage) or "streaming"
+        "export_mode": config.get("export_mode", "array"), # "array" (whole raster in RAM) or "blocks"
+        # Sets the strips blocks mode reads, and so where decimated reads are split
+        # (independently of export_workers, see block_export.MAX_STRIPS_IN_FLIGHT)
+        "export_memory_mb": config.get("export_memory_mb", block_export.DEFAULT_MEMORY_MB),
+        "heightmap_format": config.get("heightmap_format", "png"), # "png" (16-bit), "exr" (float) or "exr16" (half float, lossy)
+        "mesh_mode": mesh_mode,
+        # Only the prebuilt mesh depends on these
+        "mesh_max_error": config.get("mesh_max_error", terrain_mesh.DEFAULT_MAX_ERROR) if rtin else None,
+        "mesh_grid_size": config.get("mesh_grid_size", terrain_mesh.DEFAULT_GRID_SIZE) if rtin else None,
+    }
+
+def configure(config, job_dir=None):
+    """Apply a job's settings. Everything the job writes goes to `job_dir`
+    (data/dem when no job directory is given); shapefiles, the catalog,
+    the tile cache and the artifact cache stay shared."""
+    global WORK_DIR, OUTPUT_MAX_DIM, RESOLUTION_AWARE, PREPARE_OPTIONS
+    global LOCATION_NAME, LOCATION_TYPE, PARENT_COUNTRY, COLORS
+    global SRTM_BASE_URL, DOWNLOAD_WORKERS, TILE_STORAGE, MOSAIC_MODE, CLIP_MODE, CLIP_BLOCK_SIZE
+    global PIPELINE_MODE, DEBUG_INTERMEDIATES, EXPORT_MODE, EXPORT_MEMORY_MB, EXPORT_WORKERS
+    global ARTIFACT_CACHE, ARTIFACT_CACHE_MB, HEIGHTMAP_FORMAT, MESH_MODE, MESH_MAX_ERROR, MESH_GRID_SIZE
+    global TILE_CACHE_DIR, TILE_CACHE_MB, TILE_CACHE
+    
+    WORK_DIR = Path(job_dir) if job_dir else DATA_DIR / "dem"
+    
+    PREPARE_OPTIONS = options = prepare_options(config)
+    OUTPUT_MAX_DIM = options["max_dim"]
+    RESOLUTION_AWARE = options["resolution_aware"]
+    SRTM_BASE_URL = options["srtm_base_url"]
+    TILE_STORAGE = options["tile_storage"]
+    MOSAIC_MODE = options["mosaic_mode"]
+    CLIP_MODE = options["clip_mode"]
+    CLIP_BLOCK_SIZE = options["clip_block_size"]
+    PIPELINE_MODE = options["pipeline_mode"]
+    EXPORT_MODE = options["export_mode"]
+    EXPORT_MEMORY_MB = options["export_memory_mb"]
+    HEIGHTMAP_FORMAT = options["heightmap_format"]
+    MESH_MODE = options["mesh_mode"]
+    MESH_MAX_ERROR = options["mesh_max_error"]
+    MESH_GRID_SIZE = options["mesh_grid_size"]
+    
+    LOCATION_NAME = config.get("location_name", "South Korea")
+    LOCATION_TYPE = config.get("location_type", "country") # country or region
+    PARENT_COUNTRY = config.get("parent_country", None) # Optional, mainly for regions
+    COLORS = config.get("colors", {})
+    DOWNLOAD_WORKERS = config.get("download_workers", tile_downloader.DEFAULT_WORKERS)
+    if config.get("tile_cache_dir"):
+        TILE_CACHE_DIR = Path(config["tile_cache_dir"]).resolve()
+    elif LEGACY_TILE_CACHE_DIR.exists():
+        TILE_CACHE_DIR = LEGACY_TILE_CACHE_DIR.resolve()
+    else:
+        TILE_CACHE_DIR = DEFAULT_TILE_CACHE_DIR.resolve()
+    TILE_CACHE_MB = config.get("tile_cache_mb", tile_cache.DEFAULT_BUDGET_MB)
+    TILE_CACHE = tile_cache.TileCache(TILE_CACHE_DIR, TILE_STORAGE, SRTM_BASE_URL, DOWNLOAD_WORKERS, TILE_CACHE_MB)
+    DEBUG_INTERMEDIATES = config.get("debug_intermediates", False) # Keep intermediates in streaming mode
+    EXPORT_WORKERS = config.get("export_workers", None) # Defaults to one thread per core
+    ARTIFACT_CACHE = config.get("artifact_cache", True) # Reuse heightmap/mask/metadata of identical jobs
+    ARTIFACT_CACHE_MB = config.get("artifact_cache_mb", artifact_cache.DEFAULT_BUDGET_MB)
+
+# Defaults until main() loads the job's config
+configure({})
+# Grid of the shared batch mosaic the current location is clipped from, if any
+MOSAIC_GRID = None
+
+def load_config(config_path):
+    with open(config_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
 
 def setup_directories():
     DATA_DIR.mkdir(parents=True, exist_ok=True)
     (DATA_DIR / "shapefiles").mkdir(exist_ok=True)
-    (DATA_DIR / "dem").mkdir(exist_ok=True)
-    EXISTING_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    WORK_DIR.mkdir(parents=True, exist_ok=True)
+    (DATA_DIR / "catalog").mkdir(exist_ok=True)
+    ARTIFACT_DIR.mkdir(exist_ok=True)
+    TILE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
 def download_shapefile(url, filename):
     target_zip = DATA_DIR / "shapefiles" / f"{filename}.zip"
@@ -62,71 +174,88 @@ def download_shapefile(url, filename):
         
     return target_shp
 
+def get_catalog(url, filename):
+    shp_path = download_shapefile(url, filename)
+    return location_catalog.ensure_catalog(shp_path, DATA_DIR / "catalog" / filename)
+
 def get_geometry(location_name, location_type, parent_country=None):
     print(f"Finding geometry for {location_name} ({location_type})...")
     
     if location_type == 'region':
-        shp_path = download_shapefile(REGIONS_SHP_URL, "ne_10m_admin_1_states_provinces")
-        gdf = gpd.read_file(shp_path)
+        catalog_dir = get_catalog(REGIONS_SHP_URL, "ne_10m_admin_1_states_provinces")
         
-        # Filter by name
         # Try 'name' first, then 'woe_name', then 'gn_name'
-        matches = gdf[gdf['name'] == location_name]
-        if matches.empty:
-            matches = gdf[gdf['woe_name'] == location_name]
-        if matches.empty:
-            matches = gdf[gdf['gn_name'] == location_name]
-            
         # If parent country is specified, filter by it
-        if not matches.empty and parent_country:
-             matches = matches[matches['admin'] == parent_country]
-             
-        if matches.empty:
+        result = location_catalog.lookup(
+            catalog_dir, location_name, ["name", "woe_name", "gn_name"], parent_country
+        )
+        
+        if result is None:
              raise ValueError(f"Region '{location_name}' not found.")
              
-        result = matches.iloc[0]
-        return result.geometry, result
+        return result
         
     else:
-        shp_path = download_shapefile(COUNTRIES_SHP_URL, "ne_10m_admin_0_countries")
-        gdf = gpd.read_file(shp_path)
+        catalog_dir = get_catalog(COUNTRIES_SHP_URL, "ne_10m_admin_0_countries")
         
-        country = gdf[gdf['ADMIN'] == location_name]
-        if country.empty:
-            country = gdf[gdf['NAME'] == location_name]
+        result = location_catalog.lookup(catalog_dir, location_name, ["ADMIN", "NAME"])
         
-        if country.empty:
+        if result is None:
             raise ValueError(f"Country '{location_name}' not found.")
         
-        return country.iloc[0].geometry, country.iloc[0]
+        return result
 
 def get_cgiar_tiles(minx, miny, maxx, maxy):
-    tiles = []
-    # CGIAR grid: 5x5 degrees.
-    # X matches logic from srtm.csi.cgiar.org
-    # x = (lon + 180) // 5 + 1
-    # y = (60 - lat) // 5 + 1
+    # CGIAR grid: 5x5 degrees, see tile_cache.tiles_in_bbox
+    return tile_cache.tiles_in_bbox(minx, miny, maxx, maxy)
+
+def cached_tile_path(x, y):
+    """Path rasterio can open for a cached tile, or None if it still needs downloading."""
+    return TILE_CACHE.path(x, y)
+
+@progress.stage("download")
+def fetch_tiles(tiles):
+    """Make sure every tile is cached and return the paths to open, in tile order."""
+    tiles_done = progress.Counter("tiles", "download")
+    bytes_done = progress.Counter("bytes", "download")
     
-    # Ensure bounds are within global limits
-    minx = max(-180, minx)
-    maxx = min(180, maxx)
-    miny = max(-60, miny)
-    maxy = min(60, maxy)
+    def plan(count):
+        tiles_done.total = count
+    
+    tile_paths = TILE_CACHE.fetch(
+        tiles,
+        on_plan=plan,
+        on_tile=lambda tile, path: tiles_done.add(),
+        on_bytes=bytes_done.add
+    )
+    bytes_done.finish()
+    return tile_paths
+
+def plan_target_resolution(geometry, tile_paths):
+    """Pixel size every stage should read at, or None for the tiles' native resolution.
 
-    start_x = int((minx + 180) // 5) + 1
-    end_x = int((maxx + 180) // 5) + 1
+    Worked out from the geometry bounds before anything is merged or clipped,
+    so continent-sized jobs never touch pixels the final texture cannot show.
+    """
+    if not RESOLUTION_AWARE:
+        return None
     
-    # Y index: Top is Y=1 (60 deg N), Bottom is Y=24 (-60 S)
-    # y = (60 - lat) / 5
-    # Max Lat corresponds to Min Y index (Higher up)
-    start_y = int((60 - maxy) // 5) + 1
-    end_y = int((60 - miny) // 5) + 1
+    with rasterio.open(tile_paths[0]) as src:
+        native_x, native_y = src.res
     
-    for x in range(start_x, end_x + 1):
-        for y in range(start_y, end_y + 1):
-            tiles.append((x, y))
+    minx, miny, maxx, maxy = geometry.bounds
+    native_w = (maxx - minx) / native_x
+    native_h = (maxy - miny) / native_y
+    # The clip window can round outward by a pixel on each side, keep room for that
+    target_dim = OUTPUT_MAX_DIM - 2
+    if max(native_w, native_h) <= target_dim:
+        return None
     
-    return tiles
+    factor = max(native_w, native_h) / target_dim
+    out_w, out_h = math.ceil(native_w / factor), math.ceil(native_h / factor)
+    res = (native_x * factor, native_y * factor)
+    print(f"Reading at {res[0]:.6f} x {res[1]:.6f} (target about {out_w}x{out_h})")
+    return res
 
 def download_dem_manual(geometry, country_name):
     bounds = geometry.bounds 
@@ -134,62 +263,29 @@ def download_dem_manual(geometry, country_name):
     
     minx, miny, maxx, maxy = bounds
     tiles = get_cgiar_tiles(minx, miny, maxx, maxy)
-    downloaded_tiffs = []
     
     print(f"Required Tiles (CGIAR 5x5): {tiles}")
     
-    headers = {'User-Agent': 'Mozilla/5.0'}
-
-    for x, y in tiles:
-        filename = f"srtm_{x:02d}_{y:02d}"
-        zip_name = f"{filename}.zip"
-        tif_name = f"{filename}.tif"
-        
-        local_zip = EXISTING_CACHE_DIR / zip_name
-        local_tif = EXISTING_CACHE_DIR / tif_name
-        
-        # Check if TIF exists
-        if local_tif.exists():
-             print(f"Tile {tif_name} found in cache.")
-             downloaded_tiffs.append(local_tif)
-             continue
-             
-        # Download Zip
-        url = f"https://srtm.csi.cgiar.org/wp-content/uploads/files/srtm_5x5/TIFF/{zip_name}"
-        print(f"Downloading {url}...")
-        try:
-             response = requests.get(url, headers=headers, stream=True)
-             if response.status_code == 200:
-                with open(local_zip, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=1024*1024):
-                        f.write(chunk)
-                
-                print(f"Extracting {zip_name}...")
-                with zipfile.ZipFile(local_zip, 'r') as zip_ref:
-                    zip_ref.extract(tif_name, path=EXISTING_CACHE_DIR)
-                
-                downloaded_tiffs.append(local_tif)
-                # Cleanup zip
-                if local_zip.exists():
-                    local_zip.unlink()
-             else:
-                 print(f"Failed to download {url} (Status {response.status_code})")
-        except Exception as e:
-             print(f"Exception downloading {url}: {e}")
-             continue
+    downloaded_tiffs = fetch_tiles(tiles)
     
     if not downloaded_tiffs:
-        # Fallback loop - check if we downloaded anything this session or previous
-        # Re-check cache
-        downloaded_tiffs = []
-        for x, y in tiles:
-             tif_name = f"srtm_{x:02d}_{y:02d}.tif"
-             local_tif = EXISTING_CACHE_DIR / tif_name
-             if local_tif.exists():
-                  downloaded_tiffs.append(local_tif)
-        
-        if not downloaded_tiffs:
-            raise Exception("No DEM tiles available for merging.")
+        raise Exception("No DEM tiles available for merging.")
+    
+    target_res = plan_target_resolution(geometry, downloaded_tiffs)
+
+    return build_mosaic(downloaded_tiffs, country_name, target_res)
+
+@progress.stage("mosaic")
+def build_mosaic(downloaded_tiffs, country_name, target_res):
+    if MOSAIC_MODE == "vrt":
+        # Lightweight virtual mosaic, pixels are only read when clip_dem asks for its window
+        print("Building virtual mosaic...")
+        output_path = vrt_mosaic.build_vrt(
+            downloaded_tiffs, WORK_DIR / f"{country_name}_mosaic.vrt",
+            resolution=target_res
+        )
+        print(f"Virtual mosaic saved to {output_path}")
+        return output_path
 
     # Merge
     print("Merging tiles...")
@@ -206,7 +302,10 @@ def download_dem_manual(geometry, country_name):
     if not src_files_to_mosaic:
         raise Exception("No valid raster files to merge.")
 
-    mosaic, out_trans = merge(src_files_to_mosaic)
+    if target_res is not None:
+        mosaic, out_trans = merge(src_files_to_mosaic, res=target_res, resampling=Resampling.bilinear)
+    else:
+        mosaic, out_trans = merge(src_files_to_mosaic)
     
     # Close files
     for src in opened_files:
@@ -219,15 +318,30 @@ def download_dem_manual(geometry, country_name):
                      "width": mosaic.shape[2],
                      "transform": out_trans})
                      
-    output_path = DATA_DIR / "dem" / f"{country_name}_merged.tif"
+    output_path = WORK_DIR / f"{country_name}_merged.tif"
     with rasterio.open(output_path, "w", **out_meta) as dest:
         dest.write(mosaic)
     
     print(f"Merged DEM saved to {output_path}")
     return output_path
 
+@progress.stage("clip")
 def clip_dem(dem_path, geometry, country_name):
     print(f"Clipping DEM to {country_name} shape...")
+    clipped_path = WORK_DIR / f"{country_name}_clipped.tif"
+    
+    if CLIP_MODE == "windowed":
+        blocks = progress.Counter("blocks", "clip")
+        
+        def on_block(block, total):
+            blocks.total = total
+            blocks.add()
+        
+        clip_engine.clip_windowed(dem_path, geometry, clipped_path, block_size=CLIP_BLOCK_SIZE,
+                                  on_block=on_block)
+        print(f"Clipped DEM saved to {clipped_path}")
+        return clipped_path
+    
     with rasterio.open(dem_path) as src:
         out_image, out_transform = mask(src, [geometry], crop=True)
         out_meta = src.meta.copy()
@@ -237,28 +351,36 @@ def clip_dem(dem_path, geometry, country_name):
                      "width": out_image.shape[2],
                      "transform": out_transform})
                      
-    clipped_path = DATA_DIR / "dem" / f"{country_name}_clipped.tif"
     with rasterio.open(clipped_path, "w", **out_meta) as dest:
         dest.write(out_image)
         
     print(f"Clipped DEM saved to {clipped_path}")
     return clipped_path
 
+def export_shape(h, w):
+    """Output (height, width) once the texture size cap is applied."""
+    if max(h, w) > OUTPUT_MAX_DIM:
+        scale = OUTPUT_MAX_DIM / max(h, w)
+        return int(h * scale), int(w * scale)
+    return h, w
+
+@progress.stage("export")
 def export_for_blender(dem_path, geometry, attributes, name):
     print("Exporting for Blender...")
     
-    MAX_DIM = 16384 # Limit texture size to 16k to prevent Memory Errors
+    if EXPORT_MODE == "blocks":
+        with rasterio.open(dem_path) as src:
+            window = Window(0, 0, src.width, src.height)
+        export_blocks_for_blender(dem_path, window, geometry, attributes, name)
+        return
     
     with rasterio.open(dem_path) as src:
         # Check dimensions
         h, w = src.height, src.width
         
         # Determine strict downsampling scale
-        scale = 1.0
-        if max(h, w) > MAX_DIM:
-            scale = MAX_DIM / max(h, w)
-            new_h = int(h * scale)
-            new_w = int(w * scale)
+        new_h, new_w = export_shape(h, w)
+        if (new_h, new_w) != (h, w):
             print(f"Image too large ({w}x{h}), downsampling to ({new_w}x{new_h})...")
             
             data = src.read(
@@ -268,109 +390,320 @@ def export_for_blender(dem_path, geometry, attributes, name):
             )
         else:
             data = src.read(1)
+        crs = src.crs
+    
+    write_blender_outputs(data, crs, geometry, attributes, name)
 
-        # Stats
-        valid_mask = data > -10000
-        if np.any(valid_mask):
-            min_elev = np.nanmin(data[valid_mask])
-            max_elev = np.nanmax(data[valid_mask])
-        else:
-            min_elev = 0
-            max_elev = 1
-            
-        print(f"Elevation Range: {min_elev} to {max_elev}")
-        
-        # Clamp data to min_elev to avoid negative wrap-around for NoData
-        data_clamped = np.where(valid_mask, data, min_elev) 
-        
+def export_blocks_for_blender(dem_path, window, geometry, attributes, name, clip_geometry=None):
+    """Out-of-core export: bounded memory and all cores, whatever the raster size."""
+    out_height, out_width = export_shape(int(window.height), int(window.width))
+    reader = block_export.StripReader(dem_path, window, (out_height, out_width), geometry=clip_geometry)
+    strips = progress.Counter("blocks", "export")
+    
+    def on_strip(strip, total):
+        strips.total = total
+        strips.add()
+    
+    heightmap_path = heightmap_file(name)
+    mask_path = WORK_DIR / f"{name}_mask.png"
+    min_elev, max_elev = block_export.export_blocks(
+        reader, heightmap_path, mask_path,
+        memory_mb=EXPORT_MEMORY_MB,
+        workers=EXPORT_WORKERS,
+        on_strip=on_strip,
+        heightmap_format=HEIGHTMAP_FORMAT
+    )
+    print(f"Elevation Range: {min_elev} to {max_elev}")
+    
+    write_metadata(geometry, attributes, name, min_elev, max_elev, out_width, out_height, reader.crs)
+    print(f"Exported heightmap to {heightmap_path}")
+
+def heightmap_file(name):
+    suffix = ".png" if HEIGHTMAP_FORMAT == "png" else ".exr"
+    return WORK_DIR / f"{name}_heightmap{suffix}"
+
+def mesh_file(name):
+    return WORK_DIR / f"{name}_terrain.ply"
+
+@progress.stage("mesh")
+def build_terrain_mesh(name):
+    """Triangulate the exported heightmap for render_map.py's "rtin" mesh mode."""
+    terrain_mesh.mesh_from_files(
+        heightmap_file(name), WORK_DIR / f"{name}_mask.png", mesh_file(name),
+        max_error=MESH_MAX_ERROR, grid_size=MESH_GRID_SIZE
+    )
+
+def write_blender_outputs(data, crs, geometry, attributes, name):
+    """Normalize an elevation array and write the heightmap, mask and metadata."""
+    # Stats
+    valid_mask = data > -10000
+    if np.any(valid_mask):
+        min_elev = np.nanmin(data[valid_mask])
+        max_elev = np.nanmax(data[valid_mask])
+    else:
+        min_elev = 0
+        max_elev = 1
+
+    print(f"Elevation Range: {min_elev} to {max_elev}")
+
+    # Clamp data to min_elev to avoid negative wrap-around for NoData
+    data_clamped = np.where(valid_mask, data, min_elev) 
+
+    range_val = max_elev - min_elev
+    if range_val == 0: range_val = 1
+
+    # Create Mask (where data is not nan and not nodata)
+    mask_arr = (valid_mask).astype(np.uint8) * 255
+
+    # Save Heightmap
+    heightmap_path = heightmap_file(name)
+    if HEIGHTMAP_FORMAT == "png":
         # Normalize to 0-65535 for 16-bit PNG
-        range_val = max_elev - min_elev
-        if range_val == 0: range_val = 1
-        
         normalized = ((data_clamped - min_elev) / range_val * 65535)
         normalized = np.nan_to_num(normalized, nan=0).astype(np.uint16)
-        
-        # Create Mask (where data is not nan and not nodata)
-        mask_arr = (valid_mask).astype(np.uint8) * 255
-        
-        # Save Heightmap
-        heightmap_path = DATA_DIR / "dem" / f"{name}_heightmap.png"
         Image.fromarray(normalized, mode='I;16').save(heightmap_path)
-        
-        # Save Mask
-        mask_path = DATA_DIR / "dem" / f"{name}_mask.png"
-        Image.fromarray(mask_arr, mode='L').save(mask_path)
-        
-        # Get actual dimensions for metadata
-        out_height, out_width = data.shape
-
-        # Metadata Logic
-        local_name = attributes.get('name_local', name)
-        if hasattr(local_name, 'isnull') and local_name.isnull(): # check if pandas series/value is null
-             local_name = name
-        elif not local_name:
-             local_name = name
-             
-        # Fallback table
-        if name == "Greece":
-            local_name = "ΕΛΛΗΝΙΚΉ ΔΗΜΟΚΡΑΤÍA"
-        elif name == "South Korea":
-            local_name = "대한민국"
-        elif name == "Algeria":
-            local_name = "الجمهورية الجزائرية"
-        elif LOCATION_TYPE == 'region':
-             # Try to get local name from region attributes if available
-             pass
-
-        english_name = attributes.get('name_en', name)
-        if not english_name:
-             english_name = attributes.get('name', name)
-
-        if name == "South Korea": 
-             english_name = "REPUBLIC OF KOREA"
-        elif name == "Algeria":
-             english_name = "PEOPLE'S DEMOCRATIC REPUBLIC OF ALGERIA"
-        
-        # Sanitize text
-        if isinstance(local_name, str): local_name = local_name.strip()
-        if isinstance(english_name, str): english_name = english_name.upper().strip()
-
-        # Calculate center lat for projection correction
-        bounds = geometry.bounds
-        center_lat = (bounds[1] + bounds[3]) / 2
-
-        metadata = {
-            "country_name": name,
-            "local_name": local_name,
-            "english_name": english_name,
-            "min_elevation": float(min_elev),
-            "max_elevation": float(max_elev),
-            "width": out_width,
-            "height": out_height,
-            "center_lat": center_lat,
-            "crs": str(src.crs),
-            "colors": COLORS 
-        }
-        
-        json_path = DATA_DIR / "dem" / "metadata.json"
-        with open(json_path, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, indent=2, ensure_ascii=False)
-            
-        print(f"Exported heightmap to {heightmap_path}")
-        print(f"Exported metadata to {json_path}")
+    else:
+        # Normalize to 0-1 floats
+        normalized = np.nan_to_num((data_clamped - min_elev) / range_val, nan=0)
+        exr_stream.write_exr(heightmap_path, normalized, exr_stream.PIXEL_TYPES[HEIGHTMAP_FORMAT])
+
+    # Save Mask
+    mask_path = WORK_DIR / f"{name}_mask.png"
+    Image.fromarray(mask_arr, mode='L').save(mask_path)
+
+    # Get actual dimensions for metadata
+    out_height, out_width = data.shape
+    
+    write_metadata(geometry, attributes, name, min_elev, max_elev, out_width, out_height, crs)
+    print(f"Exported heightmap to {heightmap_path}")
+
+def write_metadata(geometry, attributes, name, min_elev, max_elev, out_width, out_height, crs):
+    # Metadata Logic
+    local_name = attributes.get('name_local', name)
+    if hasattr(local_name, 'isnull') and local_name.isnull(): # check if pandas series/value is null
+         local_name = name
+    elif not local_name:
+         local_name = name
+
+    # Fallback table
+    if name == "Greece":
+        local_name = "ΕΛΛΗΝΙΚΉ ΔΗΜΟΚΡΑΤÍA"
+    elif name == "South Korea":
+        local_name = "대한민국"
+    elif name == "Algeria":
+        local_name = "الجمهورية الجزائرية"
+    elif LOCATION_TYPE == 'region':
+         # Try to get local name from region attributes if available
+         pass
+
+    english_name = attributes.get('name_en', name)
+    if not english_name:
+         english_name = attributes.get('name', name)
+
+    if name == "South Korea": 
+         english_name = "REPUBLIC OF KOREA"
+    elif name == "Algeria":
+         english_name = "PEOPLE'S DEMOCRATIC REPUBLIC OF ALGERIA"
+
+    # Sanitize text
+    if isinstance(local_name, str): local_name = local_name.strip()
+    if isinstance(english_name, str): english_name = english_name.upper().strip()
+
+    # Calculate center lat for projection correction
+    bounds = geometry.bounds
+    center_lat = (bounds[1] + bounds[3]) / 2
+
+    metadata = {
+        "country_name": name,
+        "local_name": local_name,
+        "english_name": english_name,
+        "min_elevation": float(min_elev),
+        "max_elevation": float(max_elev),
+        "width": out_width,
+        "height": out_height,
+        "heightmap": heightmap_file(name).name,
+        "mesh": mesh_file(name).name if MESH_MODE == "rtin" else None,
+        "center_lat": center_lat,
+        "crs": str(crs),
+        "colors": COLORS 
+    }
+
+    json_path = WORK_DIR / "metadata.json"
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, indent=2, ensure_ascii=False)
+
+    print(f"Exported metadata to {json_path}")
+
+def stream_for_blender(geometry, attributes, name):
+    """Fused merge -> clip -> downsample -> export with no intermediate GeoTIFFs.
+
+    The crop window is read once from a virtual mosaic over the cached tiles,
+    already at the final texture resolution, masked in memory and handed
+    straight to the PNG writers.
+    """
+    print("Streaming tiles to Blender export...")
+    tiles = get_cgiar_tiles(*geometry.bounds)
+    print(f"Required Tiles (CGIAR 5x5): {tiles}")
+    
+    tile_paths = fetch_tiles(tiles)
+    if not tile_paths:
+        raise Exception("No DEM tiles available for merging.")
+    
+    with progress.stage("mosaic"):
+        vrt_path = vrt_mosaic.build_vrt(
+            tile_paths, WORK_DIR / f"{name}_mosaic.vrt",
+            resolution=plan_target_resolution(geometry, tile_paths)
+        )
+    
+    stream_export(vrt_path, geometry, attributes, name)
+
+@progress.stage("export")
+def stream_export(vrt_path, geometry, attributes, name):
+    if EXPORT_MODE == "blocks" and not DEBUG_INTERMEDIATES:
+        with rasterio.open(vrt_path) as src:
+            window = geometry_window(src, [geometry])
+            window = Window(int(window.col_off), int(window.row_off), int(window.width), int(window.height))
+            # Mask each strip on the output grid with an outline simplified to that grid
+            out_height, out_width = export_shape(int(window.height), int(window.width))
+            res = (src.res[0] * window.width / out_width, src.res[1] * window.height / out_height)
+        clip_geometry = clip_engine.simplify_for_resolution(geometry, res)
+        export_blocks_for_blender(vrt_path, window, geometry, attributes, name, clip_geometry=clip_geometry)
+        return
+    
+    data, crs, transform, nodata = clip_engine.read_clipped(vrt_path, geometry, export_shape)
+    print(f"Read clipped DEM at {data.shape[1]}x{data.shape[0]}")
+    
+    if DEBUG_INTERMEDIATES:
+        clipped_path = WORK_DIR / f"{name}_clipped.tif"
+        with rasterio.open(clipped_path, "w", driver="GTiff", height=data.shape[0], width=data.shape[1],
+                           count=1, dtype=data.dtype, crs=crs, transform=transform, nodata=nodata) as dest:
+            dest.write(data, 1)
+        print(f"Debug: clipped DEM saved to {clipped_path}")
+    
+    write_blender_outputs(data, crs, geometry, attributes, name)
+
+def artifact_params(geometry):
+    """Everything the prepared heightmap, mask and metadata depend on."""
+    tiles = get_cgiar_tiles(*geometry.bounds)
+    return {
+        "location_name": LOCATION_NAME,
+        "location_type": LOCATION_TYPE,
+        "parent_country": PARENT_COUNTRY,
+        # Only the tiles actually available, so a tile that shows up later changes the key
+        "tiles": [tile_downloader.tile_name(x, y) for x, y in tiles if cached_tile_path(x, y) is not None],
+        "options": PREPARE_OPTIONS,
+        # A batch group's shared mosaic can be finer than this location alone would read
+        "mosaic_grid": MOSAIC_GRID,
+    }
+
+def mosaic_grid(mosaic_path):
+    """Pixel size and origin of a mosaic: locations clipped from it are read on that grid."""
+    with rasterio.open(mosaic_path) as src:
+        return [*src.res, src.bounds.left, src.bounds.top]
+
+def artifact_files(name):
+    files = {
+        "heightmap" + heightmap_file(name).suffix: heightmap_file(name),
+        "mask.png": WORK_DIR / f"{name}_mask.png",
+        "metadata.json": WORK_DIR / "metadata.json",
+    }
+    if MESH_MODE == "rtin":
+        files["terrain.ply"] = mesh_file(name)
+    return files
+
+def restore_cached_artifacts(geometry, name):
+    key = artifact_cache.cache_key(artifact_params(geometry))
+    entry_dir = artifact_cache.lookup(ARTIFACT_DIR, key)
+    if entry_dir is None:
+        return False
+    
+    files = artifact_files(name)
+    try:
+        artifact_cache.restore(entry_dir, files)
+    except OSError as e:
+        # Evicted by another job between the lookup and the copy: prepare as on a miss
+        print(f"Cached artifacts {key[:12]} went away ({e}), preparing them again.")
+        for target in files.values():
+            Path(target).unlink(missing_ok=True)
+        return False
+    print(f"Prepared artifacts found in cache ({key[:12]}).")
+    
+    # Colors are a render setting and not part of the key
+    with open(files["metadata.json"], 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+    metadata["colors"] = COLORS
+    with open(files["metadata.json"], 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, indent=2, ensure_ascii=False)
+    return True
+
+def store_artifacts(geometry, name):
+    params = artifact_params(geometry)
+    key = artifact_cache.cache_key(params)
+    artifact_cache.store(ARTIFACT_DIR, key, artifact_files(name), params=params, budget_mb=ARTIFACT_CACHE_MB)
+    print(f"Prepared artifacts cached ({key[:12]}).")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Download, clip and export the DEM for one location.")
+    parser.add_argument("--job-dir", default=os.environ.get("ANYMAPS_JOB_DIR"),
+                        help="Directory for this job's outputs (reads <job-dir>/config.json by default)")
+    parser.add_argument("--config", default=os.environ.get("ANYMAPS_CONFIG"),
+                        help="Config file to use instead of the default one")
+    return parser.parse_args(argv)
 
-def main():
+def run(config, job_dir=None, location=None, mosaic_path=None):
+    """Prepare one location. batch.py passes the (geometry, attributes) it already
+    looked up and a mosaic shared by several locations to clip from."""
+    global MOSAIC_GRID
+    configure(config, job_dir)
+    MOSAIC_GRID = mosaic_grid(mosaic_path) if mosaic_path is not None else None
     setup_directories()
     
-    geometry, attributes = get_geometry(LOCATION_NAME, LOCATION_TYPE, PARENT_COUNTRY)
+    if location is None:
+        with progress.stage("geometry"):
+            geometry, attributes = get_geometry(LOCATION_NAME, LOCATION_TYPE, PARENT_COUNTRY)
+    else:
+        geometry, attributes = location
     
-    dem_path = download_dem_manual(geometry, LOCATION_NAME)
+    use_cache = ARTIFACT_CACHE and not DEBUG_INTERMEDIATES
+    if use_cache:
+        with progress.stage("cache_lookup"):
+            restored = restore_cached_artifacts(geometry, LOCATION_NAME)
+        if restored:
+            print("Data preparation finished successfully.")
+            return
     
-    clipped_dem = clip_dem(dem_path, geometry, LOCATION_NAME)
+    if mosaic_path is not None:
+        stream_export(mosaic_path, geometry, attributes, LOCATION_NAME)
+    elif PIPELINE_MODE == "streaming":
+        stream_for_blender(geometry, attributes, LOCATION_NAME)
+    else:
+        dem_path = download_dem_manual(geometry, LOCATION_NAME)
+        
+        clipped_dem = clip_dem(dem_path, geometry, LOCATION_NAME)
+        
+        export_for_blender(clipped_dem, geometry, attributes, LOCATION_NAME)
+    
+    if MESH_MODE == "rtin":
+        build_terrain_mesh(LOCATION_NAME)
     
-    export_for_blender(clipped_dem, geometry, attributes, LOCATION_NAME)
+    if use_cache:
+        with progress.stage("cache_store"):
+            store_artifacts(geometry, LOCATION_NAME)
     
     print("Data preparation finished successfully.")
 
+def main(argv=None):
+    args = parse_args(argv)
+    job_dir = Path(args.job_dir) if args.job_dir else None
+    
+    if args.config:
+        config_path = Path(args.config)
+    elif job_dir is not None:
+        config_path = job_dir / "config.json"
+    else:
+        config_path = CONFIG_PATH
+    
+    run(load_config(config_path), job_dir)
+
 if __name__ == "__main__":
     main()
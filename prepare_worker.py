@@ -0,0 +1,164 @@
+"""Long-lived worker processes that run data preparation as a function call.
+
+Starting `python prepare_data.py` for every job pays for importing rasterio,
+shapely and numpy and for loading the location catalog each time. Workers in
+this pool do that once when they start and then call prepare_data.run() for
+each job. Everything a job prints (progress events included) is forwarded
+line by line, so callers handle it exactly like a subprocess's stdout.
+"""
+import contextlib
+import multiprocessing
+import queue
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# GDAL block cache kept for the worker's lifetime
+GDAL_CACHE_MB = 512
+
+_env = None
+
+
+class _LineWriter:
+    """File-like object sending complete lines to a queue."""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.buffer = ""
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        with self.lock:
+            self.buffer += text
+            while "\n" in self.buffer:
+                line, self.buffer = self.buffer.split("\n", 1)
+                self.lines.put(line)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        with self.lock:
+            if self.buffer:
+                self.lines.put(self.buffer)
+                self.buffer = ""
+
+
+def enter_gdal_env():
+    """Enter the GDAL settings for the life of the process, so the block cache outlives each job."""
+    global _env
+    import rasterio
+
+    _env = rasterio.Env(GDAL_CACHEMAX=GDAL_CACHE_MB, GDAL_DISABLE_READDIR_ON_OPEN="EMPTY_DIR")
+    _env.__enter__()
+
+
+def _warm_up():
+    """Pool initializer: import the heavy libraries and load the catalogs."""
+    started = time.perf_counter()
+    import prepare_data
+    import location_catalog
+
+    enter_gdal_env()
+
+    prepare_data.setup_directories()
+    for url, filename in ((prepare_data.COUNTRIES_SHP_URL, "ne_10m_admin_0_countries"),
+                          (prepare_data.REGIONS_SHP_URL, "ne_10m_admin_1_states_provinces")):
+        try:
+            location_catalog.preload(prepare_data.get_catalog(url, filename))
+        except Exception as e:
+            # Not fatal: the job will try again (and report) when it needs the catalog
+            print(f"Could not preload catalog {filename}: {e}")
+    print(f"Prepare worker ready in {time.perf_counter() - started:.1f}s")
+
+
+def _ping():
+    return True
+
+
+def _call(fn, args, lines):
+    writer = _LineWriter(lines)
+    try:
+        with contextlib.redirect_stdout(writer):
+            try:
+                return fn(*args)
+            except Exception:
+                traceback.print_exc(file=sys.stdout)
+                raise
+    finally:
+        writer.close()
+        lines.put(None)
+
+
+def _prepare(config, job_dir, location=None, mosaic_path=None):
+    import prepare_data
+
+    prepare_data.run(config, job_dir, location=location, mosaic_path=mosaic_path)
+    return True
+
+
+class PreparePool:
+    """Pool of warm preparation processes.
+
+    What a worker keeps between jobs is its imports, the loaded catalogs and
+    one process-wide rasterio.Env, whose GDAL block cache can still hold
+    blocks of tiles read by earlier jobs. Datasets are not kept open: every
+    job opens its tiles again.
+
+    Uses the "spawn" start method everywhere: the backend is multi-threaded,
+    and forking it could copy a lock held by another thread.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.context = multiprocessing.get_context("spawn")
+        self.manager = self.context.Manager()
+        self.executor = self._new_executor()
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=self.context, initializer=_warm_up)
+
+    def warm(self):
+        """Start every worker now rather than on the first jobs."""
+        for future in [self.executor.submit(_ping) for _ in range(self.workers)]:
+            future.result()
+
+    def call(self, fn, args, on_line):
+        """Run `fn(*args)` in a worker, calling `on_line` for each line it prints.
+
+        Returns fn's result; the worker's exception is re-raised here.
+        """
+        lines = self.manager.Queue()
+        try:
+            future = self.executor.submit(_call, fn, args, lines)
+        except BrokenProcessPool:
+            # A worker died during an earlier job; start a fresh pool
+            self.executor = self._new_executor()
+            future = self.executor.submit(_call, fn, args, lines)
+        while True:
+            try:
+                line = lines.get(timeout=1)
+            except queue.Empty:
+                # A crashed worker never sends the end marker
+                if future.done():
+                    break
+                continue
+            if line is None:
+                break
+            on_line(line)
+        return future.result()
+
+    def run(self, config, job_dir, on_line, location=None, mosaic_path=None):
+        """Prepare one job in a worker (from a batch's mosaic when `mosaic_path` is given).
+
+        Returns True on success; the worker's exception is re-raised here.
+        """
+        return self.call(_prepare, (config, str(job_dir), location, mosaic_path), on_line)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.manager.shutdown()
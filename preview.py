@@ -0,0 +1,141 @@
+"""Quick hillshade preview of a prepared job, without Blender.
+
+    python preview.py [data_dir] [z_scale]
+
+Reads the heightmap (PNG or EXR), <name>_mask.png and metadata.json from the
+directory (data/dem by default) and writes <name>_preview.png next to them.
+Colours come from the same ramp render_map.py builds, the light from the
+same sun, and the relief from the same plane size and displacement scale,
+so the preview looks like a flat-lit version of the final render.
+"""
+import json
+import math
+import sys
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+import exr_stream
+
+# Our own heightmaps, not untrusted uploads: allow the full 16k size
+Image.MAX_IMAGE_PIXELS = None
+# Previews are for the browser: large heightmaps are decimated to this
+PREVIEW_MAX_DIM = 1200
+PREVIEW_PNG_COMPRESSION = 1
+DEFAULT_Z_SCALE = 3.5
+
+# Sun rotation in create_lighting (XYZ euler, degrees)
+SUN_ROTATION = (20, 15, 145)
+# Share of the light that does not depend on the slope (fill light and world)
+AMBIENT = 0.35
+
+# Scene-linear colours, as in render_map.py's material ramp
+DEFAULT_RAMP = [
+    (0.0, (0.95, 0.98, 1.0)),
+    (0.2, (0.6, 0.85, 0.95)),
+    (0.6, (0.1, 0.4, 0.8)),
+    (1.0, (0.02, 0.1, 0.5)),
+]
+BACKGROUND = (0.9, 0.9, 0.9)
+PLANE_WIDTH = 10.0
+
+
+def sun_direction(rotation=SUN_ROTATION):
+    """Unit vector pointing at the sun. A Blender sun shines down its local -Z axis."""
+    a, b, c = (math.radians(v) for v in rotation)
+    # Third column of Rz(c) @ Ry(b) @ Rx(a)
+    return np.array([
+        math.cos(c) * math.sin(b) * math.cos(a) + math.sin(c) * math.sin(a),
+        math.sin(c) * math.sin(b) * math.cos(a) - math.cos(c) * math.sin(a),
+        math.cos(b) * math.cos(a),
+    ], dtype=np.float32)
+
+
+def color_ramp(colors):
+    """Ramp stops (position, rgb) for the configured low/high colours, or the default theme."""
+    if colors and 'low_color' in colors and 'high_color' in colors:
+        low = colors['low_color'][:3]
+        high = colors['high_color'][:3]
+        mid = [(l + h) * 0.5 for l, h in zip(low, high)]
+        return [(0.0, low), (0.5, mid), (1.0, high)]
+    return DEFAULT_RAMP
+
+
+def _srgb_table(size=4096):
+    values = np.linspace(0, 1, size)
+    encoded = np.where(values <= 0.0031308, values * 12.92, 1.055 * np.power(values, 1 / 2.4) - 0.055)
+    return (encoded * 255 + 0.5).astype(np.uint8)
+
+
+# Linear 0-1 -> 8-bit sRGB by table lookup, much cheaper than a per-pixel power
+SRGB_TABLE = _srgb_table()
+
+
+def linear_to_srgb8(values):
+    index = (np.clip(values, 0, 1) * (len(SRGB_TABLE) - 1)).astype(np.intp)
+    return SRGB_TABLE[index]
+
+
+def hillshade(height, mask, colors, z_scale, pixel_size):
+    """RGB uint8 image from a 0-1 height array and a boolean mask."""
+    dx, dy = pixel_size
+    # Rows run north to south, Blender's Y runs south to north
+    dz_drow, dz_dcol = np.gradient(height * np.float32(z_scale))
+    nx = -dz_dcol / dx
+    ny = dz_drow / dy
+    sun = sun_direction()
+    lambert = (nx * sun[0] + ny * sun[1] + sun[2]) / np.sqrt(nx * nx + ny * ny + 1)
+    shade = AMBIENT + (1 - AMBIENT) * np.clip(lambert, 0, 1)
+
+    stops = color_ramp(colors)
+    positions = [p for p, _ in stops]
+    rgb = np.empty(height.shape + (3,), dtype=np.float32)
+    for channel in range(3):
+        rgb[..., channel] = np.interp(height, positions, [c[channel] for _, c in stops]) * shade
+    rgb[~mask] = BACKGROUND
+
+    return linear_to_srgb8(rgb)
+
+
+def make_preview(data_dir, z_scale=DEFAULT_Z_SCALE, out_path=None, max_dim=PREVIEW_MAX_DIM):
+    data_dir = Path(data_dir)
+    with open(data_dir / "metadata.json", 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+    name = metadata['country_name']
+
+    # Decoding the PNGs is most of the cost; decimate before any float work
+    heightmap_path = data_dir / metadata.get('heightmap', f"{name}_heightmap.png")
+    if heightmap_path.suffix == ".exr":
+        # Memory-mapped: only the decimated rows are read
+        height = exr_stream.read_exr(heightmap_path)
+        top = 1
+    else:
+        height = np.asarray(Image.open(heightmap_path))
+        top = 65535
+    factor = max(1, math.ceil(max(height.shape) / max_dim))
+    height = height[::factor, ::factor].astype(np.float32) / top
+    mask = np.asarray(Image.open(data_dir / f"{name}_mask.png"))[::factor, ::factor] > 127
+
+    # Same plane as create_map_mesh: 10 units wide before the latitude correction
+    center_lat = metadata.get('center_lat', 0)
+    lat_correction = 1 / math.cos(math.radians(center_lat)) if math.cos(math.radians(center_lat)) != 0 else 1.0
+    plane_w = PLANE_WIDTH / lat_correction
+    plane_h = PLANE_WIDTH / (metadata['width'] / metadata['height'])
+    pixel_size = (plane_w / height.shape[1], plane_h / height.shape[0])
+
+    image = hillshade(height, mask, metadata.get('colors', {}), z_scale, pixel_size)
+    # Light zlib compression: the preview is written once, read once, and must be quick
+    out_path = Path(out_path) if out_path else data_dir / f"{name}_preview.png"
+    Image.fromarray(image).save(out_path, compress_level=PREVIEW_PNG_COMPRESSION)
+    return out_path
+
+
+def main():
+    data_dir = Path(sys.argv[1]) if len(sys.argv) > 1 else Path("data") / "dem"
+    z_scale = float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_Z_SCALE
+    print(f"Preview saved to {make_preview(data_dir, z_scale)}")
+
+
+if __name__ == "__main__":
+    main()
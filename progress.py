@@ -0,0 +1,133 @@
+"""Machine-readable progress events, one JSON object per line.
+
+prepare_data.py and render_map.py print these among their normal output:
+
+    {"event": "stage_start", "stage": "download"}
+    {"event": "tiles", "stage": "download", "done": 3, "total": 8}
+    {"event": "bytes", "stage": "download", "done": 7340032}
+    {"event": "blocks", "stage": "export", "done": 12, "total": 40}
+    {"event": "stage_end", "stage": "download"}
+
+The backend turns them into percent complete and ETA per stage. Cycles
+does not speak this protocol, so its "Sample x/y" lines are parsed here
+too. Standard library only: render_map.py imports it inside Blender.
+"""
+import contextlib
+import json
+import re
+import sys
+import threading
+import time
+
+# Counters emit at most this often, plus once when they reach their total
+MIN_INTERVAL = 0.25
+
+CYCLES_SAMPLES = re.compile(r"\bSample (\d+)/(\d+)")
+CYCLES_TILES = re.compile(r"\bRendered (\d+)/(\d+) Tiles")
+
+_lock = threading.Lock()
+
+
+def _stdout_sink(event):
+    line = json.dumps(event, ensure_ascii=False)
+    with _lock:
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+
+_sink = _stdout_sink
+
+
+def set_sink(sink):
+    """Send events to `sink(event_dict)` instead of stdout (None restores stdout).
+
+    Returns the previous sink so callers can put it back.
+    """
+    global _sink
+    previous = _sink
+    _sink = sink or _stdout_sink
+    return previous
+
+
+def emit(event, stage=None, **fields):
+    payload = {"event": event}
+    if stage is not None:
+        payload["stage"] = stage
+    payload.update(fields)
+    _sink(payload)
+
+
+class stage(contextlib.ContextDecorator):
+    """Bracket a block or a function with stage_start / stage_end."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        emit("stage_start", self.name)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            emit("stage_end", self.name)
+        else:
+            emit("stage_end", self.name, error=str(exc))
+
+
+class Counter:
+    """Thread-safe done/total counter that emits `event` without flooding the output."""
+
+    def __init__(self, event, stage, total=None, interval=MIN_INTERVAL):
+        self.event = event
+        self.stage = stage
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self._last = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, amount=1):
+        with self._lock:
+            self.done += amount
+            now = time.monotonic()
+            finished = self.total is not None and self.done >= self.total
+            if not finished and now - self._last < self.interval:
+                return
+            self._last = now
+            done = self.done
+        self._emit(done)
+
+    def finish(self):
+        """Emit the final count, which `add` may have held back."""
+        with self._lock:
+            done = self.done
+        self._emit(done)
+
+    def _emit(self, done):
+        fields = {"done": done}
+        if self.total is not None:
+            fields["total"] = self.total
+        emit(self.event, self.stage, **fields)
+
+
+def parse(line):
+    """The event carried by one line of script output, or None for ordinary text."""
+    line = line.strip()
+    if line.startswith("{"):
+        try:
+            payload = json.loads(line)
+        except ValueError:
+            return None
+        if isinstance(payload, dict) and "event" in payload:
+            return payload
+        return None
+
+    match = CYCLES_SAMPLES.search(line)
+    if match:
+        return {"event": "samples", "stage": "render",
+                "done": int(match.group(1)), "total": int(match.group(2))}
+    match = CYCLES_TILES.search(line)
+    if match:
+        return {"event": "tiles", "stage": "render",
+                "done": int(match.group(1)), "total": int(match.group(2))}
+    return None
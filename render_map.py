@@ -1,71 +1,188 @@
 
 import bpy
+import argparse
 import json
 import os
 import math
+import sys
+import time
 from pathlib import Path
 
 # Setup Paths
 SCRIPT_DIR = Path(__file__).parent.absolute()
+# Blender does not put the script's folder on sys.path
+if str(SCRIPT_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPT_DIR))
+import progress
+import render_profiles
+
 DATA_DIR = SCRIPT_DIR / "data" / "dem"
 OUTPUT_DIR = SCRIPT_DIR / "output"
-OUTPUT_DIR.mkdir(exist_ok=True)
-
-METADATA_PATH = DATA_DIR / "metadata.json"
 CONFIG_PATH = SCRIPT_DIR / "config.json"
+# Compute device type Cycles found, looked up once per Blender session
+GPU_TYPE = None
+GPU_CHECKED = False
 
-# Load Metadata
-with open(METADATA_PATH, 'r', encoding='utf-8') as f:
-    metadata = json.load(f)
-
-# Load Config (for advanced render settings)
-if CONFIG_PATH.exists():
-    with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-        config = json.load(f)
-else:
-    config = {}
+def script_args():
+    """Arguments meant for this script: everything after Blender's `--`."""
+    if "--" in sys.argv:
+        return sys.argv[sys.argv.index("--") + 1:]
+    return []
 
-COUNTRY_NAME = metadata['country_name']
-HEIGHTMAP_PATH = DATA_DIR / f"{COUNTRY_NAME}_heightmap.png"
-MASK_PATH = DATA_DIR / f"{COUNTRY_NAME}_mask.png"
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Render a prepared heightmap with Blender.")
+    parser.add_argument("--job-dir", default=os.environ.get("ANYMAPS_JOB_DIR"),
+                        help="Prepared job directory; the render is written there too")
+    parser.add_argument("--config", default=os.environ.get("ANYMAPS_CONFIG"),
+                        help="Config file to use instead of the job's config.json")
+    parser.add_argument("--output-dir", default=None,
+                        help="Where to write the render (defaults to the job directory)")
+    return parser.parse_args(argv)
 
-# Parameters
-ASPECT_RATIO = metadata['width'] / metadata['height']
-MIN_ELEV = metadata['min_elevation'] 
-MAX_ELEV = metadata['max_elevation'] 
-ELEV_RANGE = MAX_ELEV - MIN_ELEV
-CENTER_LAT = metadata.get('center_lat', 0)
+def load_job(job_dir=None, config_path=None, output_dir=None):
+    """Read the job's metadata and config into the module settings.
 
-# Lat correction
-LAT_CORRECTION = 1 / math.cos(math.radians(CENTER_LAT)) if math.cos(math.radians(CENTER_LAT)) != 0 else 1.0
-
-# Visual Params
-RENDER_SAMPLES = config.get('render_samples', 128)
-Z_SCALE = config.get('z_scale', 3.5)
-SUN_ANGLE = config.get('sun_angle', 25)
-SHOW_TEXT = config.get('show_text', True)
+    Without a job directory this falls back to data/dem, output/ and the
+    shared config.json.
+    """
+    global DATA_DIR, OUTPUT_DIR, METADATA_PATH, metadata, config
+    global COUNTRY_NAME, HEIGHTMAP_PATH, MASK_PATH, MESH_PATH
+    global ASPECT_RATIO, MIN_ELEV, MAX_ELEV, ELEV_RANGE, CENTER_LAT, LAT_CORRECTION
+    global PROFILE, RENDER_SAMPLES, Z_SCALE, SUN_ANGLE, SHOW_TEXT
+    
+    if job_dir:
+        DATA_DIR = Path(job_dir)
+        OUTPUT_DIR = DATA_DIR
+        if config_path is None:
+            config_path = DATA_DIR / "config.json"
+    if output_dir:
+        OUTPUT_DIR = Path(output_dir)
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    config_path = Path(config_path) if config_path else CONFIG_PATH
+    
+    METADATA_PATH = DATA_DIR / "metadata.json"
+    
+    # Load Metadata
+    with open(METADATA_PATH, 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+    
+    # Load Config (for advanced render settings)
+    if config_path.exists():
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    else:
+        config = {}
+    
+    COUNTRY_NAME = metadata['country_name']
+    # 16-bit PNG or float EXR, whichever prepare_data.py wrote
+    HEIGHTMAP_PATH = DATA_DIR / metadata.get('heightmap', f"{COUNTRY_NAME}_heightmap.png")
+    MASK_PATH = DATA_DIR / f"{COUNTRY_NAME}_mask.png"
+    # Prebuilt terrain mesh when prepared with mesh_mode "rtin", else displace a plane
+    MESH_PATH = DATA_DIR / metadata['mesh'] if metadata.get('mesh') else None
+    
+    # Parameters
+    ASPECT_RATIO = metadata['width'] / metadata['height']
+    MIN_ELEV = metadata['min_elevation'] 
+    MAX_ELEV = metadata['max_elevation'] 
+    ELEV_RANGE = MAX_ELEV - MIN_ELEV
+    CENTER_LAT = metadata.get('center_lat', 0)
+    
+    # Lat correction
+    LAT_CORRECTION = 1 / math.cos(math.radians(CENTER_LAT)) if math.cos(math.radians(CENTER_LAT)) != 0 else 1.0
+    
+    # Visual Params
+    PROFILE = render_profiles.resolve(config)
+    RENDER_SAMPLES = PROFILE['samples']
+    Z_SCALE = config.get('z_scale', 3.5)
+    SUN_ANGLE = config.get('sun_angle', 25)
+    SHOW_TEXT = config.get('show_text', True)
 
 
 def clear_scene():
     bpy.ops.object.select_all(action='SELECT')
     bpy.ops.object.delete()
+    
+    # The render server reuses this Blender session: drop every data block the
+    # previous map left without users (worlds, node groups, lights, textures...),
+    # including those only kept alive by other orphans
+    bpy.data.orphans_purge(do_local_ids=True, do_linked_ids=True, do_recursive=True)
+
+def load_image(path):
+    """Load a data texture and decode it now rather than when Cycles first needs it."""
+    started = time.perf_counter()
+    img = bpy.data.images.load(str(path))
+    # Before the decode: changing the colorspace afterwards would throw the pixels away
+    img.colorspace_settings.name = 'Non-Color'
+    width, height = img.size # Reading the size makes Blender decode the file
+    print(f"Loaded {path.name} ({width}x{height}) in {time.perf_counter() - started:.2f}s")
+    return img
+
+def load_textures():
+    global HEIGHTMAP_IMAGE, MASK_IMAGE
+    HEIGHTMAP_IMAGE = load_image(HEIGHTMAP_PATH)
+    MASK_IMAGE = load_image(MASK_PATH)
+
+def find_gpu():
+    """Enable the first GPU backend Cycles has devices for; returns its type or None."""
+    global GPU_TYPE, GPU_CHECKED
+    if GPU_CHECKED:
+        return GPU_TYPE
+    GPU_CHECKED = True
+    
+    cycles_preferences = bpy.context.preferences.addons['cycles'].preferences
+    for device_type in ('OPTIX', 'CUDA', 'HIP', 'METAL', 'ONEAPI'):
+        try:
+            cycles_preferences.compute_device_type = device_type
+        except TypeError:
+            continue # Not supported on this platform
+        cycles_preferences.get_devices()
+        gpus = [d for d in cycles_preferences.devices if d.type == device_type]
+        if gpus:
+            for device in cycles_preferences.devices:
+                device.use = device.type == device_type
+            GPU_TYPE = device_type
+            break
+    else:
+        cycles_preferences.compute_device_type = 'NONE'
+    return GPU_TYPE
 
 def setup_render_engine():
-    bpy.context.scene.render.engine = 'CYCLES'
+    scene = bpy.context.scene
+    scene.render.engine = 'CYCLES'
     try:
-        bpy.context.scene.cycles.feature_set = 'EXPERIMENTAL'
+        scene.cycles.feature_set = 'EXPERIMENTAL'
     except AttributeError:
         pass
-
-    bpy.context.scene.cycles.device = 'GPU'
-    bpy.context.scene.cycles.use_denoising = True
-    bpy.context.scene.cycles.samples = RENDER_SAMPLES
-    
-    # Try different device settings if needed
-    preferences = bpy.context.preferences
-    cycles_preferences = preferences.addons['cycles'].preferences
-    cycles_preferences.compute_device_type = 'CUDA' 
-    cycles_preferences.get_devices()
+    
+    # Device: explicit CPU path instead of silently falling back from a missing GPU
+    gpu_type = find_gpu() if PROFILE['device'] != 'cpu' else None
+    if gpu_type:
+        scene.cycles.device = 'GPU'
+    else:
+        if PROFILE['device'] == 'gpu':
+            print("No GPU found, rendering on the CPU")
+        scene.cycles.device = 'CPU'
+    print(f"Render profile '{PROFILE['name']}' on {gpu_type or 'CPU'}")
+    
+    scene.cycles.samples = RENDER_SAMPLES
+    scene.cycles.use_adaptive_sampling = True
+    scene.cycles.adaptive_threshold = PROFILE['adaptive_threshold']
+    
+    scene.cycles.use_denoising = bool(PROFILE['denoiser'])
+    if PROFILE['denoiser']:
+        try:
+            scene.cycles.denoiser = PROFILE['denoiser']
+        except TypeError:
+            pass # Denoiser not built into this Blender
+    
+    if PROFILE['threads']:
+        scene.render.threads_mode = 'FIXED'
+        scene.render.threads = PROFILE['threads']
+    else:
+        scene.render.threads_mode = 'AUTO'
+    
+    scene.cycles.dicing_rate = PROFILE['dicing_rate']
+    scene.render.use_persistent_data = PROFILE['persistent_data']
 
 def create_lighting():
     # Sun: Very high Z (35) for close shadows
@@ -129,6 +246,16 @@ def create_background():
     
     bg_plane.data.materials.append(mat)
 
+def import_terrain_mesh():
+    """The RTIN mesh from terrain_mesh.py: a 1 x 1 plane with 0-1 heights, UVs included."""
+    try:
+        bpy.ops.wm.ply_import(filepath=str(MESH_PATH))
+    except AttributeError:
+        bpy.ops.import_mesh.ply(filepath=str(MESH_PATH)) # Blender 3.x
+    obj = bpy.context.selected_objects[0]
+    bpy.ops.object.shade_smooth()
+    return obj
+
 def create_map_mesh():
     width_blender = 10.0
     height_blender = width_blender / ASPECT_RATIO
@@ -136,26 +263,32 @@ def create_map_mesh():
     
     print(f"Creating Map Mesh: {scale_x} x {height_blender}")
     
-    bpy.ops.mesh.primitive_plane_add(size=1, location=(0, 1.5, 0))
-    obj = bpy.context.active_object
+    if MESH_PATH:
+        # Relief is in the geometry: nothing for Cycles to dice at render time
+        obj = import_terrain_mesh()
+        obj.location = (0, 1.5, 0)
+        obj.scale = (scale_x, height_blender, Z_SCALE)
+    else:
+        bpy.ops.mesh.primitive_plane_add(size=1, location=(0, 1.5, 0))
+        obj = bpy.context.active_object
+        obj.scale = (scale_x, height_blender, 1)
     obj.name = "MapMesh"
-    
-    obj.scale = (scale_x, height_blender, 1)
     bpy.ops.object.transform_apply(location=False, rotation=False, scale=True)
     
-    # Subsurf Modifier
-    subsurf = obj.modifiers.new(name="Subdivision", type='SUBSURF')
-    subsurf.subdivision_type = 'SIMPLE'
-    
-    # Adaptive Subdivision
-    try:
-        subsurf.use_adaptive_subdivision = True
-    except AttributeError:
+    if not MESH_PATH:
+        # Subsurf Modifier
+        subsurf = obj.modifiers.new(name="Subdivision", type='SUBSURF')
+        subsurf.subdivision_type = 'SIMPLE'
+        
+        # Adaptive Subdivision
         try:
-             obj.cycles.use_adaptive_subdivision = True
+            subsurf.use_adaptive_subdivision = True
         except AttributeError:
-             subsurf.levels = 9
-             subsurf.render_levels = 9
+            try:
+                 obj.cycles.use_adaptive_subdivision = True
+            except AttributeError:
+                 subsurf.levels = 9
+                 subsurf.render_levels = 9
     
     # Material
     mat = bpy.data.materials.new(name="MapMat")
@@ -183,14 +316,8 @@ def create_map_mesh():
     coord = nodes.new('ShaderNodeTexCoord')
     
     # Heightmap
-    if str(HEIGHTMAP_PATH) not in bpy.data.images:
-        img = bpy.data.images.load(str(HEIGHTMAP_PATH))
-    else:
-        img = bpy.data.images[str(HEIGHTMAP_PATH)]
-    img.colorspace_settings.name = 'Non-Color'
-    
     tex_elev = nodes.new('ShaderNodeTexImage')
-    tex_elev.image = img
+    tex_elev.image = HEIGHTMAP_IMAGE
     tex_elev.interpolation = 'Cubic' 
     tex_elev.extension = 'EXTEND'
     
@@ -208,7 +335,8 @@ def create_map_mesh():
     links.new(coord.outputs['UV'], tex_elev.inputs['Vector'])
     links.new(tex_elev.outputs['Color'], math_node.inputs[0])
     links.new(math_node.outputs['Value'], disp_node.inputs['Height'])
-    links.new(disp_node.outputs['Displacement'], output.inputs['Displacement'])
+    if not MESH_PATH:
+        links.new(disp_node.outputs['Displacement'], output.inputs['Displacement'])
     
     # Color Ramp
     ramp = nodes.new('ShaderNodeValToRGB')
@@ -288,14 +416,8 @@ def create_map_mesh():
     links.new(ramp.outputs['Color'], bsdf.inputs['Base Color'])
     
     # Masking
-    if str(MASK_PATH) not in bpy.data.images:
-        mask_img = bpy.data.images.load(str(MASK_PATH))
-    else:
-        mask_img = bpy.data.images[str(MASK_PATH)]
-    mask_img.colorspace_settings.name = 'Non-Color'
-        
     tex_mask = nodes.new('ShaderNodeTexImage')
-    tex_mask.image = mask_img
+    tex_mask.image = MASK_IMAGE
     tex_mask.interpolation = 'Closest' 
     
     mix_shader = nodes.new('ShaderNodeMixShader')
@@ -383,24 +505,38 @@ def setup_world():
 
 def render():
     bpy.context.scene.render.filepath = str(OUTPUT_DIR / f"{COUNTRY_NAME}_render.png")
-    bpy.context.scene.render.resolution_x = 2400
-    bpy.context.scene.render.resolution_y = 3000
+    bpy.context.scene.render.resolution_x, bpy.context.scene.render.resolution_y = PROFILE['resolution']
+    bpy.context.scene.render.resolution_percentage = 100
     
     print("Rendering...")
+    started = time.perf_counter()
     bpy.ops.render.render(write_still=True)
-    print(f"Render saved to {bpy.context.scene.render.filepath}")
+    print(f"Render saved to {bpy.context.scene.render.filepath} ({time.perf_counter() - started:.1f}s)")
     bpy.ops.wm.save_as_mainfile(filepath=str(OUTPUT_DIR / f"{COUNTRY_NAME}_scene.blend"))
 
-def main():
+def render_job(job_dir=None, config_path=None, output_dir=None):
+    """Build the scene for one prepared job and render it. Returns the image path."""
+    load_job(job_dir, config_path, output_dir)
+    
     clear_scene()
-    setup_render_engine()
-    setup_world()
-    create_lighting()
-    create_background()
-    create_map_mesh() 
-    setup_camera()
-    add_text()
-    render()
+    # Its own stage, so texture load time shows up next to render time
+    with progress.stage("texture"):
+        load_textures()
+    with progress.stage("scene"):
+        setup_render_engine()
+        setup_world()
+        create_lighting()
+        create_background()
+        create_map_mesh() 
+        setup_camera()
+        add_text()
+    with progress.stage("render"):
+        render()
+    return OUTPUT_DIR / f"{COUNTRY_NAME}_render.png"
+
+def main():
+    args = parse_args(script_args())
+    render_job(args.job_dir, args.config, args.output_dir)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,79 @@
+"""Named Cycles settings for render_map.py, chosen with the `render_profile` config key.
+
+draft     quick look, finishes in seconds on a CPU
+standard  the default, same size and samples as before
+print     large, low-noise output for printing
+
+Any setting can be overridden from the config: `render_samples`,
+`render_resolution` ([width, height]), `render_threads` and `render_timeout`.
+Standard library only, since it is imported inside Blender.
+"""
+
+DEFAULT_PROFILE = "standard"
+
+# How long a render may take before the backend gives up on its render server:
+# scene setup, plus the pixel-samples at a rate well below a slow CPU's
+TIMEOUT_SETUP_SECONDS = 300
+TIMEOUT_SAMPLES_PER_SECOND = 500_000
+
+PROFILES = {
+    "draft": {
+        "resolution": (960, 1200),
+        "samples": 16,
+        # Stop sampling a pixel once its noise estimate is below this
+        "adaptive_threshold": 0.1,
+        "denoiser": "OPENIMAGEDENOISE",
+        # 0 = one thread per core
+        "threads": 0,
+        # Pixels per micropolygon for adaptive subdivision: higher is coarser and faster
+        "dicing_rate": 4.0,
+        "persistent_data": False,
+    },
+    "standard": {
+        "resolution": (2400, 3000),
+        "samples": 128,
+        "adaptive_threshold": 0.02,
+        "denoiser": "OPENIMAGEDENOISE",
+        "threads": 0,
+        "dicing_rate": 1.0,
+        "persistent_data": True,
+    },
+    "print": {
+        "resolution": (4800, 6000),
+        "samples": 512,
+        "adaptive_threshold": 0.005,
+        "denoiser": "OPENIMAGEDENOISE",
+        "threads": 0,
+        "dicing_rate": 0.5,
+        "persistent_data": True,
+    },
+}
+
+# Where to render: "auto" uses a GPU when Cycles finds one, "cpu" never tries
+DEVICES = ("auto", "gpu", "cpu")
+
+
+def resolve(config):
+    """Settings for the job's profile with the config's explicit overrides applied."""
+    name = config.get("render_profile", DEFAULT_PROFILE)
+    if name not in PROFILES:
+        print(f"Unknown render profile '{name}', using '{DEFAULT_PROFILE}'")
+        name = DEFAULT_PROFILE
+
+    settings = dict(PROFILES[name], name=name)
+    if config.get("render_samples") is not None:
+        settings["samples"] = config["render_samples"]
+    if config.get("render_resolution") is not None:
+        settings["resolution"] = tuple(config["render_resolution"])
+    if config.get("render_threads") is not None:
+        settings["threads"] = config["render_threads"]
+
+    device = config.get("render_device", "auto")
+    settings["device"] = device if device in DEVICES else "auto"
+
+    if config.get("render_timeout") is not None:
+        settings["timeout"] = config["render_timeout"]
+    else:
+        width, height = settings["resolution"]
+        settings["timeout"] = TIMEOUT_SETUP_SECONDS + width * height * settings["samples"] / TIMEOUT_SAMPLES_PER_SECOND
+    return settings
@@ -0,0 +1,253 @@
+"""Protocol between the backend and a long-running render server.
+
+One JSON object per line over a localhost TCP connection:
+
+    -> {"type": "render", "token": "...", "id": "3f2a", "job_dir": "jobs/3f2a", "output_dir": null}
+    <- {"type": "result", "id": "3f2a", "ok": true, "output": "jobs/3f2a/Chile_render.png", "seconds": 41.2}
+    -> {"type": "ping", "token": "..."}
+    <- {"type": "pong", "renders": 3}
+    -> {"type": "shutdown", "token": "..."}
+    <- {"type": "bye"}
+
+A server prints {"event": "render_server", "port": N} on stdout once it
+listens; everything else it prints (Cycles' "Sample x/y" lines included) is
+forwarded by the client to whoever is waiting for the current render.
+
+render_server.py runs `serve` inside Blender. For testing without Blender:
+
+    python render_server.py --fake   (or python render_protocol.py --fake)
+
+serves the same protocol and "renders" a placeholder image. Standard
+library only, since Blender imports it too.
+"""
+import argparse
+import json
+import os
+import secrets
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import zlib
+from pathlib import Path
+
+HOST = "127.0.0.1"
+TOKEN_ENV = "ANYMAPS_RENDER_TOKEN"
+STARTUP_TIMEOUT = 120
+FAKE_SAMPLES = 8
+FAKE_SAMPLE_SECONDS = 0.05
+
+
+def send(stream, message):
+    stream.write((json.dumps(message, ensure_ascii=False) + "\n").encode('utf-8'))
+    stream.flush()
+
+
+def receive(stream):
+    """Next message, or None once the other side has closed the connection."""
+    line = stream.readline()
+    if not line:
+        return None
+    return json.loads(line.decode('utf-8'))
+
+
+def serve(handler, port=0, token=None):
+    """Answer requests, one connection at a time, until a shutdown message.
+
+    `handler(request)` renders and returns the output path; an exception
+    becomes an `ok: false` result and the server keeps going.
+    """
+    token = token if token is not None else os.environ.get(TOKEN_ENV)
+    # Output is read through a pipe, where Python would otherwise buffer it
+    if hasattr(sys.stdout, "reconfigure"):
+        sys.stdout.reconfigure(line_buffering=True)
+
+    renders = 0
+    with socket.create_server((HOST, port)) as server:
+        print(json.dumps({"event": "render_server", "port": server.getsockname()[1]}), flush=True)
+        while True:
+            conn, _ = server.accept()
+            with conn, conn.makefile("rwb") as stream:
+                while True:
+                    try:
+                        request = receive(stream)
+                    except (OSError, ValueError):
+                        break
+                    if request is None:
+                        break
+                    if token and request.get("token") != token:
+                        send(stream, {"type": "error", "error": "Invalid token"})
+                        break
+
+                    kind = request.get("type")
+                    if kind == "ping":
+                        send(stream, {"type": "pong", "renders": renders})
+                    elif kind == "shutdown":
+                        send(stream, {"type": "bye"})
+                        return
+                    elif kind == "render":
+                        started = time.perf_counter()
+                        try:
+                            result = {"ok": True, "output": str(handler(request))}
+                        except Exception as e:
+                            traceback.print_exc(file=sys.stdout)
+                            result = {"ok": False, "error": str(e)}
+                        renders += 1
+                        result.update(type="result", id=request.get("id"),
+                                      seconds=time.perf_counter() - started)
+                        send(stream, result)
+                    else:
+                        send(stream, {"type": "error", "error": f"Unknown request type {kind!r}"})
+
+
+class RenderServerProcess:
+    """Client side: starts a render server, sends it jobs and restarts it if it dies.
+
+    Renders are sent one at a time; use one instance per concurrent render.
+    """
+
+    def __init__(self, command, startup_timeout=STARTUP_TIMEOUT):
+        self.command = command
+        self.startup_timeout = startup_timeout
+        self.process = None
+        self.port = None
+        self.token = None
+        self.lock = threading.Lock()
+        self._on_line = None
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        self.port = None
+        self.token = secrets.token_hex(16)
+        env = dict(os.environ, **{TOKEN_ENV: self.token})
+        self.process = subprocess.Popen(
+            self.command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            text=True, bufsize=1, env=env
+        )
+        ready = threading.Event()
+        threading.Thread(target=self._pump, args=(self.process, ready), daemon=True).start()
+
+        if not ready.wait(self.startup_timeout) or self.port is None:
+            self.close()
+            raise RuntimeError(f"Render server did not start: {' '.join(map(str, self.command))}")
+
+    def _pump(self, process, ready):
+        for line in process.stdout:
+            line = line.rstrip("\n")
+            if self.port is None and line.startswith("{"):
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    message = {}
+                if message.get("event") == "render_server":
+                    self.port = message["port"]
+                    ready.set()
+                    continue
+            on_line = self._on_line
+            if on_line:
+                on_line(line)
+            elif line:
+                print(f"[render server] {line}")
+        # Exited (or never started listening)
+        ready.set()
+
+    def kill(self):
+        if self.alive():
+            self.process.kill()
+            self.process.wait()
+
+    def request(self, message, on_line=None, timeout=None):
+        """Send one message and wait for the reply.
+
+        Past `timeout` seconds the server is assumed stuck: it is killed and
+        started again for the next request, and this one fails.
+        """
+        with self.lock:
+            if not self.alive():
+                self.start()
+            self._on_line = on_line
+            try:
+                with socket.create_connection((HOST, self.port), timeout=timeout) as conn, conn.makefile("rwb") as stream:
+                    send(stream, dict(message, token=self.token))
+                    reply = receive(stream)
+            except socket.timeout:
+                self._on_line = None
+                self.kill()
+                try:
+                    self.start()
+                except RuntimeError as e:
+                    print(f"[render server] {e}")
+                raise RuntimeError(f"Render server gave no answer within {timeout:g}s, restarted it")
+            except (OSError, ValueError) as e:
+                raise RuntimeError(f"Render server connection failed: {e}")
+            finally:
+                self._on_line = None
+        if reply is None:
+            raise RuntimeError("Render server closed the connection (it may have crashed)")
+        return reply
+
+    def render(self, job_dir, output_dir=None, job_id=None, on_line=None, timeout=None):
+        """Render a prepared job directory; returns the server's result message."""
+        return self.request({
+            "type": "render",
+            "id": job_id,
+            "job_dir": str(job_dir),
+            "output_dir": str(output_dir) if output_dir else None,
+        }, on_line=on_line, timeout=timeout)
+
+    def close(self):
+        if not self.alive():
+            return
+        try:
+            with socket.create_connection((HOST, self.port), timeout=5) as conn, conn.makefile("rwb") as stream:
+                send(stream, {"type": "shutdown", "token": self.token})
+                receive(stream)
+            self.process.wait(timeout=10)
+        except Exception:
+            self.kill()
+
+
+def _placeholder_png(width=240, height=300, gray=128):
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+    raw = (b"\x00" + bytes([gray]) * width) * height
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw))
+            + chunk(b"IEND", b""))
+
+
+def fake_render(request):
+    """Stand-in for Blender: prints Cycles-style progress and writes a gray image."""
+    job_dir = Path(request["job_dir"])
+    output_dir = Path(request.get("output_dir") or job_dir)
+    with open(job_dir / "metadata.json", 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+
+    for sample in range(1, FAKE_SAMPLES + 1):
+        print(f"Fra:1 | Fake render | Sample {sample}/{FAKE_SAMPLES}")
+        time.sleep(FAKE_SAMPLE_SECONDS)
+
+    output = output_dir / f"{metadata['country_name']}_render.png"
+    output.write_bytes(_placeholder_png())
+    print(f"Render saved to {output}")
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render server protocol test double.")
+    parser.add_argument("--fake", action="store_true", help="Serve with the fake renderer")
+    parser.add_argument("--port", type=int, default=0)
+    args = parser.parse_args()
+    if not args.fake:
+        parser.error("only --fake is available here; the real server is render_server.py inside Blender")
+    serve(fake_render, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
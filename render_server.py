@@ -0,0 +1,52 @@
+"""Long-running render server, run inside Blender:
+
+    blender --background --python render_server.py [-- --port 0]
+
+Blender starts, loads its add-ons and enumerates the Cycles devices once;
+every render request after that (see render_protocol.py) only swaps in the
+job's heightmap, mask and settings and renders.
+
+Without Blender, `python render_server.py --fake` serves the same protocol
+with render_protocol's placeholder renderer.
+"""
+import argparse
+import sys
+from pathlib import Path
+
+SCRIPT_DIR = Path(__file__).parent.absolute()
+# Blender does not put the script's folder on sys.path
+if str(SCRIPT_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPT_DIR))
+
+try:
+    import bpy  # noqa: F401
+    IN_BLENDER = True
+except ImportError:
+    IN_BLENDER = False
+
+if IN_BLENDER:
+    import render_map
+import render_protocol
+
+
+def handle(request):
+    # The job's settings are read from <job_dir>/config.json, as with the one-shot script
+    return render_map.render_job(request["job_dir"], output_dir=request.get("output_dir"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve render requests from the backend.")
+    parser.add_argument("--port", type=int, default=0, help="Port to listen on (default: any free port)")
+    parser.add_argument("--fake", action="store_true", help="Serve with the placeholder renderer (no Blender)")
+    # Blender passes the script's own arguments after "--"
+    args = parser.parse_args(render_map.script_args() if IN_BLENDER else sys.argv[1:])
+    if args.fake:
+        render_protocol.serve(render_protocol.fake_render, port=args.port)
+    elif not IN_BLENDER:
+        parser.error("run inside Blender, or pass --fake")
+    else:
+        render_protocol.serve(handle, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
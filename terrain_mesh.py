@@ -0,0 +1,237 @@
+"""Error-bounded terrain mesh from a heightmap (RTIN, as in Mapbox's Martini).
+
+    python terrain_mesh.py <heightmap> <mask> <out.ply> [max_error] [grid_size]
+
+A right-triangulated irregular network splits each triangle at the middle
+of its hypotenuse for as long as the height there is further than
+`max_error` from the straight line between the hypotenuse's ends. Every
+vertex's error also covers all the triangles below it, so neighbours
+always split together and the mesh has no cracks. Triangles with no land
+pixel at all (per the mask) are dropped, so sparse shapes such as
+archipelagos cost triangles only where there is land.
+
+Heights are 0-1 as in the heightmap. NumPy and Pillow only: no Blender
+needed to build or inspect a mesh.
+"""
+import math
+import sys
+
+import numpy as np
+from PIL import Image
+
+import exr_stream
+
+# Largest grid side, 2^k + 1 vertices; the heightmap is resampled to fit
+DEFAULT_GRID_SIZE = 2049
+# Fraction of the elevation range a triangle may be off by
+DEFAULT_MAX_ERROR = 0.001
+# Triangles handled at once while computing errors, as a power of two
+CHUNK_LEVELS = 18
+
+# Heightmaps are our own files, not untrusted uploads
+Image.MAX_IMAGE_PIXELS = None
+
+
+def read_heightmap(path):
+    """0-1 float32 heights from a 16-bit PNG or an EXR written by exr_stream."""
+    if str(path).endswith(".exr"):
+        return np.asarray(exr_stream.read_exr(path), dtype=np.float32)
+    return np.asarray(Image.open(path)).astype(np.float32) / 65535
+
+
+def _resample(array, shape):
+    out_h, out_w = shape
+    return np.asarray(Image.fromarray(array).resize((out_w, out_h), Image.BILINEAR))
+
+
+def make_grid(height, land, grid_size=DEFAULT_GRID_SIZE):
+    """Square (2^k + 1)-sided height and land grids, plus the raster's (rows, cols) on that grid.
+
+    The raster sits in the top-left corner, resampled down first if it is
+    larger than `grid_size`; the rest of the grid repeats the edge heights
+    and has no land.
+    """
+    h, w = height.shape
+    tile = 1 << max(1, math.ceil(math.log2(max(h, w) - 1)))
+    tile = min(tile, 1 << int(math.log2(grid_size - 1)))
+    size = tile + 1
+
+    rows, cols = h, w
+    if max(h, w) > size:
+        scale = size / max(h, w)
+        rows, cols = max(2, min(size, round(h * scale))), max(2, min(size, round(w * scale)))
+        height = _resample(height.astype(np.float32), (rows, cols))
+        land = _resample(land.astype(np.float32), (rows, cols)) > 0
+
+    grid = np.pad(height.astype(np.float32), ((0, size - rows), (0, size - cols)), mode='edge')
+    grid_land = np.zeros((size, size), dtype=bool)
+    grid_land[:rows, :cols] = land
+    return grid, grid_land, (rows, cols)
+
+
+def _roots(tile):
+    # (ax, ay, bx, by, cx, cy); the hypotenuse runs from a to b
+    return np.array([[0, 0, tile, tile, tile, 0],
+                     [tile, tile, 0, 0, 0, tile]], dtype=np.int32)
+
+
+def _midpoints(tris):
+    return (tris[:, 0] + tris[:, 2]) >> 1, (tris[:, 1] + tris[:, 3]) >> 1
+
+
+def _split(tris):
+    """Both children of each triangle: (c, a, m) and (b, c, m)."""
+    mx, my = _midpoints(tris)
+    a, b, c = tris[:, 0:2], tris[:, 2:4], tris[:, 4:6]
+    m = np.stack([mx, my], axis=1)
+    return np.concatenate([np.concatenate([c, a, m], axis=1),
+                           np.concatenate([b, c, m], axis=1)])
+
+
+def _level(tile, level):
+    """Triangles of one level of the hierarchy, in chunks.
+
+    Levels are regenerated from the roots instead of kept, so memory follows
+    the chunk size and not the 2 * tile^2 triangles of the whole hierarchy.
+    """
+    base = max(0, level - CHUNK_LEVELS)
+    ancestors = _roots(tile)
+    for _ in range(base):
+        ancestors = _split(ancestors)
+    for ancestor in ancestors:
+        tris = ancestor[None, :]
+        for _ in range(level - base):
+            tris = _split(tris)
+        yield tris
+
+
+def compute_errors(grid, land):
+    """Per-vertex error (for splitting) and land cover (for dropping) of the triangles split there.
+
+    `cover[y, x]` is True when any grid point of the triangles whose
+    hypotenuse middle is (x, y) has land.
+    """
+    size = grid.shape[0]
+    tile = size - 1
+    errors = np.zeros_like(grid)
+    cover = np.zeros_like(land)
+    # The finest level whose triangles can still be split
+    finest = 2 * int(math.log2(tile)) - 1
+
+    for level in range(finest, -1, -1):
+        for tris in _level(tile, level):
+            ax, ay, bx, by, cx, cy = tris.T
+            mx, my = _midpoints(tris)
+            error = np.abs((grid[ay, ax] + grid[by, bx]) / 2 - grid[my, mx])
+            any_land = land[ay, ax] | land[by, bx] | land[cy, cx] | land[my, mx]
+            if level < finest:
+                # Fold in the children, whose middles sit on the legs
+                left_y, left_x = (ay + cy) >> 1, (ax + cx) >> 1
+                right_y, right_x = (by + cy) >> 1, (bx + cx) >> 1
+                error = np.maximum(error, np.maximum(errors[left_y, left_x], errors[right_y, right_x]))
+                any_land |= cover[left_y, left_x] | cover[right_y, right_x]
+            # Both triangles sharing a hypotenuse write the same vertex
+            np.maximum.at(errors, (my, mx), error)
+            cover[my[any_land], mx[any_land]] = True
+    return errors, cover
+
+
+def extract(errors, cover, land, max_error=DEFAULT_MAX_ERROR):
+    """(N, 6) triangles (ax, ay, bx, by, cx, cy) for `max_error`, without those fully off land."""
+    tile = errors.shape[0] - 1
+    tris = _roots(tile)
+    kept = []
+    while len(tris):
+        ax, ay, bx, by, cx, cy = tris.T
+        mx, my = _midpoints(tris)
+        splittable = np.abs(ax - cx) + np.abs(ay - cy) > 1
+        split = splittable & (errors[my, mx] > max_error)
+
+        leaves = ~split
+        has_land = land[ay, ax] | land[by, bx] | land[cy, cx] | (splittable & cover[my, mx])
+        kept.append(tris[leaves & has_land])
+        tris = _split(tris[split])
+    return np.concatenate(kept)
+
+
+def build_mesh(height, mask, max_error=DEFAULT_MAX_ERROR, grid_size=DEFAULT_GRID_SIZE):
+    """Vertices (x, y in -0.5..0.5, z = height), UVs and triangle indices for a heightmap.
+
+    x and y match a 1 x 1 plane centred on the origin with the heightmap
+    mapped over it; UVs point at the same spot in the heightmap and mask.
+    """
+    grid, land, (rows, cols) = make_grid(height, mask, grid_size)
+    errors, cover = compute_errors(grid, land)
+    tris = extract(errors, cover, land, max_error)
+
+    # Grid points in the padding fold onto the raster's edge
+    xs = np.minimum(tris[:, 0::2], cols - 1)
+    ys = np.minimum(tris[:, 1::2], rows - 1)
+    # Triangles reaching into the padding can collapse to a point or a line along the edge
+    folded = ((xs[:, 1] - xs[:, 0]) * (ys[:, 2] - ys[:, 0]) - (ys[:, 1] - ys[:, 0]) * (xs[:, 2] - xs[:, 0])) == 0
+    xs, ys = xs[~folded], ys[~folded]
+    ids, faces = np.unique(ys * grid.shape[1] + xs, return_inverse=True)
+    faces = faces.reshape(-1, 3).astype(np.int32)
+
+    vy, vx = np.divmod(ids, grid.shape[1])
+    u = (vx + 0.5) / cols
+    v = 1 - (vy + 0.5) / rows
+    vertices = np.stack([u - 0.5, v - 0.5, grid[vy, vx]], axis=1).astype(np.float32)
+    uvs = np.stack([u, v], axis=1).astype(np.float32)
+
+    # Counter-clockwise seen from above, so the normals point up
+    p0, p1, p2 = (vertices[faces[:, i], :2] for i in range(3))
+    area = (p1[:, 0] - p0[:, 0]) * (p2[:, 1] - p0[:, 1]) - (p1[:, 1] - p0[:, 1]) * (p2[:, 0] - p0[:, 0])
+    faces[area < 0] = faces[area < 0][:, [0, 2, 1]]
+    return vertices, uvs, faces
+
+
+def write_ply(path, vertices, uvs, faces):
+    """Binary PLY with positions and s/t texture coordinates, which Blender imports."""
+    vertex_data = np.empty(len(vertices), dtype=[('pos', '<f4', 3), ('uv', '<f4', 2)])
+    vertex_data['pos'] = vertices
+    vertex_data['uv'] = uvs
+    face_data = np.empty(len(faces), dtype=[('count', 'u1'), ('index', '<i4', 3)])
+    face_data['count'] = 3
+    face_data['index'] = faces
+
+    header = "\n".join([
+        "ply",
+        "format binary_little_endian 1.0",
+        f"element vertex {len(vertices)}",
+        "property float x",
+        "property float y",
+        "property float z",
+        "property float s",
+        "property float t",
+        f"element face {len(faces)}",
+        "property list uchar int vertex_indices",
+        "end_header",
+    ]) + "\n"
+    with open(path, 'wb') as f:
+        f.write(header.encode('ascii'))
+        f.write(vertex_data.tobytes())
+        f.write(face_data.tobytes())
+
+
+def mesh_from_files(heightmap_path, mask_path, out_path, max_error=DEFAULT_MAX_ERROR,
+                    grid_size=DEFAULT_GRID_SIZE):
+    height = read_heightmap(heightmap_path)
+    mask = np.asarray(Image.open(mask_path)) > 127
+    vertices, uvs, faces = build_mesh(height, mask, max_error, grid_size)
+    write_ply(out_path, vertices, uvs, faces)
+    print(f"Terrain mesh: {len(faces)} triangles, {len(vertices)} vertices (max error {max_error})")
+    return len(faces)
+
+
+def main():
+    if len(sys.argv) < 4:
+        print(__doc__)
+        sys.exit(1)
+    max_error = float(sys.argv[4]) if len(sys.argv) > 4 else DEFAULT_MAX_ERROR
+    grid_size = int(sys.argv[5]) if len(sys.argv) > 5 else DEFAULT_GRID_SIZE
+    mesh_from_files(sys.argv[1], sys.argv[2], sys.argv[3], max_error, grid_size)
+
+
+if __name__ == "__main__":
+    main()
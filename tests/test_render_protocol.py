@@ -0,0 +1,61 @@
+import json
+import sys
+
+import pytest
+
+from conftest import ROOT
+from render_protocol import RenderServerProcess
+
+
+@pytest.fixture
+def server():
+    server = RenderServerProcess([sys.executable, str(ROOT / "render_server.py"), "--fake"], startup_timeout=30)
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def job_dir(tmp_path):
+    (tmp_path / "metadata.json").write_text(json.dumps({"country_name": "Testland"}), encoding='utf-8')
+    return tmp_path
+
+
+def test_render_round_trip(server, job_dir):
+    lines = []
+    result = server.render(job_dir, job_id="job1", on_line=lines.append, timeout=30)
+
+    assert result["type"] == "result"
+    assert result["ok"] is True
+    assert result["id"] == "job1"
+    output = job_dir / "Testland_render.png"
+    assert result["output"] == str(output)
+    assert output.read_bytes().startswith(b"\x89PNG\r\n\x1a\n")
+    assert "Fra:1 | Fake render | Sample 8/8" in lines
+
+    assert server.request({"type": "ping"}, timeout=30) == {"type": "pong", "renders": 1}
+
+
+def test_failed_render_keeps_the_server(server, tmp_path):
+    result = server.render(tmp_path / "missing", job_id="job2", timeout=30)
+    assert result["ok"] is False
+    assert "metadata.json" in result["error"]
+    assert server.request({"type": "ping"}, timeout=30)["type"] == "pong"
+
+
+def test_bad_token_is_refused(server):
+    server.start()
+    token, server.token = server.token, "wrong"
+    assert server.request({"type": "ping"}, timeout=30) == {"type": "error", "error": "Invalid token"}
+    server.token = token
+
+
+def test_timeout_restarts_the_server(server, job_dir):
+    server.start()
+    first = server.process
+
+    with pytest.raises(RuntimeError, match="no answer"):
+        server.render(job_dir, job_id="slow", timeout=0.05)
+
+    assert first.poll() is not None
+    assert server.alive() and server.process is not first
+    assert server.render(job_dir, job_id="next", timeout=30)["ok"] is True
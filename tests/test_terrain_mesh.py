@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+import terrain_mesh
+
+
+def signed_areas(vertices, faces):
+    p0, p1, p2 = (vertices[faces[:, i], :2] for i in range(3))
+    return ((p1[:, 0] - p0[:, 0]) * (p2[:, 1] - p0[:, 1]) - (p1[:, 1] - p0[:, 1]) * (p2[:, 0] - p0[:, 0])) / 2
+
+
+def random_heights(shape, seed=0):
+    return np.random.default_rng(seed).random(shape).astype(np.float32)
+
+
+def test_flat_raster_is_two_triangles():
+    vertices, uvs, faces = terrain_mesh.build_mesh(np.zeros((17, 17), np.float32), np.ones((17, 17), bool))
+    assert len(vertices) == 4 and len(faces) == 2
+    assert np.allclose(np.abs(vertices[:, :2]), 0.5 - 0.5 / 17)
+
+
+def test_plane_needs_no_split():
+    y, x = np.mgrid[0:33, 0:33]
+    height = (0.2 + 0.01 * x + 0.005 * y).astype(np.float32)
+    _, _, faces = terrain_mesh.build_mesh(height, np.ones(height.shape, bool), max_error=1e-6)
+    assert len(faces) == 2
+
+
+@pytest.mark.parametrize("shape", [(9, 9), (10, 13), (17, 5), (40, 23)])
+def test_full_split_is_the_raster_grid(shape):
+    rows, cols = shape
+    vertices, uvs, faces = terrain_mesh.build_mesh(random_heights(shape), np.ones(shape, bool), max_error=-1)
+    # Every raster pixel once, two triangles per pixel square, nothing left over from the padding
+    assert len(vertices) == rows * cols
+    assert len(faces) == 2 * (rows - 1) * (cols - 1)
+
+
+@pytest.mark.parametrize("shape", [(10, 13), (17, 5), (40, 23), (33, 33)])
+@pytest.mark.parametrize("max_error", [0.2, 0.05, 0.01])
+def test_no_degenerate_or_flipped_faces(shape, max_error):
+    rows, cols = shape
+    vertices, uvs, faces = terrain_mesh.build_mesh(random_heights(shape), np.ones(shape, bool), max_error)
+
+    assert len(np.unique(np.sort(faces, axis=1), axis=0)) == len(faces)
+    areas = signed_areas(vertices, faces)
+    # Counter-clockwise and not collapsed onto the clamped padding edge
+    assert (areas > 1e-9).all()
+    # Positive areas that add up to the raster's extent: no overlaps, no holes
+    assert areas.sum() == pytest.approx((rows - 1) / rows * (cols - 1) / cols, rel=1e-5)
+    assert np.allclose(uvs, vertices[:, :2] + 0.5)
+
+
+@pytest.mark.parametrize("max_error", [0.3, 0.1, 0.02])
+def test_error_bound(max_error):
+    height = random_heights((30, 27), seed=1)
+    grid, land, _ = terrain_mesh.make_grid(height, np.ones(height.shape, bool), 65)
+    errors, cover = terrain_mesh.compute_errors(grid, land)
+    tris = terrain_mesh.extract(errors, cover, land, max_error)
+
+    # Below every kept triangle, each split point is within max_error of its hypotenuse
+    worst = 0.0
+    while len(tris):
+        splittable = np.abs(tris[:, 0] - tris[:, 4]) + np.abs(tris[:, 1] - tris[:, 5]) > 1
+        tris = tris[splittable]
+        ax, ay, bx, by = tris[:, 0], tris[:, 1], tris[:, 2], tris[:, 3]
+        mx, my = terrain_mesh._midpoints(tris)
+        error = np.abs((grid[ay, ax] + grid[by, bx]) / 2 - grid[my, mx])
+        worst = max(worst, error.max(initial=0))
+        tris = terrain_mesh._split(tris)
+    assert worst <= max_error
+
+    # and a tighter bound keeps more triangles
+    assert len(terrain_mesh.extract(errors, cover, land, max_error / 2)) > len(
+        terrain_mesh.extract(errors, cover, land, max_error))
+
+
+def test_triangles_off_land_are_dropped():
+    shape = (33, 33)
+    land = np.zeros(shape, bool)
+    land[:8, :8] = True
+    height = random_heights(shape)
+
+    vertices, _, faces = terrain_mesh.build_mesh(height, land, max_error=-1)
+    _, _, all_faces = terrain_mesh.build_mesh(height, np.ones(shape, bool), max_error=-1)
+
+    assert 0 < len(faces) < len(all_faces) / 4
+    # Raster row 0 is at the top (v = 1); every kept triangle touches the land corner
+    x = np.rint((vertices[faces, 0] + 0.5) * 33 - 0.5)
+    y = np.rint((0.5 - vertices[faces, 1]) * 33 - 0.5)
+    assert ((x <= 8) & (y <= 8)).any(axis=1).all()
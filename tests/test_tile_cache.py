@@ -0,0 +1,180 @@
+import io
+import threading
+import time
+import zipfile
+
+import pytest
+
+import tile_cache
+
+TILE_BYTES = 100_000
+
+
+def tile_zip(name, size=TILE_BYTES):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr(f"{name}.tif", bytes(range(256)) * (size // 256) + b"\0" * (size % 256))
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def publish(tile_server):
+    def publish(*tiles, size=TILE_BYTES):
+        for x, y in tiles:
+            name = f"srtm_{x:02d}_{y:02d}"
+            tile_server.files[f"{name}.zip"] = tile_zip(name, size)
+    return publish
+
+
+@pytest.fixture
+def cache(tile_server, tmp_path):
+    return tile_cache.TileCache(tmp_path / "cache", "tif", tile_server.url, workers=2)
+
+
+def requested(tile_server, name):
+    return sum(1 for path, _ in tile_server.requests if path == f"/{name}.zip")
+
+
+def age(cache, seconds, *file_names):
+    """Pretend the files were last used `seconds` ago."""
+    with cache._manifest() as manifest:
+        for file_name in file_names:
+            manifest["files"][file_name]["last_access"] = time.time() - seconds
+
+
+def test_fetch_stores_and_records_tiles(cache, publish, tile_server):
+    publish((36, 5), (37, 5))
+    paths = cache.fetch([(36, 5), (37, 5)])
+
+    assert [p.name for p in paths] == ["srtm_36_05.tif", "srtm_37_05.tif"]
+    assert not list(cache.cache_dir.glob("*.zip"))
+    entry = cache.read_manifest()["files"]["srtm_36_05.tif"]
+    assert entry["owned"] is True and entry["bytes"] == TILE_BYTES
+    assert entry["sha256"] == tile_cache.file_sha256(paths[0])
+
+    cache.fetch([(36, 5), (37, 5)])
+    assert requested(tile_server, "srtm_36_05") == 1
+
+
+def test_missing_tile_is_not_requested_again(cache, publish, tile_server):
+    publish((36, 5))
+    assert [p.name for p in cache.fetch([(36, 5), (1, 1)])] == ["srtm_36_05.tif"]
+    assert "srtm_01_01" in cache.read_manifest()["missing"]
+
+    cache.fetch([(1, 1)])
+    assert requested(tile_server, "srtm_01_01") == 1
+
+    # Asked again once the negative entry has expired
+    with cache._manifest() as manifest:
+        manifest["missing"]["srtm_01_01"] = time.time() - (tile_cache.MISSING_TTL_DAYS + 1) * 86400
+    cache.fetch([(1, 1)])
+    assert requested(tile_server, "srtm_01_01") == 2
+
+
+def test_evict_skips_kept_recent_locked_and_adopted_tiles(cache, publish):
+    cache.cache_dir.mkdir(parents=True)
+    (cache.cache_dir / "srtm_10_01.tif").write_bytes(b"\1" * TILE_BYTES)
+    tiles = [(36, 1), (36, 2), (36, 3), (36, 4), (36, 5)]
+    publish(*tiles)
+    cache.fetch(tiles + [(10, 1)])
+    names = [f"srtm_36_{y:02d}.tif" for y in range(1, 6)]
+    age(cache, 2 * tile_cache.EVICT_GRACE_SECONDS, "srtm_10_01.tif", *names[:3])
+
+    lock = cache._lock("srtm_36_03")
+    assert lock.acquire(blocking=False)
+    try:
+        # 36_01 is the only old, unkept, unlocked tile this cache stored
+        freed = cache.evict(keep={"srtm_36_02"}, budget_mb=0)
+    finally:
+        lock.release()
+
+    assert freed == TILE_BYTES
+    left = sorted(p.name for p in cache.cache_dir.glob("*.tif"))
+    assert left == ["srtm_10_01.tif"] + names[1:]
+    assert "srtm_36_01.tif" not in cache.read_manifest()["files"]
+
+
+def test_evict_budget_counts_only_stored_tiles(cache, publish):
+    cache.cache_dir.mkdir(parents=True)
+    (cache.cache_dir / "srtm_10_01.tif").write_bytes(b"\1" * 10 * TILE_BYTES)
+    publish((36, 1), (36, 2))
+    cache.fetch([(36, 1), (36, 2), (10, 1)])
+    age(cache, 2 * tile_cache.EVICT_GRACE_SECONDS, "srtm_10_01.tif", "srtm_36_01.tif", "srtm_36_02.tif")
+    # The stored tiles fit; the much larger adopted file does not count
+    assert cache.evict(budget_mb=2.5 * TILE_BYTES / 1024 / 1024) == 0
+
+    age(cache, 3 * tile_cache.EVICT_GRACE_SECONDS, "srtm_36_01.tif")
+    assert cache.evict(budget_mb=1.5 * TILE_BYTES / 1024 / 1024) == TILE_BYTES
+    assert sorted(p.name for p in cache.cache_dir.glob("*.tif")) == ["srtm_10_01.tif", "srtm_36_02.tif"]
+
+
+def test_damaged_tile_is_fetched_again_under_its_lock(cache, publish, tile_server):
+    publish((36, 5))
+    path = cache.fetch([(36, 5)])[0]
+    with open(path, 'r+b') as f:
+        f.truncate(1000)
+
+    # While someone else holds the tile, the damaged file is left alone
+    lock = cache._lock("srtm_36_05")
+    assert lock.acquire(blocking=False)
+    fetched = []
+    fetcher = threading.Thread(target=lambda: fetched.extend(cache.fetch([(36, 5)])))
+    fetcher.start()
+    time.sleep(0.3)
+    assert fetcher.is_alive()
+    assert path.stat().st_size == 1000
+    lock.release()
+    fetcher.join(10)
+
+    assert fetched == [path]
+    assert path.stat().st_size == TILE_BYTES
+    assert requested(tile_server, "srtm_36_05") == 2
+
+
+def test_damaged_adopted_file_is_not_deleted(cache, publish, tile_server):
+    cache.cache_dir.mkdir(parents=True)
+    legacy = cache.cache_dir / "srtm_36_05.tif"
+    legacy.write_bytes(b"\1" * TILE_BYTES)
+    publish((36, 5))
+    cache.fetch([(36, 5)])
+    legacy.write_bytes(b"\1" * 1000)
+
+    assert cache.fetch([(36, 5)]) == [legacy]
+    assert legacy.stat().st_size == 1000
+    assert requested(tile_server, "srtm_36_05") == 0
+    assert cache.read_manifest()["files"]["srtm_36_05.tif"]["bytes"] == 1000
+
+
+def test_rescan_and_verify_adopt_existing_files(cache):
+    cache.cache_dir.mkdir(parents=True)
+    for name in ("srtm_36_05.tif", "srtm_37_05.zip"):
+        (cache.cache_dir / name).write_bytes(b"\1" * TILE_BYTES)
+    (cache.cache_dir / "notes.txt").write_text("not a tile")
+
+    assert cache.rescan() == (0, 2)
+    files = cache.read_manifest()["files"]
+    assert sorted(files) == ["srtm_36_05.tif", "srtm_37_05.zip"]
+    # Adopted files are recorded by size; the checksum waits for verify
+    assert all(not entry["owned"] and entry["sha256"] is None for entry in files.values())
+
+    (cache.cache_dir / "srtm_38_05.tif").write_bytes(b"\2" * TILE_BYTES)
+    assert cache.verify() == (2, 0, 1)
+    files = cache.read_manifest()["files"]
+    assert files["srtm_36_05.tif"]["sha256"] == tile_cache.file_sha256(cache.cache_dir / "srtm_36_05.tif")
+    assert not files["srtm_38_05.tif"]["owned"]
+
+    # A changed adopted file is reported but kept
+    (cache.cache_dir / "srtm_36_05.tif").write_bytes(b"\3" * TILE_BYTES)
+    assert cache.verify() == (2, 0, 0)
+    assert (cache.cache_dir / "srtm_36_05.tif").exists()
+
+
+def test_verify_removes_damaged_stored_tiles(cache, publish):
+    publish((36, 5), (37, 5))
+    damaged, intact = cache.fetch([(36, 5), (37, 5)])
+    with open(damaged, 'r+b') as f:
+        f.write(b"corrupt")
+
+    assert cache.verify() == (1, 1, 0)
+    assert not damaged.exists() and intact.exists()
+    assert sorted(cache.read_manifest()["files"]) == ["srtm_37_05.tif"]
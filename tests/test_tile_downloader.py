@@ -0,0 +1,92 @@
+import io
+import zipfile
+
+import pytest
+import requests
+
+import tile_downloader
+
+TILE = bytes(range(256)) * 64
+
+
+@pytest.fixture
+def session():
+    with tile_downloader.create_session(pool_size=2) as session:
+        yield session
+
+
+def test_resumes_a_partial_download(tile_server, session, tmp_path):
+    tile_server.files["tile.zip"] = TILE
+    target = tmp_path / "tile.zip"
+    (tmp_path / "tile.zip.part").write_bytes(TILE[:1000])
+    received = []
+
+    tile_downloader.download_file(session, tile_server.url + "tile.zip", target, backoff=0, on_bytes=received.append)
+
+    assert target.read_bytes() == TILE
+    assert not (tmp_path / "tile.zip.part").exists()
+    assert tile_server.requests == [("/tile.zip", "bytes=1000-")]
+    assert sum(received) == len(TILE) - 1000
+
+
+def test_complete_part_file_is_kept_on_416(tile_server, session, tmp_path):
+    tile_server.files["tile.zip"] = TILE
+    target = tmp_path / "tile.zip"
+    (tmp_path / "tile.zip.part").write_bytes(TILE)
+
+    tile_downloader.download_file(session, tile_server.url + "tile.zip", target, backoff=0)
+
+    assert target.read_bytes() == TILE
+    assert tile_server.requests == [("/tile.zip", f"bytes={len(TILE)}-")]
+
+
+def test_oversized_part_file_is_discarded_on_416(tile_server, session, tmp_path):
+    tile_server.files["tile.zip"] = TILE
+    target = tmp_path / "tile.zip"
+    part = tmp_path / "tile.zip.part"
+    part.write_bytes(TILE + b"junk")
+
+    with pytest.raises(requests.HTTPError, match="Invalid resume offset"):
+        tile_downloader.download_file(session, tile_server.url + "tile.zip", target, retries=0)
+    assert not part.exists() and not target.exists()
+
+    # The retry starts over from the first byte
+    part.write_bytes(TILE + b"junk")
+    tile_downloader.download_file(session, tile_server.url + "tile.zip", target, retries=1, backoff=0)
+    assert target.read_bytes() == TILE
+    assert tile_server.requests[-1] == ("/tile.zip", None)
+
+
+def test_failed_validation_leaves_no_file(tile_server, session, tmp_path):
+    tile_server.files["tile.zip"] = TILE
+    target = tmp_path / "tile.zip"
+
+    with pytest.raises(IOError, match="failed validation"):
+        tile_downloader.download_file(session, tile_server.url + "tile.zip", target, retries=0,
+                                      validate=lambda path: False)
+    assert not target.exists() and not (tmp_path / "tile.zip.part").exists()
+
+
+def test_404_is_not_retried(tile_server, session, tmp_path):
+    with pytest.raises(tile_downloader.TileNotFound):
+        tile_downloader.download_file(session, tile_server.url + "srtm_01_01.zip", tmp_path / "srtm_01_01.zip",
+                                      retries=3, backoff=0)
+    assert tile_server.requests == [("/srtm_01_01.zip", None)]
+    assert not (tmp_path / "srtm_01_01.zip").exists()
+
+
+def test_download_tiles_reports_missing_tiles(tile_server, tmp_path):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr("srtm_36_05.tif", TILE)
+    tile_server.files["srtm_36_05.zip"] = buffer.getvalue()
+    missing, done = [], []
+
+    results = tile_downloader.download_tiles([(36, 5), (1, 1)], tmp_path, base_url=tile_server.url,
+                                             max_workers=2, backoff=0, on_missing=missing.append,
+                                             on_tile=lambda tile, path: done.append(tile))
+
+    assert results == {(36, 5): tmp_path / "srtm_36_05.zip"}
+    assert zipfile.is_zipfile(results[(36, 5)])
+    assert missing == [(1, 1)]
+    assert sorted(done) == [(1, 1), (36, 5)]
@@ -0,0 +1,583 @@
+"""Shared cache of CGIAR SRTM tiles, safe to use from several jobs and processes at once.
+
+    python tile_cache.py status
+    python tile_cache.py prefetch <minx> <miny> <maxx> <maxy>
+    python tile_cache.py evict [--budget-mb N]
+    python tile_cache.py verify
+
+The cache directory (the `tile_cache_dir` config key) holds the tiles as
+stored by `tile_storage`, plus:
+
+manifest.json  size, SHA-256, time stored and time last used of every
+               tile file, and the tiles the server does not publish
+               (pure ocean): those are not asked for again for
+               MISSING_TTL_DAYS, nor reported as failures
+locks/         one lock file per tile; whoever holds it downloads or
+               converts the tile, the others wait and then use the result
+
+Once a fetch is done the least recently used tiles are deleted until the
+tiles this cache downloaded fit its budget (`tile_cache_mb`). Tiles used in
+the last EVICT_GRACE_SECONDS are never deleted, since another job may be
+about to read them. Files that were already in the directory (an older
+cache such as ../map_render's) are adopted: recorded by size only, used,
+but never evicted or deleted. The CLI takes the cache settings from
+config.json.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+import zipfile
+from contextlib import contextmanager
+from pathlib import Path
+
+import cog_ingest
+import tile_downloader
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+LOCKS_DIR_NAME = "locks"
+STORAGE_MODES = ("tif", "zip", "cog")
+
+DEFAULT_BUDGET_MB = 20480
+# Ocean tiles do not appear, but a mirror may be incomplete for a while
+MISSING_TTL_DAYS = 30
+EVICT_GRACE_SECONDS = 3600
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class FileLock:
+    """Exclusive lock on a file, held across processes (fcntl on POSIX, msvcrt on Windows).
+
+    Two FileLocks on the same path exclude each other even inside one
+    process. The lock goes away with the process, so a crashed job never
+    leaves a tile locked.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = None
+
+    def acquire(self, blocking=True):
+        """Take the lock; with blocking=False, return False at once if someone else has it."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        f = open(self.path, 'a+b')
+        try:
+            if os.name == "nt":
+                f.seek(0)
+                while True:
+                    try:
+                        # LK_LOCK itself gives up after 10 seconds
+                        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        if not blocking:
+                            f.close()
+                            return False
+            else:
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+                except BlockingIOError:
+                    f.close()
+                    return False
+        except BaseException:
+            f.close()
+            raise
+        self._file = f
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        try:
+            if os.name == "nt":
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+def tiles_in_bbox(minx, miny, maxx, maxy):
+    """CGIAR 5x5 degree tiles (x, y) covering a lon/lat box; x counts from 180W, y from 60N."""
+    # SRTM stops at 60N and 60S
+    minx = max(-180, minx)
+    maxx = min(180, maxx)
+    miny = max(-60, miny)
+    maxy = min(60, maxy)
+
+    start_x = int((minx + 180) // 5) + 1
+    end_x = int((maxx + 180) // 5) + 1
+    # The northern edge has the smallest y index
+    start_y = int((60 - maxy) // 5) + 1
+    end_y = int((60 - miny) // 5) + 1
+
+    return [(x, y) for x in range(start_x, end_x + 1) for y in range(start_y, end_y + 1)]
+
+
+def extract_tile(local_zip, tif_name):
+    # Extract next to the zip and rename into place so readers never see a partial tif
+    local_tif = local_zip.with_name(tif_name)
+    tmp_tif = local_zip.with_name(f"{tif_name}.{os.getpid()}.tmp")
+    with zipfile.ZipFile(local_zip, 'r') as zip_ref:
+        with zip_ref.open(tif_name) as member, open(tmp_tif, 'wb') as f:
+            shutil.copyfileobj(member, f, 1024*1024)
+    os.replace(tmp_tif, local_tif)
+    return local_tif
+
+
+def vsizip_path(local_zip, tif_name):
+    # GDAL reads the member in place; forward slashes keep Windows paths valid too
+    return f"/vsizip/{local_zip.as_posix()}/{tif_name}"
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _describe(path, tile, now, owned):
+    # Adopted files are not hashed: a large older cache would take minutes on first use
+    return {"tile": tile, "bytes": path.stat().st_size, "sha256": file_sha256(path) if owned else None,
+            "stored": now, "last_access": now, "owned": owned}
+
+
+def tile_lock(cache_dir, tile_name):
+    """The lock held while a tile's file is written, converted or deleted."""
+    return FileLock(Path(cache_dir) / LOCKS_DIR_NAME / f"{tile_name}.lock")
+
+
+class TileCache:
+    """The tiles in `cache_dir`, stored as "tif" (extracted), "zip" (read in place) or "cog"."""
+
+    def __init__(self, cache_dir, storage="tif", base_url=tile_downloader.SRTM_BASE_URL,
+                 workers=tile_downloader.DEFAULT_WORKERS, budget_mb=DEFAULT_BUDGET_MB):
+        if storage not in STORAGE_MODES:
+            raise ValueError(f"Unknown tile storage '{storage}', expected one of {STORAGE_MODES}")
+        self.cache_dir = Path(cache_dir)
+        self.storage = storage
+        self.base_url = base_url
+        self.workers = workers
+        self.budget_mb = budget_mb
+
+    # Files and locks
+
+    def _tif(self, x, y):
+        return self.cache_dir / f"{tile_downloader.tile_name(x, y)}.tif"
+
+    def _zip(self, x, y):
+        return self.cache_dir / f"{tile_downloader.tile_name(x, y)}.zip"
+
+    def _stored_file(self, x, y):
+        if self._tif(x, y).exists():
+            return self._tif(x, y)
+        if self.storage == "zip" and self._zip(x, y).exists():
+            return self._zip(x, y)
+        return None
+
+    def _lock(self, tile_name):
+        return tile_lock(self.cache_dir, tile_name)
+
+    def path(self, x, y):
+        """Path rasterio can open for a cached tile, or None if it still needs fetching."""
+        stored = self._stored_file(x, y)
+        if stored is None or stored.suffix == ".tif":
+            return stored
+        return vsizip_path(stored, self._tif(x, y).name)
+
+    # Manifest
+
+    def read_manifest(self):
+        """Snapshot of the manifest; it is only ever replaced whole, so no lock is needed to read."""
+        try:
+            with open(self.cache_dir / MANIFEST_NAME, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            manifest = {}
+        manifest.setdefault("version", MANIFEST_VERSION)
+        manifest.setdefault("files", {})
+        manifest.setdefault("missing", {})
+        return manifest
+
+    @contextmanager
+    def _manifest(self):
+        """Read-modify-write of the manifest, exclusive across processes."""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        with FileLock(self.cache_dir / f"{MANIFEST_NAME}.lock"):
+            manifest = self.read_manifest()
+            yield manifest
+            tmp_path = self.cache_dir / f"{MANIFEST_NAME}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.cache_dir / MANIFEST_NAME)
+
+    @staticmethod
+    def _known_missing(manifest):
+        cutoff = time.time() - MISSING_TTL_DAYS * 86400
+        return {name for name, checked in manifest["missing"].items() if checked > cutoff}
+
+    @staticmethod
+    def _is_intact(stored, manifest):
+        """False if a file this cache stored no longer has the size the manifest recorded."""
+        entry = manifest["files"].get(stored.name)
+        try:
+            return entry is None or not entry.get("owned") or stored.stat().st_size == entry["bytes"]
+        except FileNotFoundError:
+            return False
+
+    def _usable(self, x, y, manifest):
+        stored = self._stored_file(x, y)
+        return stored is not None and self._is_intact(stored, manifest)
+
+    def _discard_damaged(self, x, y, manifest):
+        """Delete a tile's file if it is damaged; the caller holds the tile's lock."""
+        stored = self._stored_file(x, y)
+        if stored is None or self._is_intact(stored, manifest):
+            return
+        print(f"Cached {stored.name} is {stored.stat().st_size} bytes, "
+              f"expected {manifest['files'][stored.name]['bytes']}: fetching it again")
+        try:
+            stored.unlink()
+        except OSError:
+            pass
+
+    # Fetching
+
+    def fetch(self, tiles, on_plan=None, on_tile=None, on_bytes=None):
+        """Make sure every tile is cached and return the paths to open, in tile order.
+
+        Tiles the server does not publish are left out. `on_plan(count)` is
+        called with the number of tiles to fetch before any is, then
+        `on_tile(tile, path)` and `on_bytes(count)` as in tile_downloader.
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        manifest = self.read_manifest()
+        known_missing = self._known_missing(manifest)
+        wanted = [(x, y) for x, y in tiles if tile_downloader.tile_name(x, y) not in known_missing]
+        if len(wanted) < len(tiles):
+            print(f"{len(tiles) - len(wanted)} tiles skipped: not published (ocean only)")
+
+        needed = []
+        for x, y in wanted:
+            if self._usable(x, y, manifest):
+                print(f"Tile {tile_downloader.tile_name(x, y)} found in cache.")
+            else:
+                needed.append((x, y))
+        if on_plan:
+            on_plan(len(needed))
+
+        # Claim what nobody else is fetching; wait for the rest afterwards,
+        # holding no lock of our own, so two jobs can never wait on each other
+        claimed, busy = {}, []
+        for x, y in needed:
+            lock = self._lock(tile_downloader.tile_name(x, y))
+            if lock.acquire(blocking=False):
+                claimed[(x, y)] = lock
+            else:
+                busy.append((x, y))
+
+        try:
+            # Another job may have fetched some of them between the check and the claim
+            manifest = self.read_manifest()
+            missing = []
+            for x, y in claimed:
+                if self._usable(x, y, manifest):
+                    if on_tile:
+                        on_tile((x, y), self._stored_file(x, y))
+                    continue
+                self._discard_damaged(x, y, manifest)
+                missing.append((x, y))
+            stored_files, not_found = {}, set()
+            self._download(missing, stored_files, not_found, on_tile, on_bytes)
+            # Recorded before the locks go, so the jobs waiting on them see the outcome
+            self._record(list(claimed), manifest, stored_files, not_found)
+        finally:
+            for lock in claimed.values():
+                lock.release()
+
+        for x, y in busy:
+            name = tile_downloader.tile_name(x, y)
+            print(f"Waiting for another job to fetch {name}...")
+            with self._lock(name):
+                manifest = self.read_manifest()
+                if not self._usable(x, y, manifest) and name not in self._known_missing(manifest):
+                    self._discard_damaged(x, y, manifest)
+                    stored_files, not_found = {}, set()
+                    self._download([(x, y)], stored_files, not_found, on_tile, on_bytes)
+                    self._record([(x, y)], manifest, stored_files, not_found)
+                elif on_tile:
+                    on_tile((x, y), self._stored_file(x, y))
+
+        # Last use of every tile, and tiles cached before the manifest existed
+        self._record(wanted, self.read_manifest(), {}, ())
+        self.evict(keep={tile_downloader.tile_name(x, y) for x, y in tiles})
+
+        # Keep the tile order stable so the merge result does not depend on download timing
+        paths = [self.path(x, y) for x, y in tiles]
+        return [path for path in paths if path is not None]
+
+    def prefetch(self, bbox):
+        """Fetch every tile of a (minx, miny, maxx, maxy) lon/lat box ahead of the jobs that need them."""
+        return self.fetch(tiles_in_bbox(*bbox))
+
+    def _download(self, tiles, stored_files, not_found, on_tile=None, on_bytes=None):
+        """Download (caller holds the tiles' locks) and store as `storage`; fills stored_files and not_found."""
+        # Zips left by the "zip" mode are converted instead of downloaded again
+        reusable = {(x, y): self._zip(x, y) for x, y in tiles
+                    if self.storage != "zip" and self._zip(x, y).exists()}
+        downloaded = tile_downloader.download_tiles(
+            [tile for tile in tiles if tile not in reusable], self.cache_dir,
+            base_url=self.base_url,
+            max_workers=self.workers,
+            on_tile=on_tile,
+            on_bytes=on_bytes,
+            on_missing=not_found.add,
+        )
+        downloaded.update(reusable)
+
+        # "tif" extracts each zip, "cog" converts it once to a tiled GeoTIFF with overviews,
+        # "zip" keeps the archives and reads them through /vsizip/
+        for (x, y), local_zip in downloaded.items():
+            tif_name = self._tif(x, y).name
+            try:
+                if self.storage == "cog":
+                    print(f"Converting {local_zip.name} to a Cloud-Optimized GeoTIFF...")
+                    stored = cog_ingest.ingest_zip(local_zip, tif_name)
+                elif self.storage == "tif":
+                    print(f"Extracting {local_zip.name}...")
+                    stored = extract_tile(local_zip, tif_name)
+                    local_zip.unlink()
+                else:
+                    stored = local_zip
+            except Exception as e:
+                print(f"Exception storing {local_zip.name}: {e}")
+                continue
+            stored_files[(x, y)] = stored
+
+    def _record(self, wanted, snapshot, stored_files, not_found):
+        """Manifest entries for new files, missing tiles and the last use of everything else.
+
+        Files in `stored_files` were written by this cache; other unknown files are adopted.
+        """
+        now = time.time()
+        # Checksums are computed before taking the manifest lock
+        described = {}
+        for x, y in wanted:
+            stored = stored_files.get((x, y)) or self._stored_file(x, y)
+            if stored is None:
+                continue
+            entry = snapshot["files"].get(stored.name)
+            if (x, y) in stored_files:
+                described[stored.name] = _describe(stored, tile_downloader.tile_name(x, y), now, owned=True)
+            elif entry is None or (not entry.get("owned") and stored.stat().st_size != entry["bytes"]):
+                # Unknown, or an adopted file replaced from outside: keep its size current
+                described[stored.name] = _describe(stored, tile_downloader.tile_name(x, y), now, owned=False)
+
+        with self._manifest() as manifest:
+            files = manifest["files"]
+            for x, y in wanted:
+                name = tile_downloader.tile_name(x, y)
+                # Entries of files converted or removed since (a zip turned into a tif)
+                for file_name in (f"{name}.tif", f"{name}.zip"):
+                    if file_name in files and not (self.cache_dir / file_name).exists():
+                        del files[file_name]
+                stored = self._stored_file(x, y)
+                if stored is None:
+                    continue
+                manifest["missing"].pop(name, None)
+                if stored.name in described:
+                    files[stored.name] = described[stored.name]
+                elif stored.name in files:
+                    files[stored.name]["last_access"] = now
+            for x, y in not_found:
+                manifest["missing"][tile_downloader.tile_name(x, y)] = now
+
+    # Maintenance
+
+    def evict(self, keep=(), budget_mb=None):
+        """Delete least recently used tiles until the cache fits its budget; returns the bytes freed.
+
+        `keep` names tiles (srtm_XX_YY) that must stay, such as the ones the
+        caller is about to read. Tiles someone holds the lock of are skipped.
+        Only the tiles this cache stored count and go; adopted files stay.
+        """
+        budget = (self.budget_mb if budget_mb is None else budget_mb) * 1024 * 1024
+        freed = 0
+        with self._manifest() as manifest:
+            files = manifest["files"]
+            owned = {file_name: entry for file_name, entry in files.items() if entry.get("owned")}
+            total = sum(entry["bytes"] for entry in owned.values())
+            if total <= budget:
+                return 0
+            recent = time.time() - EVICT_GRACE_SECONDS
+            for file_name, entry in sorted(owned.items(), key=lambda item: item[1]["last_access"]):
+                if total <= budget:
+                    break
+                if entry["tile"] in keep or entry["last_access"] > recent:
+                    continue
+                lock = self._lock(entry["tile"])
+                if not lock.acquire(blocking=False):
+                    continue
+                try:
+                    (self.cache_dir / file_name).unlink(missing_ok=True)
+                except OSError as e:
+                    # Windows will not delete a file another process has open
+                    print(f"Could not evict {file_name}: {e}")
+                    continue
+                finally:
+                    lock.release()
+                print(f"Evicted tile {file_name} ({entry['bytes'] / 1024 / 1024:.1f} MB)")
+                del files[file_name]
+                total -= entry["bytes"]
+                freed += entry["bytes"]
+        return freed
+
+    def verify(self):
+        """Re-hash every tile file and adopt unknown ones. Returns (ok, removed, adopted).
+
+        Damaged tiles this cache stored are deleted, so the next fetch gets them
+        again; adopted files are only reported, and hashed the first time.
+        """
+        now = time.time()
+        ok = removed = 0
+        snapshot = self.read_manifest()
+        checked, damaged = {}, set()
+        for file_name, entry in snapshot["files"].items():
+            path = self.cache_dir / file_name
+            # Waits for a download, conversion or eviction of the tile to finish
+            with self._lock(entry["tile"]):
+                if not path.exists():
+                    continue
+                size, digest = path.stat().st_size, file_sha256(path)
+                intact = size == entry["bytes"] and entry["sha256"] in (None, digest)
+                if entry.get("owned"):
+                    if intact:
+                        ok += 1
+                        continue
+                    print(f"{file_name} does not match its checksum, removing it")
+                    path.unlink()
+                    damaged.add(file_name)
+                    removed += 1
+                    continue
+                if not intact:
+                    print(f"{file_name} changed since it was adopted; left in place, it is not this cache's")
+                else:
+                    ok += 1
+                    if entry["sha256"] is not None:
+                        continue
+                # Checksum to compare against next time
+                checked[file_name] = dict(entry, bytes=size, sha256=digest)
+
+        with self._manifest() as manifest:
+            files = manifest["files"]
+            for file_name in damaged:
+                files.pop(file_name, None)
+            files.update((name, entry) for name, entry in checked.items() if name in files)
+            _, adopted = self._rescan(manifest, now)
+        return ok, removed, adopted
+
+    def rescan(self, file_names=None):
+        """Re-describe files changed outside the cache (cog_ingest.py's migration), adopt unknown ones.
+
+        Limited to `file_names` when given. Returns (changed, adopted);
+        entries of deleted files are dropped.
+        """
+        with self._manifest() as manifest:
+            return self._rescan(manifest, time.time(), file_names)
+
+    def _rescan(self, manifest, now, file_names=None):
+        # Caller holds the manifest lock
+        files = manifest["files"]
+        # A tile the cache stored stays its own when its zip is migrated to a tif
+        owned_tiles = {entry["tile"] for entry in files.values() if entry.get("owned")}
+        if file_names is None:
+            file_names = set(files) | {path.name for path in self.cache_dir.glob("srtm_*_*.*")}
+        changed = adopted = 0
+        for file_name in sorted(file_names):
+            path = self.cache_dir / file_name
+            if not path.exists():
+                files.pop(file_name, None)
+                continue
+            if path.suffix not in (".tif", ".zip"):
+                continue
+            entry = files.get(file_name)
+            if entry is None:
+                files[file_name] = _describe(path, path.stem, now, owned=path.stem in owned_tiles)
+                adopted += 1
+            elif path.stat().st_size != entry["bytes"]:
+                files[file_name] = dict(_describe(path, path.stem, now, owned=entry.get("owned", False)),
+                                        last_access=entry["last_access"])
+                changed += 1
+        return changed, adopted
+
+    def status(self):
+        manifest = self.read_manifest()
+        files = manifest["files"]
+        return {
+            "cache_dir": str(self.cache_dir),
+            "storage": self.storage,
+            "tiles": len(files),
+            "bytes": sum(entry["bytes"] for entry in files.values()),
+            "adopted": sum(1 for entry in files.values() if not entry.get("owned")),
+            "adopted_bytes": sum(entry["bytes"] for entry in files.values() if not entry.get("owned")),
+            "budget_bytes": int(self.budget_mb * 1024 * 1024),
+            "known_missing": len(self._known_missing(manifest)),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and manage the SRTM tile cache.")
+    parser.add_argument("--config", default="config.json", help="Cache settings (tile_cache_dir, tile_storage, ...)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="Tiles, size and budget")
+    prefetch = commands.add_parser("prefetch", help="Fetch every tile of a lon/lat box")
+    for name in ("minx", "miny", "maxx", "maxy"):
+        prefetch.add_argument(name, type=float)
+    evict = commands.add_parser("evict", help="Evict down to the budget now")
+    evict.add_argument("--budget-mb", type=float, default=None)
+    commands.add_parser("verify", help="Check every checksum and adopt tiles missing from the manifest")
+    args = parser.parse_args()
+
+    import prepare_data
+    config = prepare_data.load_config(args.config) if Path(args.config).exists() else {}
+    prepare_data.configure(config)
+    cache = prepare_data.TILE_CACHE
+
+    if args.command == "prefetch":
+        paths = cache.prefetch((args.minx, args.miny, args.maxx, args.maxy))
+        print(f"{len(paths)} tiles cached for the box")
+    elif args.command == "evict":
+        freed = cache.evict(budget_mb=args.budget_mb)
+        print(f"Freed {freed / 1024 / 1024:.1f} MB")
+    elif args.command == "verify":
+        ok, removed, adopted = cache.verify()
+        print(f"{ok} tiles intact, {removed} removed, {adopted} added to the manifest")
+    status = cache.status()
+    print(f"{status['tiles']} tiles, {status['bytes'] / 1024 / 1024:.1f} of {status['budget_bytes'] / 1024 / 1024:.0f} MB "
+          f"in {status['cache_dir']} ({status['storage']}), {status['known_missing']} known missing")
+    if status["adopted"]:
+        print(f"{status['adopted']} of them ({status['adopted_bytes'] / 1024 / 1024:.1f} MB) adopted: "
+              f"used but never evicted")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import os
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+
+SRTM_BASE_URL = "https://srtm.csi.cgiar.org/wp-content/uploads/files/srtm_5x5/TIFF/"
+HEADERS = {'User-Agent': 'Mozilla/5.0'}
+
+DEFAULT_WORKERS = 8
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0  # seconds, doubled on every retry
+CHUNK_SIZE = 1024 * 1024
+TIMEOUT = (10, 60)  # (connect, read) seconds
+
+
+class TileNotFound(Exception):
+    """The server has no such tile (CGIAR does not publish pure-ocean tiles)."""
+
+
+def tile_name(x, y):
+    return f"srtm_{x:02d}_{y:02d}"
+
+
+def create_session(pool_size=DEFAULT_WORKERS):
+    """One keep-alive session shared by every download thread."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(HEADERS)
+    return session
+
+
+def _content_range_total(response):
+    # "bytes */12345" or "bytes 100-199/12345"
+    value = response.headers.get("Content-Range", "")
+    total = value.rsplit("/", 1)[-1]
+    return int(total) if total.isdigit() else None
+
+
+def download_file(session, url, target, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                  validate=None, on_bytes=None):
+    """Download `url` to `target`, resuming a previous partial download.
+
+    Bytes go to `<target>.part` and are only renamed onto `target` once the
+    transfer finished (and `validate`, if given, accepted the file), so the
+    destination never holds a truncated file.
+    """
+    target = Path(target)
+    part = target.with_name(target.name + ".part")
+
+    for attempt in range(retries + 1):
+        offset = part.stat().st_size if part.exists() else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+                if response.status_code == 404:
+                    raise TileNotFound(url)
+
+                if response.status_code == 416:
+                    # Nothing left to fetch: either the part is complete or it is junk
+                    if _content_range_total(response) != offset:
+                        part.unlink()
+                        raise requests.HTTPError(f"Invalid resume offset {offset} for {url}")
+                else:
+                    response.raise_for_status()
+                    # 206 continues the part file, a plain 200 means the server ignored the range
+                    mode = 'ab' if response.status_code == 206 else 'wb'
+                    with open(part, mode) as f:
+                        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                            f.write(chunk)
+                            if on_bytes:
+                                on_bytes(len(chunk))
+
+            if validate is not None and not validate(part):
+                part.unlink()
+                raise IOError(f"Downloaded file failed validation: {url}")
+
+            os.replace(part, target)
+            return target
+
+        except TileNotFound:
+            raise
+        except (requests.RequestException, IOError) as e:
+            if attempt == retries:
+                raise
+            delay = backoff * (2 ** attempt)
+            print(f"Retrying {url} in {delay:.1f}s ({e})")
+            time.sleep(delay)
+
+
+def download_tiles(tiles, dest_dir, base_url=SRTM_BASE_URL, max_workers=DEFAULT_WORKERS,
+                   retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, on_tile=None, on_bytes=None,
+                   on_missing=None):
+    """Fetch CGIAR tile zips concurrently into `dest_dir`.
+
+    Returns {(x, y): zip path} for the tiles that were downloaded; tiles the
+    server does not have, or that kept failing, are left out. `on_missing(tile)`
+    is called for the ones the server does not have.
+    """
+    dest_dir = Path(dest_dir)
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    if not base_url.endswith("/"):
+        base_url += "/"
+
+    results = {}
+    if not tiles:
+        return results
+
+    workers = max(1, min(max_workers, len(tiles)))
+    with create_session(pool_size=workers) as session, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for x, y in tiles:
+            zip_name = f"{tile_name(x, y)}.zip"
+            url = base_url + zip_name
+            print(f"Downloading {url}...")
+            future = pool.submit(
+                download_file, session, url, dest_dir / zip_name,
+                retries=retries, backoff=backoff, validate=zipfile.is_zipfile, on_bytes=on_bytes
+            )
+            futures[future] = (x, y)
+
+        for future in as_completed(futures):
+            x, y = futures[future]
+            try:
+                results[(x, y)] = future.result()
+                print(f"Downloaded {tile_name(x, y)}.zip")
+            except TileNotFound as e:
+                print(f"Tile not available: {e}")
+                if on_missing:
+                    on_missing((x, y))
+            except Exception as e:
+                print(f"Exception downloading {tile_name(x, y)}: {e}")
+            if on_tile:
+                on_tile((x, y), results.get((x, y)))
+
+    return results
@@ -0,0 +1,105 @@
+import os
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+import rasterio
+
+# numpy dtype name -> GDAL data type name used in VRT XML
+GDAL_TYPES = {
+    "uint8": "Byte",
+    "int8": "Int8",
+    "uint16": "UInt16",
+    "int16": "Int16",
+    "uint32": "UInt32",
+    "int32": "Int32",
+    "float32": "Float32",
+    "float64": "Float64",
+}
+
+
+def _describe(path):
+    with rasterio.open(path) as src:
+        block_h, block_w = src.block_shapes[0]
+        return {
+            "path": str(path),
+            "bounds": src.bounds,
+            "res": src.res,
+            "width": src.width,
+            "height": src.height,
+            "dtype": src.dtypes[0],
+            "nodata": src.nodata,
+            "crs": src.crs,
+            "block": (block_w, block_h),
+        }
+
+
+def build_vrt(tile_paths, vrt_path, resolution=None, resampling="bilinear"):
+    """Write a GDAL VRT mosaic over `tile_paths` and return its path.
+
+    The VRT is a few KB of XML: pixels are only read from the tiles when a
+    window of the mosaic is requested, so clipping from it costs memory in
+    proportion to the clipped area rather than the whole bounding box.
+    Like rasterio.merge, the first tile wins where tiles overlap, and the
+    mosaic takes the first tile's resolution unless `resolution` is given,
+    in which case GDAL decimates each tile with `resampling` as it reads.
+    """
+    tiles = []
+    for path in tile_paths:
+        try:
+            tiles.append(_describe(path))
+        except Exception as e:
+            print(f"Could not open {path}: {e}")
+    if not tiles:
+        raise Exception("No valid raster files to build a mosaic from.")
+
+    first = tiles[0]
+    res_x, res_y = resolution if resolution is not None else first["res"]
+    source_tag = f'ComplexSource resampling="{resampling}"' if resolution is not None else 'ComplexSource'
+    left = min(t["bounds"].left for t in tiles)
+    bottom = min(t["bounds"].bottom for t in tiles)
+    right = max(t["bounds"].right for t in tiles)
+    top = max(t["bounds"].top for t in tiles)
+    width = max(1, int(round((right - left) / res_x)))
+    height = max(1, int(round((top - bottom) / res_y)))
+
+    dtype = GDAL_TYPES[first["dtype"]]
+    nodata = first["nodata"]
+
+    lines = [
+        f'<VRTDataset rasterXSize="{width}" rasterYSize="{height}">',
+        f'  <SRS>{escape(first["crs"].to_wkt())}</SRS>' if first["crs"] else '',
+        f'  <GeoTransform>{left!r}, {res_x!r}, 0.0, {top!r}, 0.0, {-res_y!r}</GeoTransform>',
+        f'  <VRTRasterBand dataType="{dtype}" band="1">',
+    ]
+    if nodata is not None:
+        lines.append(f'    <NoDataValue>{nodata!r}</NoDataValue>')
+
+    # Later sources are painted over earlier ones, so list them in reverse to let the first tile win
+    for tile in reversed(tiles):
+        b = tile["bounds"]
+        dst_x = (b.left - left) / res_x
+        dst_y = (top - b.top) / res_y
+        dst_w = (b.right - b.left) / res_x
+        dst_h = (b.top - b.bottom) / res_y
+        block_w, block_h = tile["block"]
+        lines += [
+            f'    <{source_tag}>',
+            f'      <SourceFilename relativeToVRT="0">{escape(tile["path"])}</SourceFilename>',
+            '      <SourceBand>1</SourceBand>',
+            f'      <SourceProperties RasterXSize="{tile["width"]}" RasterYSize="{tile["height"]}" '
+            f'DataType="{GDAL_TYPES[tile["dtype"]]}" BlockXSize="{block_w}" BlockYSize="{block_h}" />',
+            f'      <SrcRect xOff="0" yOff="0" xSize="{tile["width"]}" ySize="{tile["height"]}" />',
+            f'      <DstRect xOff="{dst_x!r}" yOff="{dst_y!r}" xSize="{dst_w!r}" ySize="{dst_h!r}" />',
+        ]
+        if tile["nodata"] is not None:
+            lines.append(f'      <NODATA>{tile["nodata"]!r}</NODATA>')
+        lines.append('    </ComplexSource>')
+
+    lines += ['  </VRTRasterBand>', '</VRTDataset>']
+
+    vrt_path = Path(vrt_path)
+    tmp_path = vrt_path.with_name(vrt_path.name + f".{os.getpid()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(line for line in lines if line) + "\n")
+    os.replace(tmp_path, vrt_path)
+    return vrt_path